@@ -0,0 +1,525 @@
+"""End-to-end benchmark: upload, ingestion and study requests under load.
+
+Usage:
+    python benchmarks/e2e.py [--docs 12] [--kinds text image pdf scan] [--doc-words 2000] [--pages 8]
+                             [--requests 200] [--concurrency 8] [--mode mixed] [--stream]
+                             [--llm-latency-ms 800] [--llm-sigma 0.5] [--tokens-per-second 40]
+                             [--ocr-latency-ms 800] [--ocr-sigma 0.35] [--workers 1]
+                             [--env STUDY_BUDDY_X=value ...] [--seed 0] [--output results.json]
+
+Starts the Ollama stub (benchmarks/ollama_stub.py) and the app under
+uvicorn in a fresh data directory, with benchmarks/fake_ocr.py standing in
+for Tesseract, and waits for /ready. Then it runs two phases at the given
+concurrency:
+
+1. ingest: uploads synthetic documents (plain text, scanned images,
+   PDFs with a text layer and image-only PDFs) and polls each job until
+   it completes; latency is upload to completion.
+2. study: sends /study (or /study/stream) requests for the extracted
+   topics in learning mode, teaching mode or alternating between them.
+
+For each phase it reports throughput, latency percentiles, errors and a
+per-stage breakdown taken from the difference between /metrics scrapes
+before and after the phase. Peak RSS of the server and of its OCR
+workers is read from /proc, along with the proportional set size of the
+whole process tree, which counts pages shared between processes once.
+Results are printed (and optionally written) as JSON so runs can be
+compared; use --env to benchmark a setting, e.g.
+--env STUDY_BUDDY_VECTOR_SEARCH=ivf.
+
+With --workers above 1 the app runs as `python main.py` in multi-process
+mode instead. /metrics then only describes the worker that answers the
+scrape, so the per-stage breakdown is left out.
+
+The response cache and the question bank are off unless --response-cache
+or --question-bank is given, so every study request reaches the LLM
+path. The embedding model is real and is loaded during warm-up. PDFs
+need poppler installed; leave out pdf and scan from --kinds without it.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from PIL import Image, ImageDraw
+
+from fake_ocr import synthetic_text
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+
+PAGE_SIZE = (1700, 2200)  # Letter at 200 dpi
+METRIC_LINE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.05)
+    raise TimeoutError(f"Nothing is listening on port {port}")
+
+
+def summarise(samples: List[float]) -> Optional[Dict]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "mean": statistics.mean(ordered),
+        "max": ordered[-1]
+    }
+
+
+# Synthetic documents
+
+def wrap(text: str, width: int = 90) -> List[str]:
+    lines = []
+    for paragraph in text.split("\n\n"):
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+        lines.append("")
+    return lines
+
+
+def page_image(text: str) -> Image.Image:
+    """A scanned-looking page with the text drawn on it"""
+    image = Image.new("L", PAGE_SIZE, color=255)
+    draw = ImageDraw.Draw(image)
+    for row, line in enumerate(wrap(text)[:90]):
+        draw.text((120, 120 + row * 22), line, fill=0)
+    return image
+
+
+def text_pdf(pages: List[str]) -> bytes:
+    """A minimal PDF whose pages carry a real text layer"""
+    def escape(line: str) -> str:
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    page_ids = [4 + 2 * index for index in range(len(pages))]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(pages)} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    }
+    for page_id, text in zip(page_ids, pages):
+        lines = "\n".join(f"({escape(line)}) '" for line in wrap(text)[:60])
+        stream = f"BT /F1 10 Tf 12 TL 50 760 Td\n{lines}\nET".encode("latin-1", "replace")
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        ).encode()
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = output.tell()
+        output.write(b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for number in sorted(objects):
+        output.write(b"%010d 00000 n \n" % offsets[number])
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+def scanned_pdf(pages: List[str]) -> bytes:
+    """An image-only PDF, so every page goes through OCR"""
+    images = [page_image(text) for text in pages]
+    output = io.BytesIO()
+    images[0].save(output, format="PDF", save_all=True, append_images=images[1:], resolution=200)
+    return output.getvalue()
+
+
+def make_documents(args) -> List[Dict]:
+    """Unique documents cycling through the requested kinds"""
+    documents = []
+    for index in range(args.docs):
+        rng = random.Random(f"{args.seed}-{index}")
+        kind = args.kinds[index % len(args.kinds)]
+        if kind == "text":
+            name, data = f"notes_{index}.txt", synthetic_text(rng, args.doc_words).encode("utf-8")
+        elif kind == "image":
+            name = f"scan_{index}.png"
+            buffer = io.BytesIO()
+            page_image(synthetic_text(rng, args.doc_words // args.pages)).save(buffer, format="PNG")
+            data = buffer.getvalue()
+        else:
+            pages = [synthetic_text(rng, args.doc_words // args.pages) for _ in range(args.pages)]
+            name = f"{kind}_{index}.pdf"
+            data = text_pdf(pages) if kind == "pdf" else scanned_pdf(pages)
+        documents.append({"kind": kind, "name": name, "data": data})
+    return documents
+
+
+# Server processes and measurements
+
+def start_processes(args, data_dir: str):
+    stub_port, app_port = free_port(), free_port()
+    stub = subprocess.Popen(
+        [
+            sys.executable, os.path.join(BENCHMARKS_DIR, "ollama_stub.py"),
+            "--port", str(stub_port),
+            "--latency-ms", str(args.llm_latency_ms),
+            "--latency-sigma", str(args.llm_sigma),
+            "--tokens-per-second", str(args.tokens_per_second),
+            "--concurrency", str(args.llm_concurrency)
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    env = dict(
+        os.environ,
+        STUDY_BUDDY_DATA_DIR=data_dir,
+        STUDY_BUDDY_OLLAMA_HOSTS=f"http://127.0.0.1:{stub_port}",
+        STUDY_BUDDY_OCR_ENGINE="fake_ocr",
+        STUDY_BUDDY_FAKE_OCR_MS=str(args.ocr_latency_ms),
+        STUDY_BUDDY_FAKE_OCR_SIGMA=str(args.ocr_sigma),
+        STUDY_BUDDY_RESPONSE_CACHE="1" if args.response_cache else "0",
+        STUDY_BUDDY_QUESTION_BANK="1" if args.question_bank else "0",
+        STUDY_BUDDY_METRICS="1",
+        PYTHONPATH=os.pathsep.join(filter(None, [BENCHMARKS_DIR, os.environ.get("PYTHONPATH")]))
+    )
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        env[key] = value
+    if args.workers > 1:
+        env.update(STUDY_BUDDY_WORKERS=str(args.workers), STUDY_BUDDY_HOST="127.0.0.1", STUDY_BUDDY_PORT=str(app_port))
+        command = [sys.executable, "main.py"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                   "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(stub_port)
+    return stub, server, f"http://127.0.0.1:{app_port}"
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def descendants(pid: int) -> List[int]:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as file:
+                children.extend(int(child) for child in file.read().split())
+    except OSError:
+        return []
+    return children + [grandchild for child in children for grandchild in descendants(child)]
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water mark of a process's resident memory (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def pss_mb(pid: int) -> Optional[float]:
+    """Current proportional set size: private pages plus a share of shared ones (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def memory(pid: int) -> Dict:
+    children = descendants(pid)
+    workers = [rss for rss in (peak_rss_mb(child) for child in children) if rss is not None]
+    server = peak_rss_mb(pid)
+    pss = [value for value in (pss_mb(process) for process in [pid] + children) if value is not None]
+    return {
+        "server_peak_mb": server,
+        "workers_peak_mb": max(workers) if workers else None,
+        "total_peak_mb": (server or 0) + sum(workers) if server is not None else None,
+        "total_pss_mb": sum(pss) if pss else None
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with code {server.returncode}")
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError("The server did not become ready in time")
+
+
+async def scrape_stages(client: httpx.AsyncClient) -> Dict[str, Dict]:
+    """Stage histograms from /metrics: cumulative bucket counts, sum and count"""
+    stages: Dict[str, Dict] = {}
+    for line in (await client.get("/metrics")).text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match or not match.group(1).startswith("study_buddy_stage_seconds"):
+            continue
+        name, labels, value = match.group(1), dict(LABEL.findall(match.group(2) or "")), float(match.group(3))
+        stage = stages.setdefault(labels.get("stage", ""), {"buckets": {}, "sum": 0.0, "count": 0.0})
+        if name.endswith("_bucket"):
+            stage["buckets"][labels["le"]] = value
+        elif name.endswith("_sum"):
+            stage["sum"] = value
+        elif name.endswith("_count"):
+            stage["count"] = value
+    return stages
+
+
+def stage_breakdown(before: Dict[str, Dict], after: Dict[str, Dict]) -> List[Dict]:
+    """Per-stage time spent between two scrapes, most expensive first"""
+    empty = {"buckets": {}, "sum": 0.0, "count": 0.0}
+    rows = []
+    for stage, now in after.items():
+        then = before.get(stage, empty)
+        count = now["count"] - then["count"]
+        if count <= 0:
+            continue
+        buckets = [(float(le), cumulative - then["buckets"].get(le, 0.0)) for le, cumulative in now["buckets"].items()]
+        buckets.sort()
+
+        def quantile(fraction: float) -> float:
+            # Upper bound of the bucket the quantile falls in
+            return next((bound for bound, cumulative in buckets if cumulative >= fraction * count), float("inf"))
+
+        total = now["sum"] - then["sum"]
+        rows.append({
+            "stage": stage,
+            "count": int(count),
+            "total_seconds": total,
+            "mean_ms": total / count * 1000,
+            "p50_le_ms": quantile(0.50) * 1000,
+            "p95_le_ms": quantile(0.95) * 1000
+        })
+    return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+
+# Load phases
+
+async def with_retries(send, rejections: List[int]) -> httpx.Response:
+    """Send a request, backing off while the server answers 503"""
+    while True:
+        response = await send()
+        if response.status_code != 503 or len(rejections) > 10000:
+            return response
+        rejections.append(1)
+        await asyncio.sleep(min(float(response.headers.get("retry-after", 1)), 1.0))
+
+
+async def run_phase(concurrency: int, items: list, one) -> Dict:
+    latencies, errors, rejections = [], [], []
+    queue = list(reversed(items))
+
+    async def worker():
+        while queue:
+            item = queue.pop()
+            start = time.perf_counter()
+            try:
+                await one(item, rejections)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(str(e)[:200])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "operations": len(items),
+        "seconds": elapsed,
+        "throughput_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_seconds": summarise(latencies),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "rejected_503": len(rejections)
+    }
+
+
+async def ingest(client: httpx.AsyncClient, documents: List[Dict], concurrency: int, topics: List[str]) -> Dict:
+    async def one(document: Dict, rejections: List[int]):
+        response = await with_retries(
+            lambda: client.post("/upload", files={"file": (document["name"], document["data"])}), rejections
+        )
+        if response.status_code != 202:
+            raise RuntimeError(f"upload {response.status_code}: {response.text}")
+        status_url = response.json()["status_url"]
+        while True:
+            job = (await client.get(status_url)).json()
+            if job["status"] == "completed":
+                topics.extend(job["topics"])
+                return
+            if job["status"] == "failed":
+                raise RuntimeError(f"{document['kind']}: {job['error']}")
+            await asyncio.sleep(0.05)
+
+    result = await run_phase(concurrency, documents, one)
+    result["bytes"] = sum(len(document["data"]) for document in documents)
+    result["kinds"] = {kind: sum(1 for d in documents if d["kind"] == kind) for kind in {d["kind"] for d in documents}}
+    return result
+
+
+async def study(client: httpx.AsyncClient, topics: List[str], args) -> Dict:
+    first_bytes: List[float] = []
+    modes = ["learning", "teaching"] if args.mode == "mixed" else [args.mode]
+    requests = [
+        {"topic": topics[index % len(topics)], "mode": modes[index % len(modes)]} for index in range(args.requests)
+    ]
+
+    async def one(payload: Dict, rejections: List[int]):
+        if not args.stream:
+            response = await with_retries(lambda: client.post("/study", json=payload), rejections)
+            if response.status_code != 200 or response.json().get("status") != "success":
+                raise RuntimeError(f"study {response.status_code}: {response.text[:200]}")
+            return
+        while True:
+            start = time.perf_counter()
+            async with client.stream("POST", "/study/stream", json=payload) as response:
+                if response.status_code == 503:
+                    rejections.append(1)
+                    await asyncio.sleep(1.0)
+                    continue
+                if response.status_code != 200:
+                    raise RuntimeError(f"stream {response.status_code}")
+                first = True
+                async for line in response.aiter_lines():
+                    if first:
+                        first_bytes.append(time.perf_counter() - start)
+                        first = False
+                    if line and json.loads(line).get("event") == "error":
+                        raise RuntimeError(line[:200])
+                return
+
+    result = await run_phase(args.concurrency, requests, one)
+    if args.stream:
+        result["first_event_seconds"] = summarise(first_bytes)
+    return result
+
+
+async def drive(args, documents: List[Dict], server: subprocess.Popen, base_url: str) -> Dict:
+    timeout = httpx.Timeout(args.request_timeout)
+    limits = httpx.Limits(max_connections=args.concurrency * 2 + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        results = {"ready_seconds": await wait_ready(client, server, args.ready_timeout)}
+        topics: List[str] = []
+
+        # Each worker keeps its own metrics, so with several a scrape only sees one of them
+        breakdown = args.workers == 1
+        before = await scrape_stages(client) if breakdown else {}
+        results["ingest"] = await ingest(client, documents, args.concurrency, topics)
+        after = await scrape_stages(client) if breakdown else {}
+        results["ingest"]["stages"] = stage_breakdown(before, after) if breakdown else None
+        results["memory_after_ingest"] = memory(server.pid)
+
+        if args.requests:
+            if not topics:
+                raise RuntimeError("No topics were extracted, so there is nothing to study")
+            results["study"] = await study(client, topics, args)
+            results["study"]["stages"] = stage_breakdown(after, await scrape_stages(client)) if breakdown else None
+        results["memory"] = memory(server.pid)
+        results["topics"] = len(set(topics))
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=12, help="Documents to upload")
+    parser.add_argument("--kinds", nargs="+", default=["text", "image", "pdf", "scan"],
+                        choices=["text", "image", "pdf", "scan"], help="Document kinds, used in turn")
+    parser.add_argument("--doc-words", type=int, default=2000, help="Words per document")
+    parser.add_argument("--pages", type=int, default=8, help="Pages per PDF")
+    parser.add_argument("--requests", type=int, default=200, help="Study requests; 0 only ingests")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients sending requests at once")
+    parser.add_argument("--mode", choices=["learning", "teaching", "mixed"], default="mixed")
+    parser.add_argument("--stream", action="store_true", help="Use /study/stream")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="Median delay before the first token")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="Log-normal sigma of the LLM delay")
+    parser.add_argument("--tokens-per-second", type=float, default=40)
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Requests the stub serves at once")
+    parser.add_argument("--ocr-latency-ms", type=float, default=800, help="Median OCR time per page")
+    parser.add_argument("--ocr-sigma", type=float, default=0.35, help="Log-normal sigma of the OCR time")
+    parser.add_argument("--response-cache", action="store_true", help="Leave the response cache on")
+    parser.add_argument("--question-bank", action="store_true", help="Leave the question bank on")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Extra app settings")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--request-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    generated = time.perf_counter()
+    documents = make_documents(args)
+    generated = time.perf_counter() - generated
+
+    with tempfile.TemporaryDirectory(prefix="study-buddy-e2e-") as data_dir:
+        stub, server, base_url = start_processes(args, data_dir)
+        try:
+            results = asyncio.run(drive(args, documents, server, base_url))
+        finally:
+            stop(server)
+            stop(stub)
+
+    results["documents_generated_seconds"] = generated
+    output = {
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "settings": vars(args),
+        "results": results
+    }
+    text = json.dumps(output, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Fake OCR engine: stands in for pytesseract with realistic latency.
+
+Select it with STUDY_BUDDY_OCR_ENGINE=fake_ocr and benchmarks/ on
+PYTHONPATH (benchmarks/e2e.py does both). `image_to_string` takes a time
+drawn from a log-normal distribution, scaled by the image area relative
+to a letter page at 200 dpi, and returns synthetic text derived from the
+pixels, so identical pages always read the same. By default the time is
+spent busy on a CPU core, as Tesseract does.
+
+Settings (environment):
+    STUDY_BUDDY_FAKE_OCR_MS     median milliseconds per letter page (800)
+    STUDY_BUDDY_FAKE_OCR_SIGMA  log-normal sigma (0.35)
+    STUDY_BUDDY_FAKE_OCR_WORDS  words returned per letter page (350)
+    STUDY_BUDDY_FAKE_OCR_BUSY   0 sleeps instead of using the CPU (1)
+"""
+import hashlib
+import os
+import random
+import time
+
+LETTER_PAGE_PIXELS = 1700 * 2200
+
+TOPICS = {
+    "cell biology": (
+        "cell membrane nucleus mitochondria ribosome cytoplasm organelle protein mitosis meiosis "
+        "chromosome enzyme diffusion osmosis vesicle golgi lysosome"
+    ),
+    "thermodynamics": (
+        "energy entropy heat temperature pressure volume system equilibrium enthalpy work "
+        "engine efficiency reversible adiabatic isothermal gas"
+    ),
+    "european history": (
+        "empire revolution treaty monarchy parliament war reform republic alliance territory "
+        "industry trade colony constitution dynasty congress"
+    ),
+    "linear algebra": (
+        "matrix vector eigenvalue determinant basis dimension subspace transformation rank "
+        "orthogonal projection span kernel inverse linear scalar"
+    ),
+    "microeconomics": (
+        "demand supply price market elasticity cost revenue profit consumer producer "
+        "equilibrium monopoly competition utility surplus marginal"
+    ),
+    "organic chemistry": (
+        "carbon bond molecule reaction alkane alkene functional group isomer synthesis "
+        "catalyst acid base electron nucleophile ester"
+    ),
+}
+COMMON_WORDS = "the a of and to in is that for as with by this are which on from".split()
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    """Paragraphs of topic-flavoured sentences totalling about `words` words"""
+    vocabularies = [vocabulary.split() for vocabulary in TOPICS.values()]
+    paragraphs, written = [], 0
+    while written < words:
+        vocabulary = rng.choice(vocabularies)
+        sentences = []
+        for _ in range(rng.randint(3, 6)):
+            length = rng.randint(8, 16)
+            sentence = [rng.choice(vocabulary if rng.random() < 0.6 else COMMON_WORDS) for _ in range(length)]
+            sentences.append(" ".join(sentence).capitalize() + ".")
+            written += length
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def image_to_string(image, **kwargs) -> str:
+    """Mimic pytesseract.image_to_string"""
+    median = float(os.getenv("STUDY_BUDDY_FAKE_OCR_MS", 800)) / 1000
+    sigma = float(os.getenv("STUDY_BUDDY_FAKE_OCR_SIGMA", 0.35))
+    words = int(os.getenv("STUDY_BUDDY_FAKE_OCR_WORDS", 350))
+    busy = os.getenv("STUDY_BUDDY_FAKE_OCR_BUSY", "1") != "0"
+
+    scale = image.width * image.height / LETTER_PAGE_PIXELS
+    seed = hashlib.sha256(image.tobytes()).digest()
+    rng = random.Random(seed)
+    duration = median * scale * random.lognormvariate(0, sigma)
+
+    deadline = time.perf_counter() + duration
+    if busy:
+        while time.perf_counter() < deadline:
+            pass
+    else:
+        time.sleep(duration)
+    return synthetic_text(rng, max(1, int(words * scale)))
@@ -0,0 +1,161 @@
+"""LLM backend benchmark: throughput, balancing and failover against stub servers.
+
+Usage:
+    python benchmarks/llm_backend.py [--backends 2] [--requests 400] [--concurrency 32]
+                                     [--latency-ms 200] [--stub-concurrency 4]
+                                     [--kill-after 0] [--stream] [--output results.json]
+
+Starts --backends Ollama stub servers (benchmarks/ollama_stub.py) on
+consecutive ports and drives the app's LLMBackend against all of them at
+the given concurrency. With --kill-after N the first stub is terminated
+after N completed requests, to show requests failing over to the others.
+Reports throughput, latency percentiles, errors and how requests were
+spread over the endpoints, as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from study_buddy.core.llm_backend import LLMBackend  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(port: int, args) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable, os.path.join(REPO_ROOT, "benchmarks", "ollama_stub.py"),
+            "--port", str(port),
+            "--latency-ms", str(args.latency_ms),
+            "--jitter-ms", str(args.jitter_ms),
+            "--tokens-per-second", str(args.tokens_per_second),
+            "--concurrency", str(args.stub_concurrency)
+        ],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.05)
+    raise TimeoutError(f"Stub on port {port} did not start")
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def drive(backend: LLMBackend, args, stubs: list) -> dict:
+    latencies, errors = [], []
+    completed = 0
+    queue = asyncio.Queue()
+    for index in range(args.requests):
+        queue.put_nowait(index)
+
+    async def one():
+        if args.stream:
+            parts = await backend.generate(model="stub", prompt="Explain photosynthesis", stream=True)
+            async for _ in parts:
+                pass
+        else:
+            await backend.generate(model="stub", prompt="Explain photosynthesis")
+
+    async def worker():
+        nonlocal completed
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                await one()
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(type(e).__name__)
+            completed += 1
+            if args.kill_after and completed == args.kill_after:
+                stubs[0].terminate()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "throughput_rps": args.requests / elapsed,
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "mean": statistics.mean(latencies)
+        } if latencies else None,
+        "errors": {name: errors.count(name) for name in set(errors)},
+        "backends": backend.stats()["backends"]
+    }
+
+
+async def run(args, ports: list, stubs: list) -> dict:
+    backend = LLMBackend([f"http://127.0.0.1:{port}" for port in ports], health_interval_seconds=1)
+    await backend.start()
+    try:
+        return await drive(backend, args, stubs)
+    finally:
+        await backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--stub-concurrency", type=int, default=4, help="Requests each stub serves at once")
+    parser.add_argument("--kill-after", type=int, default=0, help="Stop the first stub after this many requests")
+    parser.add_argument("--stream", action="store_true", help="Use streaming generation")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    ports = [free_port() for _ in range(args.backends)]
+    stubs = [start_stub(port, args) for port in ports]
+    try:
+        for port in ports:
+            wait_for_port(port)
+        results = {
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "settings": vars(args),
+            "results": asyncio.run(run(args, ports, stubs))
+        }
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait(timeout=10)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
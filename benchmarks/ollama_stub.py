@@ -0,0 +1,184 @@
+"""Ollama stub server: mimics /api/generate with configurable latency.
+
+Usage:
+    python benchmarks/ollama_stub.py [--port 11434] [--latency-ms 200] [--jitter-ms 50] [--latency-sigma 0]
+                                     [--tokens-per-second 50] [--error-rate 0.0] [--concurrency 0]
+
+Answers /api/generate (streaming and not) with JSON shaped like the
+responses Study Buddy asks for, so the app can be load-tested without a
+GPU or a model. Latency is a fixed delay (plus uniform jitter) before the
+first token, then one token every 1/tokens-per-second. With
+--latency-sigma the delay is instead drawn from a log-normal distribution
+with --latency-ms as its median, giving the long tail of a real model
+server. --concurrency
+caps requests served at once, like a single Ollama runner does; 0 means
+unlimited. --error-rate makes that share of requests fail with a 500.
+Final responses carry Ollama's timing and token count fields, so the
+app's prefill and generation metrics are populated too.
+
+Point the app at one or more stubs with STUDY_BUDDY_OLLAMA_HOSTS, for
+example two stubs on ports 11434 and 11435 to exercise load balancing,
+then stop one to exercise failover.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LEARNING_RESPONSE = {
+    "explanation": "This is a stub explanation of the topic.",
+    "questions": [
+        {
+            "type": "multiple_choice",
+            "question": "Which option is correct?",
+            "options": ["A) The first", "B) The second", "C) The third"],
+            "correct_answer": "B) The second",
+            "explanation": "The stub always picks the second option."
+        },
+        {
+            "type": "true_false",
+            "question": "The stub server is fast.",
+            "correct_answer": "True",
+            "explanation": "Its latency is configurable."
+        },
+        {
+            "type": "short_answer",
+            "question": "Describe the topic in one sentence.",
+            "correct_answer": "A one-sentence description.",
+            "explanation": "Any reasonable sentence is accepted."
+        }
+    ],
+    "active_recall_prompt": "Recall the three key points of the topic.",
+    "difficulty_level": "beginner"
+}
+
+TEACHING_RESPONSE = {
+    "missing_concepts": ["A stub concept"],
+    "gaps": ["A stub gap"],
+    "feedback": "Stub feedback on the explanation.",
+    "suggested_readings": ["Section 1"],
+    "rating": "good",
+    "badges": ["Clear Communicator"]
+}
+
+
+def build_app(latency: float, jitter: float, tokens_per_second: float, error_rate: float,
+              concurrency: int, latency_sigma: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Ollama stub")
+    app.state.requests = 0
+    gate = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+
+    def response_text(prompt: str) -> str:
+        if "Evaluate each of the following answers" in prompt:
+            count = len(re.findall(r"^\[\d+\]$", prompt, flags=re.MULTILINE))
+            return json.dumps({"verdicts": [
+                {"index": index, "is_correct": True, "feedback": "Stub verdict.", "suggested_improvements": []}
+                for index in range(count)
+            ]})
+        if prompt.startswith("Evaluate"):
+            return json.dumps({"is_correct": True, "feedback": "Stub verdict.", "suggested_improvements": []})
+        if "evaluating a student's explanation" in prompt:
+            return json.dumps(TEACHING_RESPONSE)
+        return json.dumps(LEARNING_RESPONSE)
+
+    def tokens(text: str) -> list:
+        return re.findall(r"\S+\s*|\s+", text)
+
+    @app.get("/")
+    async def root():
+        return "Ollama is running"
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": "stub"}]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        if random.random() < error_rate:
+            return JSONResponse(status_code=500, content={"error": "stub failure"})
+        if not body.get("prompt"):
+            # An empty prompt only loads the model
+            return {"model": body.get("model"), "response": "", "done": True}
+
+        text = response_text(body["prompt"])
+        parts = tokens(text)
+        if latency_sigma > 0:
+            delay = latency * random.lognormvariate(0, latency_sigma)
+        else:
+            delay = latency + random.uniform(0, jitter)
+        interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+
+        async def run():
+            if gate is not None:
+                await gate.acquire()
+            try:
+                start = time.perf_counter()
+                await asyncio.sleep(delay)
+                first_token = time.perf_counter()
+                for part in parts:
+                    yield part
+                    if interval:
+                        await asyncio.sleep(interval)
+                end = time.perf_counter()
+                yield usage(first_token - start, end - first_token, end - start)
+            finally:
+                if gate is not None:
+                    gate.release()
+
+        def usage(prefill: float, generation: float, total: float) -> dict:
+            # Timing fields as Ollama reports them, in nanoseconds
+            return {
+                "total_duration": int(total * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": len(body["prompt"]) // 4,
+                "prompt_eval_duration": int(prefill * 1e9),
+                "eval_count": len(parts),
+                "eval_duration": int(generation * 1e9)
+            }
+
+        if body.get("stream", True):
+            async def stream():
+                async for item in run():
+                    if isinstance(item, dict):
+                        yield json.dumps(dict(item, model=body["model"], response="", done=True)) + "\n"
+                    else:
+                        yield json.dumps({"model": body["model"], "response": item, "done": False}) + "\n"
+            return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+        result = {}
+        async for item in run():
+            if isinstance(item, dict):
+                result = item
+        return dict(result, model=body["model"], response=text, done=True)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency-ms", type=float, default=200, help="Delay before the first token")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="Uniform random extra delay")
+    parser.add_argument("--latency-sigma", type=float, default=0.0,
+                        help="Draw the delay from a log-normal with this sigma instead (0 uses jitter)")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="0 sends all tokens at once")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument("--concurrency", type=int, default=0, help="Requests served at once; 0 is unlimited")
+    args = parser.parse_args()
+
+    app = build_app(args.latency_ms / 1000, args.jitter_ms / 1000, args.tokens_per_second,
+                    args.error_rate, args.concurrency, args.latency_sigma)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
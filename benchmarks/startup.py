@@ -0,0 +1,117 @@
+"""Startup benchmark: import time, time to ready and first-request latency.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--port 8765] [--skip-study] [--output results.json]
+
+Import time is measured in fresh interpreters. Time to ready and
+first-request latency are measured against a uvicorn server started in a
+subprocess, so the numbers include model loading and warm-up exactly as a
+deployment sees them. Results are printed (and optionally written) as JSON
+so runs can be compared over time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(runs: int) -> dict:
+    """Seconds taken by `import main` in a fresh interpreter"""
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    return summarise(samples)
+
+
+def request(url: str, payload: dict = None, timeout: float = 600) -> tuple:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def measure_server(port: int, skip_study: bool, ready_timeout: float) -> dict:
+    """Time from process start to listening, to ready, and first/second request latency"""
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {}
+    try:
+        while "listening_seconds" not in result or "ready_seconds" not in result:
+            if time.perf_counter() - start > ready_timeout:
+                raise TimeoutError("Server did not become ready in time")
+            try:
+                status, body = request(f"{base}/ready", timeout=5)
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+                continue
+            result.setdefault("listening_seconds", time.perf_counter() - start)
+            if status == 200:
+                result["ready_seconds"] = time.perf_counter() - start
+                result["warm_up"] = json.loads(body)
+            else:
+                time.sleep(0.05)
+
+        if not skip_study:
+            payload = {"topic": "photosynthesis", "mode": "learning", "context": "Plants convert light to energy."}
+            for label in ("first_request_seconds", "second_request_seconds"):
+                request_start = time.perf_counter()
+                status, _ = request(f"{base}/study", payload)
+                result[label] = time.perf_counter() - request_start
+                result[label.replace("seconds", "status")] = status
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return result
+
+
+def summarise(samples: list) -> dict:
+    return {
+        "runs": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters used for the import benchmark")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--skip-study", action="store_true", help="Do not send /study requests (no Ollama needed)")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "import_main_seconds": measure_import(args.runs),
+        "server": measure_server(args.port, args.skip_study, args.ready_timeout)
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Topic extraction benchmark: cost per chunk as uploads grow.
+
+Usage:
+    python benchmarks/topic_extraction.py [--sizes 1000 4000 16000 64000] [--dim 384] [--repeats 3]
+                                          [--baseline-max 16000] [--output results.json]
+
+Chunk embeddings are synthetic: unit vectors drawn around a few dozen
+random directions, which is roughly how sentence embeddings of a textbook
+cluster. For each size the current TopicExtractor and a TopicMap update
+are timed, alongside the previous implementation (full-batch KMeans plus
+per-chunk distance loops) up to --baseline-max chunks. Near-linear
+scaling shows up as a flat `seconds_per_1k_chunks` column.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from study_buddy.core.topic_extractor import TopicExtractor, TopicMap  # noqa: E402
+
+
+def synthetic_corpus(n_chunks: int, dim: int, n_directions: int = 40, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(n_directions, dim))
+    embeddings = directions[rng.integers(0, n_directions, n_chunks)] + 0.6 * rng.normal(size=(n_chunks, dim))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    chunks = [f"chunk {i}" for i in range(n_chunks)]
+    return chunks, embeddings.astype(np.float32)
+
+
+def baseline_extract(chunks: list, embeddings: np.ndarray) -> list:
+    """The implementation TopicExtractor replaced"""
+    from sklearn.cluster import KMeans
+    n_clusters = min(5, len(chunks))
+    kmeans = KMeans(n_clusters=n_clusters, n_init=10)
+    clusters = kmeans.fit_predict(embeddings)
+    topics = []
+    for i in range(n_clusters):
+        cluster_chunks = [chunks[j] for j in range(len(chunks)) if clusters[j] == i]
+        center = kmeans.cluster_centers_[i]
+        distances = [np.linalg.norm(embeddings[j] - center) for j in range(len(chunks)) if clusters[j] == i]
+        topics.append(cluster_chunks[np.argmin(distances)][:100])
+    return topics
+
+
+def time_call(fn, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000, 64000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--baseline-max", type=int, default=16000, help="Largest size the old implementation is run on")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    extractor = TopicExtractor()
+    # Pay scikit-learn's import and first-call costs before timing anything
+    extractor.extract(*synthetic_corpus(100, args.dim))
+    baseline_extract(*synthetic_corpus(100, args.dim))
+    rows = []
+    for size in args.sizes:
+        chunks, embeddings = synthetic_corpus(size, args.dim)
+        extract_seconds = time_call(lambda: extractor.extract(chunks, embeddings), args.repeats)
+        map_seconds = time_call(lambda: TopicMap().update(chunks, embeddings), args.repeats)
+        row = {
+            "chunks": size,
+            "extract_seconds": extract_seconds,
+            "seconds_per_1k_chunks": extract_seconds / size * 1000,
+            "topic_map_update_seconds": map_seconds
+        }
+        if size <= args.baseline_max:
+            baseline_seconds = time_call(lambda: baseline_extract(chunks, embeddings), args.repeats)
+            row["baseline_seconds"] = baseline_seconds
+            row["baseline_seconds_per_1k_chunks"] = baseline_seconds / size * 1000
+            row["speedup"] = baseline_seconds / extract_seconds
+        rows.append(row)
+        print(json.dumps(row), file=sys.stderr)
+
+    results = {
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "dim": args.dim,
+        "sample_size": extractor.sample_size,
+        "results": rows
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import json
+import os
+import uuid
 import uvicorn
 from study_buddy.core.llm_manager import LLMManager
 from study_buddy.core.document_processor import DocumentProcessor
 from study_buddy.core.learning_mode import LearningMode
 from study_buddy.core.teaching_mode import TeachingMode
+from study_buddy.core.executor import ServiceOverloadedError, get_io_pool, shutdown_pools
+from study_buddy.core.jobs import IngestionQueue, JobStore
+from study_buddy.core.question_bank import QuestionBank
+from study_buddy.core.progress_store import DEFAULT_USER, ProgressStore
+from study_buddy.core.warmup import WarmUp
+from study_buddy.core import config, metrics
 
 app = FastAPI(title="LLM Study Buddy", description="Personalized Learning & Active Recall System")
 
@@ -20,20 +30,120 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize core components
-llm_manager = LLMManager()
-document_processor = DocumentProcessor()
-learning_mode = LearningMode(llm_manager, document_processor)
-teaching_mode = TeachingMode(llm_manager, document_processor)
+# Per-route latency and the Server-Timing header; added last so it also times CORS handling
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Core components are built at startup rather than import time; heavy models
+# are loaded by the warm-up task or on first use
+llm_manager: Optional[LLMManager] = None
+document_processor: Optional[DocumentProcessor] = None
+question_bank: Optional[QuestionBank] = None
+progress_store: Optional[ProgressStore] = None
+learning_mode: Optional[LearningMode] = None
+teaching_mode: Optional[TeachingMode] = None
+ingestion_queue: Optional[IngestionQueue] = None
+warm_up: Optional[WarmUp] = None
+upload_dir = os.path.join(config.DATA_DIR, "uploads")
+
+def init_components():
+    """Construct the core components"""
+    global llm_manager, document_processor, question_bank, progress_store, learning_mode, teaching_mode
+    global ingestion_queue, warm_up
+    llm_manager = LLMManager()
+    document_processor = DocumentProcessor()
+    question_bank = QuestionBank(
+        os.path.join(config.DATA_DIR, "question_bank.sqlite3"), llm_manager, document_processor
+    ) if config.QUESTION_BANK_ENABLED else None
+    progress_store = ProgressStore(os.path.join(config.DATA_DIR, "progress.sqlite3"))
+    learning_mode = LearningMode(llm_manager, document_processor, question_bank, progress_store)
+    teaching_mode = TeachingMode(llm_manager, document_processor, progress_store)
+    # Status requests may reach a different worker than the upload did
+    job_store = JobStore(os.path.join(config.DATA_DIR, "jobs.sqlite3")) if config.WORKERS > 1 else None
+    ingestion_queue = IngestionQueue(document_processor, store=job_store)
+    if question_bank is not None:
+        def bank_document(job):
+            # Banked content is served to anyone asking for the topic, so only shared documents are banked
+            if job.user_id == DEFAULT_USER:
+                question_bank.schedule_document(job.document_id, job.topics)
+        ingestion_queue.on_complete.append(bank_document)
+    warm_up = WarmUp(document_processor, llm_manager)
+
+@app.exception_handler(ServiceOverloadedError)
+async def overloaded_handler(request: Request, exc: ServiceOverloadedError):
+    """Tell clients to back off when a worker pool is saturated"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.on_event("startup")
+async def startup():
+    """Build components, start background workers and begin warm-up"""
+    init_components()
+    os.makedirs(upload_dir, exist_ok=True)
+    await llm_manager.client.start()
+    await ingestion_queue.start()
+    if question_bank is not None:
+        await question_bank.start()
+    await progress_store.start()
+    if warm_up.enabled:
+        app.state.warm_up_task = asyncio.create_task(warm_up.run())
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop background workers and worker pools"""
+    warm_up_task = getattr(app.state, "warm_up_task", None)
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await ingestion_queue.stop()
+    if question_bank is not None:
+        await question_bank.stop()
+    await document_processor.embedding_service.stop()
+    await progress_store.stop()
+    if llm_manager.response_cache is not None:
+        llm_manager.response_cache.save()
+    await llm_manager.client.close()
+    shutdown_pools()
 
 class StudyRequest(BaseModel):
     topic: str
     mode: str  # "learning" or "teaching"
     context: Optional[str] = None
+    user_id: str = DEFAULT_USER
+    document_id: Optional[str] = None  # search only this uploaded document
+    topic_filter: Optional[str] = None  # search only chunks of this extracted topic
+
+class AnswerSubmission(BaseModel):
+    question: Dict
+    user_answer: str
+
+class EvaluateRequest(BaseModel):
+    topic: str
+    answers: List[AnswerSubmission]
+    user_id: str = DEFAULT_USER
 
 class UploadResponse(BaseModel):
     message: str
+    job_id: str
+    status_url: str
+
+class JobStatus(BaseModel):
+    job_id: str
+    filename: str
+    size: int
+    user_id: str
+    status: str
+    stage: str
+    pages_done: int
+    pages_total: Optional[int] = None
+    document_id: Optional[str] = None
     topics: List[str]
+    cached: bool
+    error: Optional[str] = None
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -60,7 +170,17 @@ async def root():
                 
                 <div class="endpoint">
                     <p><span class="method">POST</span> <span class="url">/upload</span></p>
-                    <p class="description">Upload study notes for processing. Accepts PDF, images (PNG, JPG), and text files.</p>
+                    <p class="description">Upload study notes for background processing. Accepts PDF, images (PNG, JPG), and text files. Returns a job ID.</p>
+                </div>
+
+                <div class="endpoint">
+                    <p><span class="method">GET</span> <span class="url">/jobs/{job_id}</span></p>
+                    <p class="description">Check the progress of an upload and get its extracted topics once processing completes.</p>
+                </div>
+
+                <div class="endpoint">
+                    <p><span class="method">GET</span> <span class="url">/topics</span></p>
+                    <p class="description">List the main topics across all uploaded notes.</p>
                 </div>
 
                 <div class="endpoint">
@@ -68,6 +188,26 @@ async def root():
                     <p class="description">Handle study requests in either learning or teaching mode.</p>
                 </div>
 
+                <div class="endpoint">
+                    <p><span class="method">POST</span> <span class="url">/study/stream</span></p>
+                    <p class="description">Stream a study response as NDJSON (or server-sent events with Accept: text/event-stream).</p>
+                </div>
+
+                <div class="endpoint">
+                    <p><span class="method">POST</span> <span class="url">/evaluate</span></p>
+                    <p class="description">Grade a list of answers to generated questions in one request.</p>
+                </div>
+
+                <div class="endpoint">
+                    <p><span class="method">GET</span> <span class="url">/progress/{user_id}</span></p>
+                    <p class="description">Progress, difficulty level and badges of every topic a user has studied.</p>
+                </div>
+
+                <div class="endpoint">
+                    <p><span class="method">GET</span> <span class="url">/metrics</span></p>
+                    <p class="description">Per-stage latency histograms, request counts and queue depths for Prometheus.</p>
+                </div>
+
                 <div class="endpoint">
                     <p><span class="method">GET</span> <span class="url">/docs</span></p>
                     <p class="description">Interactive API documentation (Swagger UI)</p>
@@ -77,38 +217,173 @@ async def root():
             <h2>Quick Start:</h2>
             <ol>
                 <li>Visit <a href="/docs">/docs</a> for interactive API documentation</li>
-                <li>Use the /upload endpoint to upload your study notes</li>
+                <li>Use the /upload endpoint to upload your study notes, then poll /jobs/{job_id} for the topics</li>
                 <li>Use the /study endpoint to start learning or teaching sessions</li>
             </ol>
         </body>
     </html>
     """
 
-@app.post("/upload", response_model=UploadResponse)
-async def upload_notes(file: UploadFile = File(...)):
-    """Upload study notes for processing"""
+@app.post("/upload", response_model=UploadResponse, status_code=202)
+async def upload_notes(file: UploadFile = File(...), user_id: str = Form(DEFAULT_USER)):
+    """Accept study notes and queue them for background processing"""
     try:
-        topics = await document_processor.process_document(file)
+        filename = os.path.basename(file.filename or "upload")
+        path = os.path.join(upload_dir, f"{uuid.uuid4().hex}_{filename}")
+        try:
+            size = await save_upload(file, path)
+            job = await ingestion_queue.submit(path, filename, size, user_id)
+        except BaseException:
+            # Rejected or interrupted uploads must not leave partial files behind
+            if os.path.exists(path):
+                os.remove(path)
+            raise
         return UploadResponse(
-            message="Document processed successfully",
-            topics=topics
+            message="Document accepted for processing",
+            job_id=job.id,
+            status_url=f"/jobs/{job.id}"
         )
+    except ServiceOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def save_upload(file: UploadFile, path: str) -> int:
+    """Stream an uploaded file to disk in chunks and return its size"""
+    io_pool = get_io_pool()
+    size = 0
+    with open(path, "wb") as buffer:
+        while True:
+            chunk = await file.read(config.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            await io_pool.run(buffer.write, chunk)
+            size += len(chunk)
+    return size
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def job_status(job_id: str):
+    """Report the stage, page progress and topics of an ingestion job"""
+    job = await ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatus(**job.to_dict())
+
+@app.get("/topics")
+async def topics(limit: int = 20):
+    """Corpus-wide topics across all uploaded notes, largest first"""
+    return {"topics": document_processor.topic_map.topics(limit)}
+
+@app.get("/progress/{user_id}")
+async def user_progress(user_id: str):
+    """Progress and badges of every topic a user has studied"""
+    return {"user_id": user_id, "topics": await get_io_pool().run(progress_store.user_progress, user_id)}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once warm-up has finished, 503 before"""
+    status = warm_up.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit, miss and eviction counters of the LLM response cache"""
+    if llm_manager.response_cache is None:
+        return {"enabled": False}
+    return dict(llm_manager.response_cache.stats(), enabled=True)
+
+@app.get("/llm/backends")
+async def llm_backends():
+    """Health, circuit state and load of each Ollama endpoint"""
+    return llm_manager.client.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latencies, request counts and queue depths in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/embeddings/stats")
+async def embedding_stats():
+    """Queue depth and batch sizes of the embedding micro-batcher"""
+    return document_processor.embedding_service.stats()
+
 @app.post("/study")
 async def study(request: StudyRequest):
     """Handle study requests in either learning or teaching mode"""
     try:
         if request.mode == "learning":
-            response = await learning_mode.handle_request(request.topic, request.context)
+            response = await learning_mode.handle_request(
+                request.topic, request.context, request.user_id, request.document_id, request.topic_filter
+            )
         elif request.mode == "teaching":
-            response = await teaching_mode.handle_request(request.topic, request.context)
+            response = await teaching_mode.handle_request(
+                request.topic, request.context, request.user_id, request.document_id, request.topic_filter
+            )
         else:
             raise HTTPException(status_code=400, detail="Invalid mode specified")
         return response
+    except (HTTPException, ServiceOverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/evaluate")
+async def evaluate(request: EvaluateRequest):
+    """Grade a list of answers; closed-form answers never reach the LLM"""
+    try:
+        answers = [answer.model_dump() for answer in request.answers]
+        return await learning_mode.evaluate_answers(request.topic, answers, request.user_id)
+    except ServiceOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/study/stream")
+async def study_stream(request: StudyRequest, http_request: Request):
+    """Stream a study response as NDJSON, or as server-sent events when requested"""
+    if request.mode == "learning":
+        events = learning_mode.stream_request(
+            request.topic, request.context, request.user_id, request.document_id, request.topic_filter
+        )
+    elif request.mode == "teaching":
+        events = teaching_mode.stream_request(
+            request.topic, request.context, request.user_id, request.document_id, request.topic_filter
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Invalid mode specified")
+
+    # Wait for the first event so overload and setup errors still produce a
+    # proper status code instead of a broken stream
+    try:
+        first = await events.__anext__()
+    except (HTTPException, ServiceOverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    use_sse = "text/event-stream" in http_request.headers.get("accept", "")
+    return StreamingResponse(
+        encode_events(first, events, use_sse),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson"
+    )
+
+async def encode_events(first: Dict, events: AsyncIterator[Dict], use_sse: bool) -> AsyncIterator[str]:
+    """Serialise stream events as SSE frames or NDJSON lines"""
+    def encode(event: Dict) -> str:
+        if use_sse:
+            return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        return json.dumps(event) + "\n"
+
+    yield encode(first)
+    try:
+        async for event in events:
+            yield encode(event)
+    except Exception as e:
+        yield encode({"event": "error", "message": str(e)})
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True) 
\ No newline at end of file
+    if config.WORKERS > 1:
+        from study_buddy.core.server import serve
+        serve("main:app")
+    else:
+        uvicorn.run("main:app", host=config.HOST, port=config.PORT, reload=True)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import os
+
+
+def _int_env(name: str, default: int) -> int:
+    """Read an integer setting from the environment"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    """Read a float setting from the environment"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+CPU_COUNT = os.cpu_count() or 2
+
+# Local state (embedding cache, document registry, vector index)
+DATA_DIR = os.getenv("STUDY_BUDDY_DATA_DIR", "data")
+
+# Serving: one worker runs with auto-reload for development. With several,
+# the embedding model is loaded once and the workers are forked from that
+# process, sharing its memory, one listening socket and the on-disk index.
+HOST = os.getenv("STUDY_BUDDY_HOST", "127.0.0.1")
+PORT = _int_env("STUDY_BUDDY_PORT", 8000)
+WORKERS = max(1, _int_env("STUDY_BUDDY_WORKERS", 1))
+WORKER_THREADS = _int_env("STUDY_BUDDY_WORKER_THREADS", max(1, CPU_COUNT // WORKERS))  # Torch threads per worker
+
+# Ollama
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = os.getenv("STUDY_BUDDY_OLLAMA_KEEP_ALIVE", "30m")
+# Several endpoints can be given, comma separated; requests go to the one
+# with the fewest outstanding requests and fail over between them.
+OLLAMA_HOSTS = [
+    host.strip() for host in os.getenv("STUDY_BUDDY_OLLAMA_HOSTS", OLLAMA_HOST).split(",") if host.strip()
+]
+LLM_TIMEOUT_SECONDS = _float_env("STUDY_BUDDY_LLM_TIMEOUT", 300)
+LLM_CONNECT_TIMEOUT_SECONDS = _float_env("STUDY_BUDDY_LLM_CONNECT_TIMEOUT", 5)
+LLM_RETRIES = _int_env("STUDY_BUDDY_LLM_RETRIES", 2)
+LLM_POOL_SIZE = _int_env("STUDY_BUDDY_LLM_POOL_SIZE", 16)  # Connections per endpoint
+LLM_HEALTH_INTERVAL_SECONDS = _float_env("STUDY_BUDDY_LLM_HEALTH_INTERVAL", 10)
+LLM_BREAKER_FAILURES = _int_env("STUDY_BUDDY_LLM_BREAKER_FAILURES", 3)
+LLM_BREAKER_RESET_SECONDS = _float_env("STUDY_BUDDY_LLM_BREAKER_RESET", 30)
+
+# Prompt context: retrieved notes are packed into whatever the context window
+# leaves after the prompt template and the tokens reserved for the response.
+CONTEXT_WINDOW = _int_env("STUDY_BUDDY_CONTEXT_WINDOW", 4096)
+RESPONSE_TOKENS = _int_env("STUDY_BUDDY_RESPONSE_TOKENS", 1024)
+CONTEXT_TOKEN_BUDGET = _int_env("STUDY_BUDDY_CONTEXT_TOKEN_BUDGET", 0)  # 0 derives it from the window
+CONTEXT_CANDIDATES = _int_env("STUDY_BUDDY_CONTEXT_CANDIDATES", 20)
+CONTEXT_MMR_LAMBDA = _float_env("STUDY_BUDDY_CONTEXT_MMR_LAMBDA", 0.7)
+TOKENIZER = os.getenv("STUDY_BUDDY_TOKENIZER", "")  # Hugging Face tokenizer; empty uses an estimate
+
+# Execution layer: OCR runs in a process pool, embeddings and vector storage
+# in a thread pool, LLM calls on the event loop through the async client.
+OCR_WORKERS = _int_env("STUDY_BUDDY_OCR_WORKERS", max(1, (CPU_COUNT - 1) // WORKERS))  # Per server worker
+OCR_QUEUE_SIZE = _int_env("STUDY_BUDDY_OCR_QUEUE_SIZE", OCR_WORKERS * 4)
+IO_WORKERS = _int_env("STUDY_BUDDY_IO_WORKERS", 4)
+IO_QUEUE_SIZE = _int_env("STUDY_BUDDY_IO_QUEUE_SIZE", 64)
+LLM_CONCURRENCY = _int_env("STUDY_BUDDY_LLM_CONCURRENCY", 4)
+LLM_QUEUE_SIZE = _int_env("STUDY_BUDDY_LLM_QUEUE_SIZE", 32)
+RETRY_AFTER_SECONDS = _int_env("STUDY_BUDDY_RETRY_AFTER", 5)
+
+# PDF extraction: pages are rendered and OCR'd in small batches, and pages
+# that already carry a text layer skip rasterisation entirely.
+PDF_BATCH_PAGES = _int_env("STUDY_BUDDY_PDF_BATCH_PAGES", 4)
+PDF_BATCHES_IN_FLIGHT = _int_env("STUDY_BUDDY_PDF_BATCHES_IN_FLIGHT", OCR_WORKERS + 1)
+PDF_DPI = _int_env("STUDY_BUDDY_PDF_DPI", 200)
+PDF_TEXT_LAYER_MIN_CHARS = _int_env("STUDY_BUDDY_PDF_TEXT_LAYER_MIN_CHARS", 25)
+# Module providing image_to_string(image), e.g. a fake engine for benchmarks
+OCR_ENGINE = os.getenv("STUDY_BUDDY_OCR_ENGINE", "pytesseract")
+
+# Embeddings
+EMBEDDING_MODEL = os.getenv("STUDY_BUDDY_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_CACHE_MAX_MB = _int_env("STUDY_BUDDY_EMBEDDING_CACHE_MAX_MB", 512)
+# Concurrent encode requests are batched: queries wait up to the window for
+# others to join, up to the batch size; document chunks go in full batches.
+EMBED_BATCH_WINDOW_MS = _float_env("STUDY_BUDDY_EMBED_BATCH_WINDOW_MS", 5)
+EMBED_BATCH_MAX = _int_env("STUDY_BUDDY_EMBED_BATCH_MAX", 64)
+
+# Vector index: a memory-mapped float32 or float16 matrix searched exactly
+# ("brute") or through an inverted-file index ("ivf") once it is large enough.
+VECTOR_DTYPE = os.getenv("STUDY_BUDDY_VECTOR_DTYPE", "float32")
+VECTOR_SEARCH = os.getenv("STUDY_BUDDY_VECTOR_SEARCH", "brute")
+VECTOR_IVF_MIN_ROWS = _int_env("STUDY_BUDDY_VECTOR_IVF_MIN_ROWS", 10000)
+VECTOR_IVF_NPROBE = _int_env("STUDY_BUDDY_VECTOR_IVF_NPROBE", 8)
+
+# Hybrid retrieval: BM25 keyword matches are fused with the vector search
+# results by reciprocal rank fusion, scoring each chunk 1 / (RRF_K + rank).
+HYBRID_SEARCH = os.getenv("STUDY_BUDDY_HYBRID_SEARCH", "1") != "0"
+RRF_K = _int_env("STUDY_BUDDY_RRF_K", 60)
+
+# Topic extraction: per-document topics are clustered from a bounded sample
+# of chunks; the corpus-wide topic map is updated with every new chunk.
+TOPIC_MAX_TOPICS = _int_env("STUDY_BUDDY_TOPIC_MAX_TOPICS", 5)
+TOPIC_SAMPLE_SIZE = _int_env("STUDY_BUDDY_TOPIC_SAMPLE_SIZE", 2048)
+TOPIC_MAP_SIZE = _int_env("STUDY_BUDDY_TOPIC_MAP_SIZE", 50)
+
+# Background ingestion
+INGEST_WORKERS = _int_env("STUDY_BUDDY_INGEST_WORKERS", 2)
+INGEST_QUEUE_SIZE = _int_env("STUDY_BUDDY_INGEST_QUEUE_SIZE", 100)
+INGEST_AGING_SECONDS = _float_env("STUDY_BUDDY_INGEST_AGING_SECONDS", 30.0)
+INGEST_RETRY_MAX_SECONDS = _float_env("STUDY_BUDDY_INGEST_RETRY_MAX_SECONDS", 60.0)  # Backoff cap when pools are full
+JOB_RETENTION = _int_env("STUDY_BUDDY_JOB_RETENTION", 1000)
+JOB_SAVE_SECONDS = _float_env("STUDY_BUDDY_JOB_SAVE_SECONDS", 0.5)  # Stage and page progress, multi-worker
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# LLM response cache
+RESPONSE_CACHE_ENABLED = os.getenv("STUDY_BUDDY_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_MAX_ENTRIES = _int_env("STUDY_BUDDY_RESPONSE_CACHE_MAX_ENTRIES", 1000)
+RESPONSE_CACHE_MAX_MB = _int_env("STUDY_BUDDY_RESPONSE_CACHE_MAX_MB", 64)
+RESPONSE_CACHE_TTL_SECONDS = _float_env("STUDY_BUDDY_RESPONSE_CACHE_TTL_SECONDS", 24 * 3600)
+RESPONSE_CACHE_SIMILARITY = _float_env("STUDY_BUDDY_RESPONSE_CACHE_SIMILARITY", 0.95)
+RESPONSE_CACHE_PATH = os.getenv("STUDY_BUDDY_RESPONSE_CACHE_PATH", "")
+
+# Question bank
+QUESTION_BANK_ENABLED = os.getenv("STUDY_BUDDY_QUESTION_BANK", "1") != "0"
+QUESTION_BANK_DEPTH = _int_env("STUDY_BUDDY_QUESTION_BANK_DEPTH", 2)
+
+# Learner progress: records are cached per user and topic (LRU, write-back)
+# and flushed to SQLite in batches as atomic increments, so several server
+# processes can share the database.
+PROGRESS_CACHE_ENTRIES = _int_env("STUDY_BUDDY_PROGRESS_CACHE_ENTRIES", 10000)
+PROGRESS_FLUSH_SECONDS = _float_env("STUDY_BUDDY_PROGRESS_FLUSH_SECONDS", 1.0)
+PROGRESS_FLUSH_BATCH = _int_env("STUDY_BUDDY_PROGRESS_FLUSH_BATCH", 256)
+PROGRESS_REFRESH_SECONDS = _float_env("STUDY_BUDDY_PROGRESS_REFRESH_SECONDS", 5.0)
+
+# Startup warm-up
+WARMUP_ENABLED = os.getenv("STUDY_BUDDY_WARMUP", "1") != "0"
+WARMUP_LLM = os.getenv("STUDY_BUDDY_WARMUP_LLM", "1") != "0"
+
+# Metrics: per-stage latency histograms served on /metrics. The per-request
+# stage breakdown goes into a Server-Timing response header when
+# STUDY_BUDDY_SERVER_TIMING is on or the request sends an X-Server-Timing header.
+METRICS_ENABLED = os.getenv("STUDY_BUDDY_METRICS", "1") != "0"
+SERVER_TIMING = os.getenv("STUDY_BUDDY_SERVER_TIMING", "0") != "0"
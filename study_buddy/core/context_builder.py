@@ -0,0 +1,217 @@
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import config
+
+_WORD_OR_SYMBOL = re.compile(r"\w+|[^\w\s]")
+
+
+class TokenCounter:
+    """Counts prompt tokens for the target model.
+
+    Uses a Hugging Face tokenizer when `STUDY_BUDDY_TOKENIZER` names one
+    (for example a Llama tokenizer matching the Ollama model); otherwise it
+    falls back to a word-and-punctuation estimate scaled for sub-word
+    splitting, which errs on the high side for English prose.
+    """
+
+    SUBWORD_FACTOR = 1.3
+
+    def __init__(self, tokenizer_name: str = ""):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None and self.tokenizer_name:
+            with self._lock:
+                if self._tokenizer is None:
+                    from transformers import AutoTokenizer
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+        return self._tokenizer
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return math.ceil(len(_WORD_OR_SYMBOL.findall(text)) * self.SUBWORD_FACTOR)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest word-boundary prefix of text that fits in max_tokens"""
+        if self.count(text) <= max_tokens:
+            return text
+        words = text.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(" ".join(words[:middle])) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+
+_token_counter: Optional[TokenCounter] = None
+
+
+def get_token_counter() -> TokenCounter:
+    """Shared token counter for the configured tokenizer"""
+    global _token_counter
+    if _token_counter is None:
+        _token_counter = TokenCounter(config.TOKENIZER)
+    return _token_counter
+
+
+class ContextBuilder:
+    """Packs retrieved chunks into a prompt context of a fixed token budget.
+
+    Candidates are reranked with maximal marginal relevance, so a chunk that
+    mostly repeats one already chosen loses to a less similar but new one.
+    Chosen chunks that are neighbours in the same document are merged on
+    their shared overlap, so no text appears twice. Chunks are added until
+    the budget is reached and the last one is cut to fill it exactly.
+    """
+
+    SEGMENT_SEPARATOR = "\n\n"
+    MIN_OVERLAP_CHARS = 20
+
+    def __init__(self, token_counter: Optional[TokenCounter] = None,
+                 mmr_lambda: float = config.CONTEXT_MMR_LAMBDA):
+        self.token_counter = token_counter or get_token_counter()
+        self.mmr_lambda = mmr_lambda
+
+    def build(self, query_embedding: Sequence[float], candidates: List[Dict], token_budget: int) -> str:
+        """Build the context from vector search results.
+
+        Each candidate holds `document`, `vector` and `metadata` (with
+        `source_id` and the chunk's `position` in its document), and may
+        hold a `relevance` from a fused search that replaces its similarity
+        to the query.
+        """
+        if not candidates or token_budget <= 0:
+            return ""
+        chosen: List[Dict] = []
+        context = ""
+        for index in self._mmr_order(query_embedding, candidates):
+            candidate = candidates[index]
+            attempt = self._render(chosen + [candidate])
+            if self.token_counter.count(attempt) <= token_budget:
+                chosen.append(candidate)
+                context = attempt
+                continue
+            # Fill the rest of the budget with as much of this chunk as fits
+            remaining = token_budget - self.token_counter.count(context)
+            if remaining > 0:
+                context = self._fill(chosen, candidate, token_budget)
+            break
+        return context
+
+    def _mmr_order(self, query_embedding: Sequence[float], candidates: List[Dict]) -> List[int]:
+        """Candidate indices in maximal marginal relevance order"""
+        vectors = np.array([candidate["vector"] for candidate in candidates], dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        if all("relevance" in candidate for candidate in candidates):
+            relevance = np.array([candidate["relevance"] for candidate in candidates], dtype=np.float32)
+        else:
+            query = np.asarray(query_embedding, dtype=np.float32)
+            relevance = vectors @ (query / (np.linalg.norm(query) or 1.0))
+        similarity = vectors @ vectors.T
+
+        order: List[int] = []
+        redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+        remaining = np.ones(len(candidates), dtype=bool)
+        for _ in range(len(candidates)):
+            penalty = np.where(np.isfinite(redundancy), redundancy, 0)
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * penalty
+            scores[~remaining] = -np.inf
+            best = int(np.argmax(scores))
+            order.append(best)
+            remaining[best] = False
+            redundancy = np.maximum(redundancy, similarity[best])
+        return order
+
+    def _fill(self, chosen: List[Dict], candidate: Dict, token_budget: int) -> str:
+        """Render chosen plus the longest prefix of candidate that fits the budget"""
+        words = candidate["document"].split(" ")
+        best = self._render(chosen)
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            partial = dict(candidate, document=" ".join(words[:middle]))
+            attempt = self._render(chosen + [partial])
+            if self.token_counter.count(attempt) <= token_budget:
+                low, best = middle, attempt
+            else:
+                high = middle - 1
+        return best
+
+    def _render(self, chosen: List[Dict]) -> str:
+        """Join chosen chunks, merging neighbours from the same document.
+
+        Segments keep the order in which their first chunk was chosen, so
+        the most relevant material comes first.
+        """
+        segments: List[Dict] = []
+        for candidate in chosen:
+            metadata = candidate.get("metadata") or {}
+            segment = {
+                "source_id": metadata.get("source_id"),
+                "first": metadata.get("position"),
+                "last": metadata.get("position"),
+                "text": candidate["document"]
+            }
+            segments.append(segment)
+            if segment["first"] is not None:
+                self._coalesce(segments, segment)
+        return self.SEGMENT_SEPARATOR.join(segment["text"] for segment in segments)
+
+    def _coalesce(self, segments: List[Dict], segment: Dict):
+        """Merge a segment with the segments directly before and after it in its document.
+
+        The merged segment takes the place of whichever part came first.
+        """
+        for other in list(segments):
+            if other is segment or other["source_id"] != segment["source_id"]:
+                continue
+            if other["last"] == segment["first"] - 1:
+                left, right = other, segment
+            elif other["first"] == segment["last"] + 1:
+                left, right = segment, other
+            else:
+                continue
+            keep, drop = (other, segment) if segments.index(other) < segments.index(segment) else (segment, other)
+            keep["text"] = self._merge(left["text"], right["text"])
+            keep["first"], keep["last"] = left["first"], right["last"]
+            segments.remove(drop)
+            segment = keep
+
+    @classmethod
+    def _merge(cls, left: str, right: str) -> str:
+        """Concatenate two consecutive chunks, dropping the text they share"""
+        if right in left:
+            return left
+        overlap = cls._overlap(left, right)
+        if overlap:
+            return left + right[overlap:]
+        return f"{left} {right}"
+
+    @classmethod
+    def _overlap(cls, left: str, right: str) -> int:
+        """Length of the longest suffix of left that is a prefix of right"""
+        longest = min(len(left), len(right))
+        if longest < cls.MIN_OVERLAP_CHARS:
+            return 0
+        probe = right[:cls.MIN_OVERLAP_CHARS]
+        start = len(left) - longest
+        index = left.find(probe, start)
+        while index != -1:
+            if right.startswith(left[index:]):
+                return len(left) - index
+            index = left.find(probe, index + 1)
+        return 0
@@ -1,158 +1,505 @@
+import asyncio
+import hashlib
+import json
 import os
-from typing import List, Dict
-from fastapi import UploadFile
-import pytesseract
-from pdf2image import convert_from_path
-from PIL import Image
-import chromadb
-from sentence_transformers import SentenceTransformer
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, List, Dict, Optional, Tuple
 import numpy as np
-import tempfile
-import shutil
+from .executor import ServiceOverloadedError, get_io_pool, get_ocr_pool
+from .embedding_cache import EmbeddingCache
+from .embedding_service import EmbeddingService
+from .document_registry import DocumentRegistry
+from .vector_store import VectorStore
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .progress_store import DEFAULT_USER
+from .context_builder import ContextBuilder
+from .topic_extractor import TopicExtractor, TopicMap
+from . import config
+from . import metrics
+from . import ocr
+
+# Called with (pages_done, pages_total) as a document is extracted
+ProgressCallback = Callable[[int, int], None]
+# Called with the name of each ingestion stage as it starts
+StageCallback = Callable[[str], None]
+
+DOCUMENTS_TOTAL = metrics.counter(
+    "study_buddy_documents_total", "Ingested documents, by whether they were already indexed", ("result",)
+)
+PDF_PAGES_TOTAL = metrics.counter(
+    "study_buddy_pdf_pages_total", "PDF pages extracted, by method (text, ocr or cached)", ("method",)
+)
+
+# Embedding models loaded in this process; loaded before the server forks
+# its workers, they are shared by all of them copy-on-write
+_preloaded_models: Dict[str, object] = {}
+
+def preload_embedding_model(model_name: str = config.EMBEDDING_MODEL):
+    """Load an embedding model once per process"""
+    if model_name not in _preloaded_models:
+        from sentence_transformers import SentenceTransformer
+        _preloaded_models[model_name] = SentenceTransformer(model_name)
+    return _preloaded_models[model_name]
 
 class DocumentProcessor:
     def __init__(self):
-        self.embeddings_model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.chroma_client = chromadb.Client()
-        try:
-            # Try to get existing collection
-            self.collection = self.chroma_client.get_collection(name="study_notes")
-        except:
-            # If collection doesn't exist, create it
-            self.collection = self.chroma_client.create_collection(name="study_notes")
-        self.temp_dir = tempfile.mkdtemp()
-
-    async def process_document(self, file: UploadFile) -> List[str]:
-        """Process uploaded document and extract topics"""
-        try:
-            # Save uploaded file temporarily
-            temp_path = os.path.join(self.temp_dir, file.filename)
-            with open(temp_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
+        self.model_name = config.EMBEDDING_MODEL
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(config.DATA_DIR, "embeddings.sqlite3"),
+            self.model_name,
+            config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        )
+        self.embedding_service = EmbeddingService(self._encode_batch)
+        self.registry = DocumentRegistry(os.path.join(config.DATA_DIR, "documents.sqlite3"))
+        self._source_locks: Dict[str, asyncio.Lock] = {}
+        self._load_lock = threading.Lock()
+        self._embeddings_model = None
+        self._vector_store = None
+        self._lexical_index = None
+        self.context_builder = ContextBuilder()
+        self.topic_extractor = TopicExtractor()
+        self.topic_map = TopicMap(os.path.join(config.DATA_DIR, "topic_map.npz"))
+
+    @property
+    def embeddings_model(self):
+        """SentenceTransformer model, loaded (with torch) on first use"""
+        if self._embeddings_model is None:
+            with self._load_lock:
+                if self._embeddings_model is None:
+                    self._embeddings_model = preload_embedding_model(self.model_name)
+        return self._embeddings_model
+
+    @property
+    def vector_store(self) -> VectorStore:
+        """On-disk vector index, opened on first use"""
+        if self._vector_store is None:
+            with self._load_lock:
+                if self._vector_store is None:
+                    self._vector_store = VectorStore(
+                        os.path.join(config.DATA_DIR, "index"),
+                        dtype=config.VECTOR_DTYPE,
+                        search_mode=config.VECTOR_SEARCH,
+                        ivf_min_rows=config.VECTOR_IVF_MIN_ROWS,
+                        ivf_nprobe=config.VECTOR_IVF_NPROBE
+                    )
+        return self._vector_store
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        """Keyword index, opened on first use and filled from the vector store if it is new"""
+        if self._lexical_index is None:
+            vector_store = self.vector_store
+            with self._load_lock:
+                if self._lexical_index is None:
+                    index = LexicalIndex(os.path.join(config.DATA_DIR, "index", "lexical.sqlite3"))
+                    if index.enabled and index.count() == 0:
+                        # Chunks stored before the keyword index existed
+                        for batch in vector_store.iter_chunks():
+                            index.add(
+                                [chunk["id"] for chunk in batch],
+                                [chunk["document"] for chunk in batch],
+                                [chunk["metadata"] for chunk in batch]
+                            )
+                    self._lexical_index = index
+        return self._lexical_index
+
+    def warm_up(self):
+        """Load the embedding model and the indexes and run a dummy encode"""
+        self.embeddings_model.encode(["warm-up"])
+        _ = self.vector_store
+        _ = self.lexical_index
+        from sklearn.cluster import MiniBatchKMeans  # noqa: F401
+
+    async def ingest_file(self, file_path: str, filename: str,
+                          progress: Optional[ProgressCallback] = None,
+                          on_stage: Optional[StageCallback] = None, user_id: str = DEFAULT_USER) -> Dict:
+        """Ingest a file from disk, skipping work for content already indexed.
+
+        Byte-identical files return their recorded topics immediately. A new
+        version of a known file reuses the OCR text of unchanged pages and
+        only adds or removes the chunks that differ. `on_stage` is told when
+        the render, ocr, embed, cluster and store stages begin. Documents of
+        the default user are searched for everyone; those of any other user
+        only for that user.
+        """
+        on_stage = on_stage or (lambda stage: None)
+        content_hash = await get_io_pool().run(self._hash_file, file_path)
+        existing = await get_io_pool().run(self.registry.find_by_hash, content_hash, user_id)
+        if existing:
+            DOCUMENTS_TOTAL.inc(result="cached")
+            return {
+                "document_id": existing["source_id"],
+                "topics": existing["topics"],
+                "cached": True,
+                "chunks_added": 0,
+                "chunks_removed": 0
+            }
+
+        source_id = self._source_id(filename, user_id)
+        async with self._source_locks.setdefault(source_id, asyncio.Lock()):
+            previous = await get_io_pool().run(self.registry.get, source_id)
+            known_pages = await get_io_pool().run(self.registry.page_texts, source_id)
 
             # Process based on file type
-            if file.filename.lower().endswith('.pdf'):
-                text = await self._process_pdf(temp_path)
-            elif file.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                text = await self._process_image(temp_path)
+            if filename.lower().endswith('.pdf'):
+                on_stage("render")
+
+                def page_progress(done: int, total: int):
+                    if done == 1:
+                        on_stage("ocr")
+                    if progress:
+                        progress(done, total)
+
+                with metrics.span("pdf_extract"):
+                    text, pages = await self._process_pdf(file_path, page_progress, known_pages)
+            elif filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+                on_stage("ocr")
+                with metrics.span("image_ocr"):
+                    text = await self._process_image(file_path)
+                pages = {content_hash: text}
             else:
-                text = await self._process_text(temp_path)
+                with metrics.span("text_read"):
+                    text = await self._process_text(file_path)
+                pages = {content_hash: text}
 
-            # Extract topics and store in vector database
-            topics = await self._extract_topics(text)
-            await self._store_document(text, topics)
+            # Chunk and embed once, then share the result between topic
+            # extraction and storage
+            on_stage("embed")
+            with metrics.span("chunk"):
+                chunks = self._unique(self._split_text(text))
+            embeddings = await self.embed(chunks)
+            on_stage("cluster")
+            with metrics.span("cluster"):
+                topics, chunk_topics = await self._extract_topics(chunks, embeddings)
+            on_stage("store")
 
-            # Cleanup
-            os.remove(temp_path)
-            return topics
+            chunk_ids = [self._chunk_id(source_id, chunk) for chunk in chunks]
+            old_ids = set(previous["chunk_ids"]) if previous else set()
+            added = [i for i, chunk_id in enumerate(chunk_ids) if chunk_id not in old_ids]
+            removed = list(old_ids - set(chunk_ids))
+            with metrics.span("store"):
+                await self._store_document(
+                    source_id, filename, user_id, chunk_ids, chunks, embeddings, topics, chunk_topics, added, removed
+                )
+            if added:
+                with metrics.span("topic_map"):
+                    await get_io_pool().run(self.topic_map.update, [chunks[i] for i in added], embeddings[added])
+            with metrics.span("registry_save"):
+                await get_io_pool().run(
+                    self.registry.save, source_id, filename, content_hash, topics, chunk_ids, pages, user_id
+                )
+        DOCUMENTS_TOTAL.inc(result="indexed")
 
-        except Exception as e:
-            raise Exception(f"Error processing document: {str(e)}")
+        return {
+            "document_id": source_id,
+            "topics": topics,
+            "cached": False,
+            "chunks_added": len(added),
+            "chunks_removed": len(removed)
+        }
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _source_id(filename: str, user_id: str = DEFAULT_USER) -> str:
+        """Stable identity of an uploaded document across versions"""
+        key = filename if user_id == DEFAULT_USER else f"{user_id}/{filename}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _chunk_id(source_id: str, chunk: str) -> str:
+        """Stable, content-addressed ID of a chunk within a document"""
+        return f"{source_id}:{hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:32]}"
 
-    async def _process_pdf(self, file_path: str) -> str:
-        """Extract text from PDF using OCR"""
+    @staticmethod
+    def _unique(chunks: List[str]) -> List[str]:
+        """Drop repeated chunks, keeping the first occurrence"""
+        return list(dict.fromkeys(chunks))
+
+    async def _process_pdf(self, file_path: str, progress: Optional[ProgressCallback] = None,
+                           known_pages: Optional[Dict[str, str]] = None) -> Tuple[str, Dict[str, str]]:
+        """Extract text from PDF, page by page.
+
+        Returns the full text and a map of page hash to page text.
+        """
         try:
-            # Convert PDF to images
-            images = convert_from_path(file_path)
-            text = ""
-            
-            # Process each page
-            for image in images:
-                text += pytesseract.image_to_string(image)
-            
-            return text
+            texts = []
+            pages = {}
+            async for _, text, page_hash in self.iter_pdf_pages(file_path, progress, known_pages):
+                texts.append(text)
+                pages[page_hash] = text
+            return "\n".join(texts), pages
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
             raise Exception(f"Error processing PDF: {str(e)}")
 
+    async def iter_pdf_pages(self, file_path: str, progress: Optional[ProgressCallback] = None,
+                             known_pages: Optional[Dict[str, str]] = None) -> AsyncIterator[Tuple[int, str, str]]:
+        """Yield (page_number, text, page_hash) for every page of a PDF in order.
+
+        Pages are processed in small batches across the OCR process pool. Only
+        a bounded number of batches is in flight at once, so peak memory does
+        not grow with the page count. Pages found in `known_pages` (page hash
+        to text) are not OCR'd again.
+        """
+        known_pages = known_pages or {}
+        known_hashes = frozenset(known_pages)
+        pool = get_ocr_pool()
+        total = await pool.run(ocr.pdf_page_count, file_path)
+        batch_size = max(1, config.PDF_BATCH_PAGES)
+        batches = deque(
+            (first, min(first + batch_size - 1, total))
+            for first in range(1, total + 1, batch_size)
+        )
+        in_flight = deque()
+        done = 0
+
+        def submit_next():
+            first, last = batches.popleft()
+            in_flight.append(asyncio.ensure_future(pool.run(
+                ocr.process_pdf_pages, file_path, first, last,
+                config.PDF_DPI, config.PDF_TEXT_LAYER_MIN_CHARS, known_hashes, config.OCR_ENGINE
+            )))
+
+        try:
+            while batches and len(in_flight) < config.PDF_BATCHES_IN_FLIGHT:
+                submit_next()
+            while in_flight:
+                pages = await in_flight.popleft()
+                if batches:
+                    submit_next()
+                for page, text, method, page_hash, timings in pages:
+                    PDF_PAGES_TOTAL.inc(method=method)
+                    for stage, seconds in timings.items():
+                        metrics.record(stage, seconds)
+                    if text is None:
+                        text = known_pages[page_hash]
+                    done += 1
+                    if progress:
+                        progress(done, total)
+                    yield page, text, page_hash
+        finally:
+            for future in in_flight:
+                future.cancel()
+
     async def _process_image(self, file_path: str) -> str:
         """Extract text from image using OCR"""
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image)
-            return text
+            return await get_ocr_pool().run(ocr.ocr_image_file, file_path, config.OCR_ENGINE)
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
             raise Exception(f"Error processing image: {str(e)}")
 
     async def _process_text(self, file_path: str) -> str:
         """Process plain text file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            return await get_io_pool().run(self._read_text, file_path)
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
             raise Exception(f"Error processing text file: {str(e)}")
 
-    async def _extract_topics(self, text: str) -> List[str]:
-        """Extract main topics from the text using the LLM"""
-        # Split text into chunks
-        chunks = self._split_text(text)
-        
-        # Generate embeddings for chunks
-        embeddings = self.embeddings_model.encode(chunks)
-        
-        # Use clustering to identify main topics
-        from sklearn.cluster import KMeans
-        n_clusters = min(5, len(chunks))  # Limit to 5 topics or less
-        kmeans = KMeans(n_clusters=n_clusters)
-        clusters = kmeans.fit_predict(embeddings)
-        
-        # Extract representative chunks for each cluster
-        topics = []
-        for i in range(n_clusters):
-            cluster_chunks = [chunks[j] for j in range(len(chunks)) if clusters[j] == i]
-            # Use the chunk closest to cluster center as topic
-            center = kmeans.cluster_centers_[i]
-            distances = [np.linalg.norm(embeddings[j] - center) for j in range(len(chunks)) if clusters[j] == i]
-            topic_idx = np.argmin(distances)
-            topics.append(cluster_chunks[topic_idx][:100])  # Take first 100 chars as topic
-        
-        return topics
+    @staticmethod
+    def _read_text(file_path: str) -> str:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return file.read()
 
-    async def _store_document(self, text: str, topics: List[str]):
-        """Store document in vector database"""
-        # Split text into chunks
-        chunks = self._split_text(text)
-        
-        # Generate embeddings
-        embeddings = self.embeddings_model.encode(chunks)
-        
-        # Store in ChromaDB
-        self.collection.add(
-            embeddings=embeddings.tolist(),
-            documents=chunks,
-            metadatas=[{"topics": topics} for _ in chunks]
-        )
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, reusing cached vectors and batching the rest with concurrent requests"""
+        if not texts:
+            return await get_io_pool().run(self._empty_embeddings)
+
+        with metrics.span("embed"):
+            cached = await get_io_pool().run(self.embedding_cache.get_many, texts)
+            missing = [i for i in range(len(texts)) if i not in cached]
+            if missing:
+                fresh = await self.embedding_service.encode([texts[i] for i in missing])
+                for i, vector in zip(missing, fresh):
+                    cached[i] = vector
+            return np.vstack([cached[i] for i in range(len(texts))]).astype(np.float32, copy=False)
+
+    def _empty_embeddings(self) -> np.ndarray:
+        return np.zeros((0, self.embeddings_model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Run the model on one batch and cache the vectors"""
+        vectors = self.embeddings_model.encode(texts, batch_size=len(texts))
+        self.embedding_cache.put_many(texts, vectors)
+        return vectors
+
+    async def _extract_topics(self, chunks: List[str], embeddings: np.ndarray) -> Tuple[List[str], List[str]]:
+        """Extract main topics by clustering chunk embeddings, with the topic of every chunk"""
+        return await get_io_pool().run(self.topic_extractor.extract_with_assignments, chunks, embeddings)
 
-    def _split_text(self, text: str, chunk_size: int = 1000) -> List[str]:
-        """Split text into overlapping chunks"""
+    async def _store_document(self, source_id: str, filename: str, user_id: str, chunk_ids: List[str],
+                              chunks: List[str], embeddings: np.ndarray, topics: List[str],
+                              chunk_topics: List[str], added: List[int], removed: List[str]):
+        """Apply a document version to the vector and keyword indexes.
+
+        Only chunks that are new in this version are inserted and only chunks
+        that disappeared are deleted; retained chunks just get fresh metadata.
+        """
+        metadata = {"source_id": source_id, "filename": filename, "user_id": user_id, "topics": json.dumps(topics)}
+        # Chunk positions let the context builder merge neighbouring chunks
+        metadatas = [
+            dict(metadata, position=position, topic=chunk_topics[position]) for position in range(len(chunk_ids))
+        ]
+        io_pool = get_io_pool()
+        if removed:
+            await io_pool.run(self.vector_store.delete, removed)
+            await io_pool.run(self.lexical_index.delete, removed)
+            await io_pool.run(self.vector_store.compact_if_fragmented)
+        if added:
+            await io_pool.run(
+                self.vector_store.add,
+                ids=[chunk_ids[i] for i in added],
+                embeddings=embeddings[added],
+                documents=[chunks[i] for i in added],
+                metadatas=[metadatas[i] for i in added]
+            )
+            await io_pool.run(
+                self.lexical_index.add,
+                ids=[chunk_ids[i] for i in added],
+                documents=[chunks[i] for i in added],
+                metadatas=[metadatas[i] for i in added]
+            )
+        added_set = set(added)
+        retained = [i for i in range(len(chunk_ids)) if i not in added_set]
+        if retained:
+            for index in (self.vector_store, self.lexical_index):
+                await io_pool.run(
+                    index.update_metadata,
+                    ids=[chunk_ids[i] for i in retained],
+                    metadatas=[metadatas[i] for i in retained]
+                )
+
+    def _split_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+        """Split text into overlapping chunks.
+
+        Chunk edges snap to paragraph, sentence or word boundaries, so an edit
+        only changes the chunks around it and the rest keep their content
+        (and their cached embeddings).
+        """
         chunks = []
         start = 0
         while start < len(text):
-            end = start + chunk_size
-            if end > len(text):
-                end = len(text)
+            end = min(start + chunk_size, len(text))
+            if end < len(text):
+                end = self._boundary_before(text, start + chunk_size // 2, end)
             chunks.append(text[start:end])
-            start = end - 200  # 200 character overlap
+            if end >= len(text):
+                break
+            next_start = self._boundary_after(text, end - overlap, end)
+            start = next_start if next_start > start else end
         return chunks
 
-    async def get_relevant_context(self, topic: str) -> str:
-        """Retrieve relevant context for a given topic"""
+    @staticmethod
+    def _boundary_before(text: str, lower: int, upper: int) -> int:
+        """Last natural break in text[lower:upper], or upper if there is none"""
+        for separator in ("\n\n", ". ", "\n", " "):
+            index = text.rfind(separator, lower, upper)
+            if index != -1:
+                return index + len(separator)
+        return upper
+
+    @staticmethod
+    def _boundary_after(text: str, lower: int, upper: int) -> int:
+        """First word start in text[lower:upper], or lower if there is none"""
+        index = text.find(" ", lower, upper)
+        return index + 1 if index != -1 else lower
+
+    async def get_relevant_context(self, topic: str, token_budget: Optional[int] = None,
+                                   document_id: Optional[str] = None, user_id: Optional[str] = None,
+                                   topic_filter: Optional[str] = None) -> str:
+        """Retrieve relevant context for a given topic.
+
+        The search can be limited to one document, to the documents a user
+        can see (their own and the shared ones) and to chunks of one
+        extracted topic. Vector and keyword matches are fused by rank, and
+        the best are reranked for diversity, merged where they overlap and
+        packed into `token_budget` prompt tokens.
+        """
+        where = self._context_filter(document_id, user_id, topic_filter)
         # Generate embedding for the topic
-        topic_embedding = self.embeddings_model.encode([topic])[0]
+        topic_embedding = (await self.embed([topic]))[0]
         
-        # Query ChromaDB
-        results = self.collection.query(
-            query_embeddings=[topic_embedding.tolist()],
-            n_results=3
-        )
+        # Query the vector index
+        with metrics.span("vector_query"):
+            candidates = await get_io_pool().run(
+                self.vector_store.query, topic_embedding, config.CONTEXT_CANDIDATES,
+                include_vectors=True, where=where
+            )
+        if config.HYBRID_SEARCH:
+            candidates = await self._fuse_keyword_matches(topic, candidates, where)
         
-        # Combine relevant chunks
-        context = " ".join(results['documents'][0])
-        return context
+        # Pack the relevant chunks into the token budget
+        if token_budget is None:
+            token_budget = config.CONTEXT_TOKEN_BUDGET or config.CONTEXT_WINDOW - config.RESPONSE_TOKENS
+        with metrics.span("context_pack"):
+            return await get_io_pool().run(self.context_builder.build, topic_embedding, candidates, token_budget)
 
-    def __del__(self):
-        """Cleanup temporary directory"""
-        try:
-            shutil.rmtree(self.temp_dir)
-        except:
-            pass 
\ No newline at end of file
+    def retrieval_scope(self, document_id: Optional[str] = None, user_id: Optional[str] = None,
+                        topic_filter: Optional[str] = None) -> str:
+        """What `get_relevant_context` searches with these filters, at the current version of the notes.
+
+        Within one scope the context only depends on the topic, so responses
+        can be matched on topic similarity alone. A user's own chunks only
+        set their scope apart when some of them pass the filters; users
+        without any share the scope of the shared notes, and their cache
+        entries.
+        """
+        owners = None
+        if user_id:
+            owners = [DEFAULT_USER]
+            private = self._context_filter(document_id, None, topic_filter) or {}
+            private["user_id"] = user_id
+            if user_id != DEFAULT_USER and self.vector_store.contains(private):
+                owners.append(user_id)
+        return json.dumps([document_id, owners, topic_filter, config.HYBRID_SEARCH, self.vector_store.version()])
+
+    @staticmethod
+    def _context_filter(document_id: Optional[str], user_id: Optional[str],
+                        topic_filter: Optional[str]) -> Optional[Dict]:
+        where = {}
+        if document_id:
+            where["source_id"] = document_id
+        if user_id:
+            where["user_id"] = sorted({user_id, DEFAULT_USER})
+        if topic_filter:
+            where["topic"] = topic_filter
+        return where or None
+
+    async def _fuse_keyword_matches(self, topic: str, candidates: List[Dict], where: Optional[Dict]) -> List[Dict]:
+        """Merge BM25 matches into the vector results by reciprocal rank fusion.
+
+        Each candidate's `relevance` is its fused score relative to the best.
+        """
+        io_pool = get_io_pool()
+        with metrics.span("lexical_query"):
+            matches = await io_pool.run(self.lexical_index.search, topic, config.CONTEXT_CANDIDATES, where)
+        if not matches:
+            return candidates
+        fused = reciprocal_rank_fusion(
+            [[candidate["id"] for candidate in candidates], [chunk_id for chunk_id, _ in matches]], config.RRF_K
+        )[:config.CONTEXT_CANDIDATES]
+        by_id = {candidate["id"]: candidate for candidate in candidates}
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in by_id]
+        if missing:
+            for chunk in await io_pool.run(self.vector_store.get, missing, include_vectors=True):
+                by_id[chunk["id"]] = chunk
+        best = fused[0][1]
+        results = []
+        for chunk_id, score in fused:
+            # Keyword matches the vector store no longer holds (deleted since) are dropped
+            if chunk_id in by_id:
+                results.append(dict(by_id[chunk_id], relevance=score / best))
+        return results
@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class DocumentRegistry:
+    """Persistent record of ingested documents.
+
+    A document is identified by its source (the uploaded filename, per user)
+    and versioned by the hash of its bytes. For each source the registry keeps
+    the chunk IDs stored in the vector index and the text of every page, keyed
+    by page hash, so re-uploads only redo the work for content that changed.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                source_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                topics TEXT NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                user_id TEXT NOT NULL DEFAULT 'default'
+            );
+            CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash);
+            CREATE TABLE IF NOT EXISTS pages (
+                source_id TEXT NOT NULL,
+                page_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (source_id, page_hash)
+            );
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        if "user_id" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN user_id TEXT NOT NULL DEFAULT 'default'")
+        self._conn.commit()
+
+    def find_by_hash(self, content_hash: str, user_id: str = "default") -> Optional[Dict]:
+        """Return a document of the user whose bytes match the given hash"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_id, filename, content_hash, topics, chunk_ids, user_id FROM documents "
+                "WHERE content_hash = ? AND user_id = ? LIMIT 1",
+                (content_hash, user_id)
+            ).fetchone()
+        return self._to_record(row)
+
+    def get(self, source_id: str) -> Optional[Dict]:
+        """Return the current version of a source"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_id, filename, content_hash, topics, chunk_ids, user_id FROM documents "
+                "WHERE source_id = ?",
+                (source_id,)
+            ).fetchone()
+        return self._to_record(row)
+
+    def page_texts(self, source_id: str) -> Dict[str, str]:
+        """Map page hash to extracted text for the current version of a source"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page_hash, text FROM pages WHERE source_id = ?", (source_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, source_id: str, filename: str, content_hash: str, topics: List[str],
+             chunk_ids: List[str], pages: Dict[str, str], user_id: str = "default"):
+        """Record a new version of a source, replacing the previous one"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents "
+                    "(source_id, filename, content_hash, topics, chunk_ids, updated_at, user_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (source_id, filename, content_hash, json.dumps(topics), json.dumps(chunk_ids), time.time(),
+                     user_id)
+                )
+                self._conn.execute("DELETE FROM pages WHERE source_id = ?", (source_id,))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pages (source_id, page_hash, text) VALUES (?, ?, ?)",
+                    [(source_id, page_hash, text) for page_hash, text in pages.items()]
+                )
+
+    @staticmethod
+    def _to_record(row) -> Optional[Dict]:
+        if row is None:
+            return None
+        return {
+            "source_id": row[0],
+            "filename": row[1],
+            "content_hash": row[2],
+            "topics": json.loads(row[3]),
+            "chunk_ids": json.loads(row[4]),
+            "user_id": row[5],
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """On-disk, content-addressed cache of text embeddings.
+
+    Entries are keyed by a hash of the model name and the exact text, so an
+    edited document only needs fresh embeddings for the chunks that changed.
+    The cache is bounded by total vector bytes and evicts least recently used
+    entries first.
+
+    Reads never write: recency is only refreshed for entries last used more
+    than `touch_seconds` ago, and those updates are written together at most
+    once per `touch_seconds`. The byte total is kept in the database and
+    updated in the same transaction as the entries, so several processes can
+    share the file.
+    """
+
+    def __init__(self, path: str, model_name: str, max_bytes: int, touch_seconds: float = 300.0):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.touch_seconds = touch_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        self._touches_written_at = time.monotonic()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) "
+            "SELECT 'total_bytes', COALESCE(SUM(nbytes), 0) FROM embeddings"
+        )
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        """Content address of a text for the current model"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+        """Return cached vectors, indexed by position in `texts`"""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            now = time.time()
+            # Stay well below SQLite's bound-parameter limit
+            for offset in range(0, len(keys), 500):
+                batch = keys[offset:offset + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, vector, last_used in self._conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({placeholders})", batch
+                ):
+                    found[key] = vector
+                    if now - last_used > self.touch_seconds:
+                        self._touched[key] = now
+            if self._touched and time.monotonic() - self._touches_written_at > self.touch_seconds:
+                self._write_touches()
+                self._conn.commit()
+
+        result = {}
+        for index, key in enumerate(keys):
+            if key in found:
+                result[index] = np.frombuffer(found[key], dtype=np.float32)
+        self.hits += len(result)
+        self.misses += len(texts) - len(result)
+        return result
+
+    def _write_touches(self):
+        self._conn.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._touched.items()]
+        )
+        self._touched.clear()
+        self._touches_written_at = time.monotonic()
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        """Store vectors for the given texts"""
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            key = self.key(text)
+            rows[key] = (key, blob, len(blob), now)
+        if not rows:
+            return
+        with self._lock:
+            # Taken up front, so the byte count and the entries change together
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                replaced = 0
+                keys = list(rows)
+                for offset in range(0, len(keys), 500):
+                    batch = keys[offset:offset + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    replaced += self._conn.execute(
+                        f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+                    ).fetchone()[0]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, nbytes, last_used) VALUES (?, ?, ?, ?)",
+                    rows.values()
+                )
+                self._add_bytes(sum(row[2] for row in rows.values()) - replaced)
+                if self._touched:
+                    self._write_touches()
+                if self._total_bytes() > self.max_bytes:
+                    self._evict()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    def _add_bytes(self, nbytes: int):
+        self._conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_bytes'", (nbytes,))
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is 90% full"""
+        target = int(self.max_bytes * 0.9)
+        total = self._total_bytes()
+        while total > target:
+            rows = self._conn.execute(
+                "SELECT key, nbytes FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            evicted: List[str] = []
+            for key, nbytes in rows:
+                evicted.append(key)
+                total -= nbytes
+                if total <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key in evicted])
+        self._conn.execute(
+            "UPDATE meta SET value = (SELECT COALESCE(SUM(nbytes), 0) FROM embeddings) WHERE key = 'total_bytes'"
+        )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total_bytes()}
+
+    def close(self):
+        with self._lock:
+            if self._touched:
+                self._write_touches()
+                self._conn.commit()
+            self._conn.close()
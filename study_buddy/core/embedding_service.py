@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+from . import config, metrics
+from .executor import get_io_pool
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+EMBED_BATCH_SIZE = metrics.histogram(
+    "study_buddy_embedding_batch_size", "Texts per embedding forward pass", buckets=BATCH_SIZE_BUCKETS
+)
+
+
+class EmbeddingService:
+    """Micro-batches concurrent embedding requests into shared forward passes.
+
+    Requests smaller than a full batch (topic queries) wait up to
+    `window_ms` for company, then run together as one call to `encode_fn`;
+    identical texts in a batch are encoded once. Larger requests (document
+    chunks) are split into full batches of their own. Only one batch runs
+    at a time and queries always go before chunks, so a query waits at most
+    one window plus one batch however large the uploads in flight.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray],
+                 window_ms: float = config.EMBED_BATCH_WINDOW_MS, max_batch: int = config.EMBED_BATCH_MAX):
+        self.encode_fn = encode_fn
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._interactive: Deque[Dict] = deque()
+        self._bulk: Deque[Dict] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.encoded = 0
+        self.largest_batch = 0
+        self.total_wait = 0.0
+        self.batch_sizes = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        metrics.gauge(
+            "study_buddy_embedding_queue_depth", "Texts waiting for an embedding batch",
+            callback=lambda: {(): self.queue_depth}
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        """Texts waiting for a batch"""
+        return sum(len(item["texts"]) for queue in (self._interactive, self._bulk) for item in queue)
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as part of whichever batch they land in"""
+        loop = asyncio.get_running_loop()
+        self._ensure_worker()
+        queue = self._interactive if len(texts) < self.max_batch else self._bulk
+        futures = []
+        for start in range(0, len(texts), self.max_batch):
+            future = loop.create_future()
+            queue.append({"texts": texts[start:start + self.max_batch], "future": future, "queued_at": time.perf_counter()})
+            futures.append(future)
+        self._wakeup.set()
+        return np.vstack(await asyncio.gather(*futures))
+
+    def _ensure_worker(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        """Stop the batching worker, failing any waiting requests"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for queue in (self._interactive, self._bulk):
+            while queue:
+                future = queue.popleft()["future"]
+                if not future.done():
+                    future.cancel()
+
+    async def _worker(self):
+        # The worker outlives the request that started it
+        metrics.detach_request_timings()
+        while True:
+            if not self._interactive and not self._bulk:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            if self._interactive:
+                await self._wait_for_window()
+                batch = self._take_interactive()
+            else:
+                batch = [self._bulk.popleft()]
+            await self._run(batch)
+
+    async def _wait_for_window(self):
+        """Let more queries join until the window closes or the batch is full"""
+        deadline = self._interactive[0]["queued_at"] + self.window
+        while sum(len(item["texts"]) for item in self._interactive) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def _take_interactive(self) -> List[Dict]:
+        batch, size = [], 0
+        while self._interactive and size + len(self._interactive[0]["texts"]) <= self.max_batch:
+            item = self._interactive.popleft()
+            batch.append(item)
+            size += len(item["texts"])
+        return batch
+
+    async def _run(self, batch: List[Dict]):
+        batch = [item for item in batch if not item["future"].done()]
+        if not batch:
+            return
+        texts = [text for item in batch for text in item["texts"]]
+        unique = list(dict.fromkeys(texts))
+        started = time.perf_counter()
+        try:
+            with metrics.span("embed_batch"):
+                vectors = await get_io_pool().run(self.encode_fn, unique)
+        except Exception as e:
+            for item in batch:
+                if not item["future"].done():
+                    item["future"].set_exception(e)
+            return
+        self._record(batch, len(texts), len(unique), started)
+
+        by_text = {text: vector for text, vector in zip(unique, vectors)}
+        for item in batch:
+            if not item["future"].done():
+                item["future"].set_result(np.vstack([by_text[text] for text in item["texts"]]))
+
+    def _record(self, batch: List[Dict], n_texts: int, n_unique: int, started: float):
+        self.batches += 1
+        self.requests += len(batch)
+        self.texts += n_texts
+        self.encoded += n_unique
+        self.largest_batch = max(self.largest_batch, n_unique)
+        self.total_wait += sum(started - item["queued_at"] for item in batch)
+        bucket = next((bucket for bucket in BATCH_SIZE_BUCKETS if n_unique <= bucket), BATCH_SIZE_BUCKETS[-1])
+        self.batch_sizes[bucket] += 1
+        EMBED_BATCH_SIZE.observe(n_unique)
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "texts": self.texts,
+            "encoded": self.encoded,
+            "mean_batch_size": self.encoded / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "mean_wait_ms": self.total_wait / self.requests * 1000 if self.requests else 0.0,
+            "batch_sizes": {f"le_{bucket}": count for bucket, count in self.batch_sizes.items()},
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch
+        }
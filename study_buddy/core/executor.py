@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import multiprocessing
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from . import config, metrics
+
+
+class ServiceOverloadedError(Exception):
+    """Raised when a worker pool has no room left for new work"""
+
+    def __init__(self, pool_name: str, retry_after: int):
+        super().__init__(f"The {pool_name} pool is at capacity, retry in {retry_after}s")
+        self.pool_name = pool_name
+        self.retry_after = retry_after
+
+
+class BoundedPool:
+    """Executor wrapper that rejects work once its queue is full"""
+
+    def __init__(self, name: str, executor: Executor, max_workers: int, max_queue: int):
+        self.name = name
+        self.executor = executor
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                raise ServiceOverloadedError(self.name, config.RETRY_AFTER_SECONDS)
+            self.pending += 1
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable in the pool without blocking the event loop"""
+        self._acquire()
+        try:
+            future = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the work itself ends: a caller that gives up
+        # (client disconnect, timeout) leaves a running task behind, which still
+        # counts against the queue.
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncLimiter:
+    """Caps concurrent coroutines and rejects callers once the waiting room is full"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.pending = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def in_flight(self) -> int:
+        return min(self.pending, self.max_concurrency)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a concurrency slot for the duration of the block"""
+        if self.pending >= self.max_concurrency + self.max_queue:
+            raise ServiceOverloadedError(self.name, config.RETRY_AFTER_SECONDS)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                yield
+        finally:
+            self.pending -= 1
+
+    async def run(self, coro_fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """Await a coroutine function once a concurrency slot is free"""
+        async with self.slot():
+            return await coro_fn(*args, **kwargs)
+
+
+_ocr_pool: Optional[BoundedPool] = None
+_io_pool: Optional[BoundedPool] = None
+_llm_limiter: Optional[AsyncLimiter] = None
+_pools_lock = threading.Lock()
+
+
+def get_ocr_pool() -> BoundedPool:
+    """Process pool for CPU-bound rendering and OCR"""
+    global _ocr_pool
+    with _pools_lock:
+        if _ocr_pool is None:
+            # Workers fork from a clean server process that has only imported the
+            # OCR helpers, so they never inherit the embedding model or torch threads.
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["study_buddy.core.ocr"])
+            executor = ProcessPoolExecutor(max_workers=config.OCR_WORKERS, mp_context=context)
+            _ocr_pool = BoundedPool("ocr", executor, config.OCR_WORKERS, config.OCR_QUEUE_SIZE)
+        return _ocr_pool
+
+
+def get_io_pool() -> BoundedPool:
+    """Thread pool for embedding and vector store calls"""
+    global _io_pool
+    with _pools_lock:
+        if _io_pool is None:
+            executor = ThreadPoolExecutor(max_workers=config.IO_WORKERS, thread_name_prefix="study-buddy-io")
+            _io_pool = BoundedPool("io", executor, config.IO_WORKERS, config.IO_QUEUE_SIZE)
+        return _io_pool
+
+
+def get_llm_limiter() -> AsyncLimiter:
+    """Concurrency gate in front of the LLM backend"""
+    global _llm_limiter
+    if _llm_limiter is None:
+        _llm_limiter = AsyncLimiter("llm", config.LLM_CONCURRENCY, config.LLM_QUEUE_SIZE)
+    return _llm_limiter
+
+
+def pool_stats():
+    """Pending work per pool that has been created, keyed for the metrics gauge"""
+    stats = {}
+    for name, pool in (("ocr", _ocr_pool), ("io", _io_pool), ("llm", _llm_limiter)):
+        if pool is not None:
+            stats[(name,)] = pool.pending
+    return stats
+
+
+POOL_PENDING = metrics.gauge(
+    "study_buddy_pool_pending", "Work running or queued in each worker pool", ("pool",), callback=pool_stats
+)
+
+
+def shutdown_pools():
+    """Stop all worker pools"""
+    global _ocr_pool, _io_pool
+    with _pools_lock:
+        for pool in (_ocr_pool, _io_pool):
+            if pool is not None:
+                pool.shutdown()
+        _ocr_pool = None
+        _io_pool = None
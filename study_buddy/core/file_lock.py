@@ -0,0 +1,50 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, TextIO
+
+try:
+    import fcntl
+except ImportError:  # Windows: the server runs as a single process, so the thread lock is enough
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive lock shared by every process that uses the same lock file.
+
+    Re-entrant for the thread holding it. The file is opened per process, so
+    a lock object inherited through fork never shares its lock with the parent.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file: Optional[TextIO] = None
+        self._pid: Optional[int] = None
+
+    @contextmanager
+    def hold(self) -> Iterator[None]:
+        with self._lock:
+            if self._depth == 0:
+                self._acquire()
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._release()
+
+    def _acquire(self):
+        if fcntl is None:
+            return
+        if self._file is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, "a")
+            self._pid = os.getpid()
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def _release(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
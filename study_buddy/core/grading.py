@@ -0,0 +1,112 @@
+import re
+import string
+from typing import Dict, List, Optional
+
+CLOSED_FORM_TYPES = ("multiple_choice", "true_false")
+
+_TRUE_WORDS = {"true", "t", "yes", "y", "correct", "right", "1"}
+_FALSE_WORDS = {"false", "f", "no", "n", "incorrect", "wrong", "0"}
+_NEGATIONS = {"not", "isnt", "arent", "wasnt", "never", "no"}
+_OPTION_LABEL = re.compile(r"^\(?([a-z]|\d{1,2})[\).:]\s+")
+_NUMERIC = re.compile(r"^[-+]?\.?\d")
+_PUNCTUATION = str.maketrans("", "", string.punctuation)
+
+
+def normalise_answer(text) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(str(text).lower().translate(_PUNCTUATION).split())
+
+
+def is_closed_form(question: Dict) -> bool:
+    return question.get("type") in CLOSED_FORM_TYPES
+
+
+def grade_closed_form(question: Dict, user_answer: str) -> Optional[Dict]:
+    """Grade a multiple choice or true/false answer without the LLM.
+
+    Returns None when the question cannot be graded locally: its correct
+    answer does not match any of its options, or the user's answer does not
+    clearly name one (free text such as "The mitochondria"), so it is left
+    to the LLM grader.
+    """
+    if question.get("type") == "true_false":
+        expected = _parse_bool(question.get("correct_answer", ""))
+        given = _parse_bool(user_answer)
+        if expected is None or given is None:
+            return None
+        return _verdict(question, given == expected)
+
+    if question.get("type") == "multiple_choice":
+        options = question.get("options") or []
+        expected = _resolve_option(options, question.get("correct_answer", ""))
+        given = _resolve_option(options, user_answer)
+        if expected is None or given is None:
+            return None
+        return _verdict(question, given == expected)
+
+    return None
+
+
+def _parse_bool(text) -> Optional[bool]:
+    words = normalise_answer(text).split()
+    if not words:
+        return None
+    if words[0] in _TRUE_WORDS:
+        return True
+    if words[0] in _FALSE_WORDS:
+        return False
+    # "I think false": a single "true" or "false" further in, unless negated
+    verdicts = {word for word in words if word in ("true", "false")}
+    if len(verdicts) == 1 and not _NEGATIONS.intersection(words):
+        return verdicts.pop() == "true"
+    return None
+
+
+def _resolve_option(options: List[str], answer) -> Optional[int]:
+    """Map an answer given as option text, letter or number to an option index"""
+    raw = str(answer).strip().lower()
+    normalised = normalise_answer(answer)
+    if not normalised:
+        return None
+
+    unlabelled_options = [_OPTION_LABEL.sub("", str(option).strip().lower()) for option in options]
+    normalised_options = [normalise_answer(option) for option in unlabelled_options]
+    unlabelled = normalise_answer(_OPTION_LABEL.sub("", raw))
+    for index, option in enumerate(normalised_options):
+        if option and option in (normalised, unlabelled):
+            return index
+
+    # A bare label such as "b", "B)", "(2)" or "2."
+    label = normalised if len(normalised.split()) == 1 else None
+    if label is None:
+        match = _OPTION_LABEL.match(raw)
+        label = match.group(1) if match else None
+    if label is not None:
+        if len(label) == 1 and label.isalpha():
+            index = ord(label) - ord("a")
+        elif label.isdigit():
+            # With numeric options a bare number is an answer, not a position
+            if any(_NUMERIC.match(option.strip()) for option in unlabelled_options):
+                return None
+            index = int(label) - 1
+        else:
+            return None
+        if 0 <= index < len(options):
+            return index
+    return None
+
+
+def _verdict(question: Dict, is_correct: bool) -> Dict:
+    explanation = question.get("explanation", "")
+    if is_correct:
+        feedback = f"Correct! {explanation}".strip()
+        improvements = []
+    else:
+        feedback = f"Not quite. The correct answer is: {question.get('correct_answer')}. {explanation}".strip()
+        improvements = ["Review the explanation and try recalling the answer again later"]
+    return {
+        "is_correct": is_correct,
+        "feedback": feedback,
+        "suggested_improvements": improvements,
+        "graded_by": "rules"
+    }
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+
+from . import config, metrics
+from .document_processor import DocumentProcessor
+from .executor import ServiceOverloadedError, get_io_pool
+from .progress_store import DEFAULT_USER
+
+
+class IngestionJob:
+    """State of one uploaded document moving through ingestion"""
+
+    def __init__(self, file_path: str, filename: str, size: int, user_id: str = DEFAULT_USER):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.filename = filename
+        self.size = size
+        self.user_id = user_id
+        self.status = "queued"  # queued, running, completed, failed
+        self.stage = "queued"   # queued, render, ocr, embed, cluster, store, done
+        self.pages_done = 0
+        self.pages_total: Optional[int] = None
+        self.document_id: Optional[str] = None
+        self.topics: List[str] = []
+        self.cached = False
+        self.error: Optional[str] = None
+        self.attempts = 0  # Runs put back because the worker pools were full
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+
+    def set_pages(self, done: int, total: int):
+        self.pages_done = done
+        self.pages_total = total
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "user_id": self.user_id,
+            "status": self.status,
+            "stage": self.stage,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "document_id": self.document_id,
+            "topics": self.topics,
+            "cached": self.cached,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "IngestionJob":
+        """Rebuild a job reported by another process"""
+        job = cls("", data["filename"], data["size"], data.get("user_id", DEFAULT_USER))
+        job.id = data["job_id"]
+        for key in ("status", "stage", "pages_done", "pages_total", "document_id", "topics", "cached",
+                    "error", "submitted_at", "started_at", "finished_at"):
+            setattr(job, key, data[key])
+        return job
+
+
+class JobStore:
+    """Job states in SQLite, so any server process can report on any upload"""
+
+    def __init__(self, path: str, retention: int = config.JOB_RETENTION):
+        self.retention = retention
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                submitted_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_submitted_at ON jobs (submitted_at)")
+        self._conn.commit()
+
+    def save(self, job: IngestionJob):
+        self.save_many([job])
+
+    def save_many(self, jobs: List[IngestionJob]):
+        """Write the current state of jobs in one transaction"""
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO jobs (job_id, state, submitted_at) VALUES (?, ?, ?)",
+                    [(job.id, json.dumps(job.to_dict()), job.submitted_at) for job in jobs]
+                )
+                if any(job.finished_at for job in jobs):
+                    self._conn.execute(
+                        "DELETE FROM jobs WHERE submitted_at < "
+                        "(SELECT submitted_at FROM jobs ORDER BY submitted_at DESC LIMIT 1 OFFSET ?)",
+                        (self.retention,)
+                    )
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return IngestionJob.from_dict(json.loads(row[0])) if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class IngestionQueue:
+    """Background ingestion workers with a size-aware scheduler.
+
+    Waiting jobs are ordered by file size, so a short set of notes is not
+    stuck behind a whole textbook. A job's effective size shrinks the longer
+    it waits, which keeps large documents from starving.
+
+    With a `store`, a job's state is also written there, so the other
+    server processes can answer status requests for it. Submission and the
+    final state are written at once; stage and page progress are batched
+    and written every `save_seconds`.
+    """
+
+    def __init__(self, document_processor: DocumentProcessor, workers: int = config.INGEST_WORKERS,
+                 max_pending: int = config.INGEST_QUEUE_SIZE, aging_seconds: float = config.INGEST_AGING_SECONDS,
+                 retention: int = config.JOB_RETENTION, store: Optional[JobStore] = None,
+                 save_seconds: float = config.JOB_SAVE_SECONDS):
+        self.document_processor = document_processor
+        self.store = store
+        self.save_seconds = save_seconds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.aging_seconds = aging_seconds
+        self.retention = retention
+        self.jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self.on_complete: List[Callable[[IngestionJob], None]] = []
+        self._pending: List[IngestionJob] = []
+        self._condition: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self._dirty: Dict[str, IngestionJob] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._retries: Set[asyncio.Task] = set()
+        metrics.gauge(
+            "study_buddy_ingest_pending", "Ingestion jobs waiting for a worker",
+            callback=lambda: {(): len(self._pending)}
+        )
+
+    async def start(self):
+        """Start the worker tasks"""
+        self._condition = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.store is not None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Cancel the worker tasks and write out pending progress"""
+        for task in [*self._tasks, *self._retries]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retries, return_exceptions=True)
+        self._tasks = []
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+            await self._flush()
+
+    async def submit(self, file_path: str, filename: str, size: int, user_id: str = DEFAULT_USER) -> IngestionJob:
+        """Queue a file that has already been written to disk"""
+        if len(self._pending) >= self.max_pending:
+            raise ServiceOverloadedError("ingestion", config.RETRY_AFTER_SECONDS)
+        job = IngestionJob(file_path, filename, size, user_id)
+        self.jobs[job.id] = job
+        self._trim()
+        await self._save(job)
+        async with self._condition:
+            self._pending.append(job)
+            self._condition.notify()
+        return job
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = await get_io_pool().run(self.store.get, job_id)
+        return job
+
+    async def _save(self, job: IngestionJob):
+        """Write a job's state now, off the event loop"""
+        if self.store is None:
+            return
+        self._dirty.pop(job.id, None)
+        try:
+            await get_io_pool().run(self.store.save, job)
+        except sqlite3.Error:
+            # Only other processes lose sight of the job; ingestion carries on
+            pass
+        except ServiceOverloadedError:
+            self._mark_dirty(job)
+
+    def _mark_dirty(self, job: IngestionJob):
+        """Queue a job's state for the next periodic write"""
+        if self.store is not None:
+            self._dirty[job.id] = job
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.save_seconds)
+            await self._flush()
+
+    async def _flush(self):
+        """Write the state of every job changed since the last flush"""
+        if not self._dirty:
+            return
+        jobs = list(self._dirty.values())
+        self._dirty.clear()
+        try:
+            await get_io_pool().run(self.store.save_many, jobs)
+        except (sqlite3.Error, ServiceOverloadedError):
+            # Retried on the next flush, unless the job has been written since
+            for job in jobs:
+                self._dirty.setdefault(job.id, job)
+
+    def _priority(self, job: IngestionJob, now: float) -> float:
+        waited = now - job.submitted_at
+        return job.size / (1.0 + waited / self.aging_seconds)
+
+    async def _next_job(self) -> IngestionJob:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._pending)
+            now = time.time()
+            job = min(self._pending, key=lambda pending: self._priority(pending, now))
+            self._pending.remove(job)
+            return job
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            await self._run(job)
+
+    async def _run(self, job: IngestionJob):
+        job.status = "running"
+        job.started_at = time.time()
+        await self._save(job)
+        metrics.record("ingest_wait", job.started_at - job.submitted_at)
+
+        def set_pages(done: int, total: int):
+            job.set_pages(done, total)
+            self._mark_dirty(job)
+
+        def set_stage(stage: str):
+            job.set_stage(stage)
+            self._mark_dirty(job)
+
+        try:
+            with metrics.span("ingest"):
+                result = await self.document_processor.ingest_file(
+                    job.file_path, job.filename, progress=set_pages, on_stage=set_stage, user_id=job.user_id
+                )
+            job.document_id = result["document_id"]
+            job.topics = result["topics"]
+            job.cached = result["cached"]
+            job.status = "completed"
+            job.stage = "done"
+        except ServiceOverloadedError:
+            # The worker pools are full for now; nothing is wrong with the file
+            job.status = "queued"
+            job.stage = "queued"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            if job.status != "queued":
+                job.finished_at = time.time()
+                try:
+                    os.remove(job.file_path)
+                except OSError:
+                    pass
+        await self._save(job)
+        if job.status == "queued":
+            self._retry_later(job)
+            return
+        if job.status == "completed":
+            for callback in self.on_complete:
+                try:
+                    callback(job)
+                except Exception:
+                    # The document is stored either way; follow-up work is best-effort
+                    pass
+
+    def _retry_later(self, job: IngestionJob):
+        """Put a job back in the queue after a backoff that doubles with each attempt"""
+        job.attempts += 1
+        delay = min(config.RETRY_AFTER_SECONDS * 2 ** (job.attempts - 1), config.INGEST_RETRY_MAX_SECONDS)
+        task = asyncio.create_task(self._requeue(job, delay))
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def _requeue(self, job: IngestionJob, delay: float):
+        await asyncio.sleep(delay)
+        async with self._condition:
+            self._pending.append(job)
+            self._condition.notify()
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond the retention limit"""
+        excess = len(self.jobs) - self.retention
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at][:excess]:
+            del self.jobs[job_id]
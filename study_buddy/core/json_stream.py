@@ -0,0 +1,169 @@
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+class IncrementalJSONParser:
+    """Parse a JSON object as it streams in, one chunk at a time.
+
+    The parser reports each top-level field of the object as soon as its
+    value is complete, and each element of a top-level array as soon as that
+    element is complete, without waiting for the rest of the document. Any
+    text the model emits before the opening brace is ignored.
+
+    `feed` returns a list of events:
+        {"type": "item", "key": "questions", "index": 0, "value": {...}}
+        {"type": "field", "key": "explanation", "value": "..."}
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._item_index = 0
+
+    @property
+    def done(self) -> bool:
+        return self._end is not None
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Consume more text and return the events it completed"""
+        self.text += chunk
+        events: List[Dict] = []
+        text = self.text
+        while self._pos < len(text) and not self.done:
+            i = self._pos
+            ch = text[i]
+            self._pos += 1
+
+            if not self._stack:
+                if ch == "{":
+                    self._stack.append(ch)
+                    self._start = i
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._close_string(i, events)
+                continue
+
+            if ch in " \t\r\n":
+                continue
+
+            depth = len(self._stack)
+            in_array = depth == 2 and self._stack[1] == "["
+            if depth == 1 and self._expect == "value" and self._value_start is None and ch not in ",}":
+                self._value_start = i
+            if in_array and self._item_start is None and ch not in ",]":
+                self._item_start = i
+
+            if ch == '"':
+                self._in_string = True
+                if depth == 1 and self._expect == "key":
+                    self._key_start = i
+            elif ch in "{[":
+                if depth == 1 and ch == "[":
+                    self._item_index = 0
+                self._stack.append(ch)
+            elif ch in "}]":
+                if in_array and ch == "]":
+                    self._finish_item(i, events)
+                if depth == 1:
+                    self._finish_value(i, events)
+                    self._stack.pop()
+                    self._end = i + 1
+                    continue
+                self._stack.pop()
+                if len(self._stack) == 2 and self._stack[1] == "[":
+                    self._finish_item(i + 1, events)
+                elif len(self._stack) == 1:
+                    self._finish_value(i + 1, events)
+            elif ch == ":" and depth == 1:
+                self._expect = "value"
+            elif ch == ",":
+                if depth == 1:
+                    self._finish_value(i, events)
+                    self._expect = "key"
+                elif in_array:
+                    self._finish_item(i, events)
+        return events
+
+    def result(self) -> Any:
+        """Parse the complete object"""
+        if self._start is None:
+            return json.loads(self.text)
+        end = self._end if self._end is not None else len(self.text)
+        return json.loads(self.text[self._start:end])
+
+    def _close_string(self, i: int, events: List[Dict]):
+        depth = len(self._stack)
+        if depth == 1:
+            if self._expect == "key":
+                self._key = self._load(self.text[self._key_start:i + 1])
+                self._expect = "colon"
+            else:
+                self._finish_value(i + 1, events)
+        elif depth == 2 and self._stack[1] == "[":
+            self._finish_item(i + 1, events)
+
+    def _finish_value(self, end: int, events: List[Dict]):
+        if self._value_start is None:
+            return
+        raw = self.text[self._value_start:end]
+        self._value_start = None
+        value = self._load(raw)
+        if value is not _INVALID:
+            events.append({"type": "field", "key": self._key, "value": value})
+
+    def _finish_item(self, end: int, events: List[Dict]):
+        if self._item_start is None:
+            return
+        raw = self.text[self._item_start:end]
+        self._item_start = None
+        value = self._load(raw)
+        if value is not _INVALID:
+            events.append({"type": "item", "key": self._key, "index": self._item_index, "value": value})
+            self._item_index += 1
+
+    @staticmethod
+    def _load(raw: str) -> Any:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return _INVALID
+
+
+_INVALID = object()
+
+
+async def stream_events(tokens: AsyncIterator[str]) -> AsyncIterator[Dict]:
+    """Turn a stream of model tokens into client events.
+
+    Every token is forwarded as {"event": "token", "text": ...}. Completed
+    top-level fields arrive as {"event": <field name>, "data": ...} and
+    completed array elements as {"event": "<field name>_item", "index": i,
+    "data": ...}. The stream ends with {"event": "done", "content": ...}
+    holding the fully parsed object.
+    """
+    parser = IncrementalJSONParser()
+    async for token in tokens:
+        yield {"event": "token", "text": token}
+        for event in parser.feed(token):
+            if event["type"] == "item":
+                yield {"event": f"{event['key']}_item", "index": event["index"], "data": event["value"]}
+            else:
+                yield {"event": event["key"], "data": event["value"]}
+    yield {"event": "done", "content": parser.result()}
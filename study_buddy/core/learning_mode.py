@@ -1,92 +1,210 @@
-from typing import Dict, Optional
+import json
+import os
+from typing import AsyncIterator, Dict, List, Optional
+from . import config
+from . import metrics
 from .llm_manager import LLMManager
 from .document_processor import DocumentProcessor
+from .executor import ServiceOverloadedError, get_io_pool
+from .grading import grade_closed_form
+from .json_stream import stream_events
+from .progress_store import DEFAULT_USER, ProgressStore
+from .question_bank import QuestionBank
 
 class LearningMode:
-    def __init__(self, llm_manager: LLMManager, document_processor: DocumentProcessor):
+    def __init__(self, llm_manager: LLMManager, document_processor: DocumentProcessor,
+                 question_bank: Optional[QuestionBank] = None, progress_store: Optional[ProgressStore] = None):
         self.llm_manager = llm_manager
         self.document_processor = document_processor
-        self.user_progress = {}  # Track user progress per topic
+        self.question_bank = question_bank
+        # Track user progress per user and topic
+        self.progress_store = progress_store or ProgressStore(os.path.join(config.DATA_DIR, "progress.sqlite3"))
 
-    async def handle_request(self, topic: str, context: Optional[str] = None) -> Dict:
-        """Handle a learning request for a specific topic"""
+    async def handle_request(self, topic: str, context: Optional[str] = None, user_id: str = DEFAULT_USER,
+                             document_id: Optional[str] = None, topic_filter: Optional[str] = None) -> Dict:
+        """Handle a learning request for a specific topic.
+
+        `document_id` and `topic_filter` limit the notes searched for context.
+        """
         try:
-            # Get relevant context from uploaded notes
+            with metrics.span("learning"):
+                difficulty = await self._difficulty(user_id, topic)
+
+                # Serve pre-generated content for topics from uploaded notes
+                response = None
+                if not context:
+                    response = await self._take_banked(topic, difficulty, document_id, topic_filter)
+
+                if response is None:
+                    # Get relevant context from uploaded notes
+                    scope = None
+                    if not context:
+                        context = await self.document_processor.get_relevant_context(
+                            topic, self.llm_manager.context_budget("learning", topic, difficulty),
+                            document_id=document_id, user_id=user_id, topic_filter=topic_filter
+                        )
+                        scope = await get_io_pool().run(
+                            self.document_processor.retrieval_scope, document_id, user_id, topic_filter
+                        )
+
+                    # Generate learning content
+                    topic_embedding = (await self.document_processor.embed([topic]))[0]
+                    response = await self.llm_manager.generate_response(
+                        mode="learning",
+                        topic=topic,
+                        context=context,
+                        topic_embedding=topic_embedding,
+                        cache_scope=scope,
+                        difficulty=difficulty
+                    )
+
+                # Update user progress
+                progress = await self._update_progress(user_id, topic, response)
+
+                return {
+                    "status": "success",
+                    "content": response,
+                    "progress": progress
+                }
+
+        except ServiceOverloadedError:
+            raise
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": str(e)
+            }
+
+    async def stream_request(self, topic: str, context: Optional[str] = None, user_id: str = DEFAULT_USER,
+                             document_id: Optional[str] = None,
+                             topic_filter: Optional[str] = None) -> AsyncIterator[Dict]:
+        """Stream a learning request as tokens and structured events.
+
+        The explanation, each question and the active recall prompt are
+        emitted as soon as the model finishes writing them.
+        """
+        difficulty = await self._difficulty(user_id, topic)
+        banked = await self._take_banked(topic, difficulty, document_id, topic_filter) if not context else None
+        if banked is not None:
+            tokens = self._replay(banked)
+        else:
+            scope = None
             if not context:
-                context = await self.document_processor.get_relevant_context(topic)
+                context = await self.document_processor.get_relevant_context(
+                    topic, self.llm_manager.context_budget("learning", topic, difficulty),
+                    document_id=document_id, user_id=user_id, topic_filter=topic_filter
+                )
+                scope = await get_io_pool().run(
+                    self.document_processor.retrieval_scope, document_id, user_id, topic_filter
+                )
 
-            # Generate learning content
-            response = await self.llm_manager.generate_response(
+            topic_embedding = (await self.document_processor.embed([topic]))[0]
+            tokens = self.llm_manager.stream_response(
                 mode="learning",
                 topic=topic,
-                context=context
+                context=context,
+                topic_embedding=topic_embedding,
+                cache_scope=scope,
+                difficulty=difficulty
             )
+        with metrics.span("learning_stream"):
+            async for event in stream_events(tokens):
+                if event["event"] == "done":
+                    event["progress"] = await self._update_progress(user_id, topic, event["content"])
+                yield event
 
-            # Update user progress
-            self._update_progress(topic, response)
+    async def _take_banked(self, topic: str, difficulty: str, document_id: Optional[str] = None,
+                           topic_filter: Optional[str] = None) -> Optional[Dict]:
+        """Take pre-generated content from the question bank, queueing a refill when it is empty"""
+        # Banked content is generated from the topic's own chunks, so it cannot serve another topic's filter
+        if self.question_bank is None or (topic_filter and topic_filter != topic):
+            return None
+        with metrics.span("question_bank_take"):
+            response = await self.question_bank.take(topic, difficulty, document_id)
+        if response is None:
+            self.question_bank.request_refill(topic, difficulty)
+        return response
+
+    @staticmethod
+    async def _replay(response: Dict) -> AsyncIterator[str]:
+        yield json.dumps(response)
+
+    async def _difficulty(self, user_id: str, topic: str) -> str:
+        return await get_io_pool().run(self.progress_store.difficulty, user_id, topic)
+
+    async def evaluate_answer(self, topic: str, question: Dict, user_answer: str,
+                              user_id: str = DEFAULT_USER) -> Dict:
+        """Evaluate a user's answer to a question"""
+        try:
+            # Closed-form questions are graded locally; the rest go to the LLM
+            with metrics.span("grading"):
+                evaluation = grade_closed_form(question, user_answer)
+            if evaluation is None:
+                evaluation = dict(await self.llm_manager.evaluate_answer(question, user_answer), graded_by="llm")
+
+            # Update progress
+            progress = await self._update_progress_after_answers(user_id, topic, [evaluation["is_correct"]])
 
             return {
                 "status": "success",
-                "content": response,
-                "progress": self.user_progress.get(topic, {
-                    "questions_answered": 0,
-                    "correct_answers": 0,
-                    "difficulty_level": "beginner"
-                })
+                "evaluation": evaluation,
+                "progress": progress
             }
 
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
             return {
                 "status": "error",
                 "message": str(e)
             }
 
-    async def evaluate_answer(self, topic: str, question: Dict, user_answer: str) -> Dict:
-        """Evaluate a user's answer to a question"""
+    async def evaluate_answers(self, topic: str, answers: List[Dict], user_id: str = DEFAULT_USER) -> Dict:
+        """Evaluate a quiz's worth of answers with at most one LLM call.
+
+        Each answer holds a `question` and a `user_answer`. Multiple choice and
+        true/false answers are graded locally; all remaining answers are
+        graded together in a single batched generation.
+        """
         try:
-            # Get evaluation from LLM
-            evaluation = await self.llm_manager.evaluate_answer(question, user_answer)
+            with metrics.span("grading"):
+                evaluations: List[Optional[Dict]] = [
+                    grade_closed_form(answer["question"], answer["user_answer"]) for answer in answers
+                ]
+            open_ended = [index for index, evaluation in enumerate(evaluations) if evaluation is None]
+            if open_ended:
+                batch = await self.llm_manager.evaluate_answers([answers[index] for index in open_ended])
+                for index, evaluation in zip(open_ended, batch):
+                    evaluations[index] = dict(evaluation, graded_by="llm")
 
-            # Update progress
-            self._update_progress_after_answer(topic, evaluation["is_correct"])
+            progress = await self._update_progress_after_answers(
+                user_id, topic, [evaluation["is_correct"] for evaluation in evaluations]
+            )
 
             return {
                 "status": "success",
-                "evaluation": evaluation,
-                "progress": self.user_progress.get(topic, {
-                    "questions_answered": 0,
-                    "correct_answers": 0,
-                    "difficulty_level": "beginner"
-                })
+                "evaluations": evaluations,
+                "correct": sum(1 for evaluation in evaluations if evaluation["is_correct"]),
+                "total": len(evaluations),
+                "progress": progress
             }
 
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
             return {
                 "status": "error",
                 "message": str(e)
             }
 
-    def _update_progress(self, topic: str, response: Dict):
-        """Update user progress based on the learning content"""
-        if topic not in self.user_progress:
-            self.user_progress[topic] = {
-                "questions_answered": 0,
-                "correct_answers": 0,
-                "difficulty_level": response.get("difficulty_level", "beginner")
-            }
+    async def _update_progress(self, user_id: str, topic: str, response: Dict) -> Dict:
+        """Start tracking a topic at the level of the learning content"""
+        return await get_io_pool().run(
+            self.progress_store.start_topic, user_id, topic, response.get("difficulty_level", "beginner")
+        )
 
-    def _update_progress_after_answer(self, topic: str, is_correct: bool):
-        """Update progress after answering a question"""
-        if topic in self.user_progress:
-            self.user_progress[topic]["questions_answered"] += 1
-            if is_correct:
-                self.user_progress[topic]["correct_answers"] += 1
-
-            # Adjust difficulty based on performance
-            correct_ratio = self.user_progress[topic]["correct_answers"] / self.user_progress[topic]["questions_answered"]
-            if correct_ratio > 0.8:
-                self.user_progress[topic]["difficulty_level"] = "advanced"
-            elif correct_ratio > 0.6:
-                self.user_progress[topic]["difficulty_level"] = "intermediate"
-            else:
-                self.user_progress[topic]["difficulty_level"] = "beginner" 
\ No newline at end of file
+    async def _update_progress_after_answers(self, user_id: str, topic: str, results: List[bool]) -> Dict:
+        """Count graded answers; the store adapts difficulty to the share answered correctly"""
+        return await get_io_pool().run(
+            self.progress_store.record_answers, user_id, topic, len(results), sum(1 for correct in results if correct)
+        )
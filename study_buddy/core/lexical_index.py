@@ -0,0 +1,151 @@
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .vector_store import filter_clause
+
+_TERM = re.compile(r"\w+")
+# Terms this common match most chunks and add nothing to BM25 but work
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has how in is it of on or that the this to was were what when "
+    "where which who why with".split()
+)
+MAX_QUERY_TERMS = 32
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge rankings of IDs into one, scoring each ID by the sum of 1 / (k + rank).
+
+    Only ranks are used, so rankers whose scores are on different scales
+    (cosine similarity, BM25) combine without calibration.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+
+
+class LexicalIndex:
+    """BM25 keyword index over the stored chunks.
+
+    An SQLite FTS5 inverted index, updated chunk by chunk at ingest, finds
+    the exact terms (formulas, names, acronyms) that embeddings blur.
+    Terms are stemmed, so "reactions" matches "reaction". Each chunk also
+    carries the filter columns of the vector store, so keyword searches
+    can be restricted by document, user or topic the same way. Without
+    FTS5 in the SQLite build the index stays empty and searches find
+    nothing.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS lexical_chunks (
+                id INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                source_id TEXT,
+                user_id TEXT NOT NULL DEFAULT 'default',
+                topic TEXT
+            );
+            CREATE INDEX IF NOT EXISTS lexical_chunks_source_id ON lexical_chunks (source_id);
+            CREATE INDEX IF NOT EXISTS lexical_chunks_user_id ON lexical_chunks (user_id);
+            CREATE INDEX IF NOT EXISTS lexical_chunks_topic ON lexical_chunks (topic);
+            """
+        )
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS lexical_fts USING fts5(document, tokenize='porter unicode61')"
+            )
+            self.enabled = True
+        except sqlite3.OperationalError:
+            self.enabled = False
+        self._conn.commit()
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        """Index chunks; existing IDs are replaced"""
+        if not self.enabled or not ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._delete(ids)
+                for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                    row = self._conn.execute(
+                        "INSERT INTO lexical_chunks (chunk_id, source_id, user_id, topic) VALUES (?, ?, ?, ?)",
+                        (chunk_id, *self._filter_values(metadata))
+                    ).lastrowid
+                    self._conn.execute("INSERT INTO lexical_fts (rowid, document) VALUES (?, ?)", (row, document))
+
+    def delete(self, ids: Sequence[str]):
+        if not self.enabled or not ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._delete(ids)
+
+    def _delete(self, ids: Sequence[str]):
+        ids = list(ids)
+        for offset in range(0, len(ids), 500):
+            batch = ids[offset:offset + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = [(row,) for (row,) in self._conn.execute(
+                f"SELECT id FROM lexical_chunks WHERE chunk_id IN ({placeholders})", batch
+            )]
+            self._conn.executemany("DELETE FROM lexical_fts WHERE rowid = ?", rows)
+            self._conn.executemany("DELETE FROM lexical_chunks WHERE id = ?", rows)
+
+    def update_metadata(self, ids: Sequence[str], metadatas: List[Dict]):
+        """Replace the filter values of indexed chunks"""
+        if not self.enabled or not ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE lexical_chunks SET source_id = ?, user_id = ?, topic = ? WHERE chunk_id = ?",
+                    [(*self._filter_values(metadata), chunk_id) for chunk_id, metadata in zip(ids, metadatas)]
+                )
+
+    @staticmethod
+    def _filter_values(metadata: Dict) -> Tuple:
+        return metadata.get("source_id"), metadata.get("user_id", "default"), metadata.get("topic")
+
+    def search(self, query: str, n_results: int = 10, where: Optional[Dict] = None) -> List[Tuple[str, float]]:
+        """(chunk ID, BM25 score) of the best keyword matches, best first.
+
+        A chunk matches if it contains any query term; `where` restricts the
+        search like the vector store's filter.
+        """
+        expression = self._match_expression(query)
+        if not self.enabled or not expression:
+            return []
+        clause, params = filter_clause(where or {}, prefix="c.")
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT c.chunk_id, bm25(lexical_fts) FROM lexical_fts "
+                "JOIN lexical_chunks c ON c.id = lexical_fts.rowid "
+                f"WHERE lexical_fts MATCH ? AND {clause} "
+                "ORDER BY bm25(lexical_fts) LIMIT ?",
+                [expression, *params, n_results]
+            ).fetchall()
+        # FTS5 reports BM25 negated, so that smaller sorts first
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """FTS5 query matching any of the terms; each is quoted so none reads as an operator"""
+        terms = [term for term in dict.fromkeys(_TERM.findall(query.lower())) if term not in STOPWORDS]
+        return " OR ".join(f'"{term}"' for term in terms[:MAX_QUERY_TERMS])
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM lexical_chunks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
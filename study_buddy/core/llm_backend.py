@@ -0,0 +1,291 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+
+from . import config, metrics
+from .executor import ServiceOverloadedError
+
+
+class LLMBackendError(Exception):
+    """Raised when Ollama rejects a request or every retry failed"""
+
+
+class NoBackendAvailableError(ServiceOverloadedError):
+    """Raised when every Ollama endpoint is unhealthy or has its circuit open"""
+
+    def __init__(self, retry_after: int):
+        Exception.__init__(self, f"No LLM backend is available, retry in {retry_after}s")
+        self.pool_name = "llm"
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops sending requests to an endpoint after repeated failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    the endpoint gets no traffic for `reset_seconds`. Then a single probe
+    request is let through (half-open): success closes the circuit, failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = config.LLM_BREAKER_FAILURES,
+                 reset_seconds: float = config.LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = "half_open"
+        return self.state == "half_open" and not self._probing
+
+    def on_request(self):
+        if self.state == "half_open":
+            self._probing = True
+
+    def release(self):
+        """Give up a probe that ended without a verdict (e.g. a cancelled request)"""
+        self._probing = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class Backend:
+    """One Ollama endpoint with its own connection pool and breaker"""
+
+    def __init__(self, host: str, timeout: httpx.Timeout, limits: httpx.Limits):
+        self.host = host.rstrip("/")
+        self.client = httpx.AsyncClient(base_url=self.host, timeout=timeout, limits=limits)
+        self.breaker = CircuitBreaker()
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency_ewma: Optional[float] = None
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.breaker.allow()
+
+    def record_latency(self, seconds: float):
+        self.latency_ewma = seconds if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * seconds
+
+    def stats(self) -> Dict:
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma_seconds": self.latency_ewma
+        }
+
+
+class LLMBackend:
+    """Ollama client that spreads requests over several endpoints.
+
+    Each endpoint keeps a pool of persistent HTTP connections. Requests go
+    to the available endpoint with the fewest outstanding requests; a
+    request that fails with a connection error, timeout or 5xx is retried
+    on another endpoint. Endpoints are health-checked in the background and
+    taken out of rotation by a circuit breaker when they keep failing.
+
+    `generate` mirrors `ollama.AsyncClient.generate`: it returns the
+    response dict, or with `stream=True` an async iterator of parts.
+    """
+
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, hosts: Sequence[str], timeout_seconds: float = config.LLM_TIMEOUT_SECONDS,
+                 connect_timeout_seconds: float = config.LLM_CONNECT_TIMEOUT_SECONDS,
+                 retries: int = config.LLM_RETRIES, pool_size: int = config.LLM_POOL_SIZE,
+                 health_interval_seconds: float = config.LLM_HEALTH_INTERVAL_SECONDS):
+        timeout = httpx.Timeout(timeout_seconds, connect=connect_timeout_seconds)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.backends = [Backend(host, timeout, limits) for host in hosts]
+        self.retries = retries
+        self.health_interval = health_interval_seconds
+        self._next = 0
+        self._health_task: Optional[asyncio.Task] = None
+        metrics.gauge(
+            "study_buddy_llm_backend_outstanding", "Requests in flight per Ollama endpoint", ("host",),
+            callback=lambda: {(backend.host,): backend.outstanding for backend in self.backends}
+        )
+        metrics.gauge(
+            "study_buddy_llm_backend_available", "Whether each Ollama endpoint is taking requests", ("host",),
+            callback=lambda: {
+                (backend.host,): int(backend.healthy and backend.breaker.state != "open") for backend in self.backends
+            }
+        )
+
+    async def start(self):
+        """Start background health checks"""
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        """Stop health checks and close every connection pool"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        await asyncio.gather(*(backend.client.aclose() for backend in self.backends), return_exceptions=True)
+
+    async def generate(self, model: str, prompt: str, stream: bool = False,
+                       options: Optional[Dict] = None, keep_alive: Optional[str] = None) -> Any:
+        """Call /api/generate on the least loaded available endpoint"""
+        payload = {"model": model, "prompt": prompt, "stream": stream}
+        if options:
+            payload["options"] = options
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if stream:
+            backend, response, started = await self._send(payload, stream=True)
+            return self._iter_stream(backend, response, started)
+        backend, response, started = await self._send(payload, stream=False)
+        try:
+            return response.json()
+        finally:
+            self._finish(backend, started)
+
+    async def _send(self, payload: Dict, stream: bool):
+        """Send a request, retrying other endpoints on retryable failures.
+
+        Returns the endpoint, the (possibly still streaming) response and the
+        start time; the caller must hand the endpoint back with `_finish`.
+        """
+        tried: List[Backend] = []
+        last_error: Optional[Exception] = None
+        for attempt in range(self.retries + 1):
+            backend = self._pick(exclude=tried) or self._pick()
+            if backend is None:
+                break
+            tried.append(backend)
+            backend.breaker.on_request()
+            backend.outstanding += 1
+            backend.requests += 1
+            started = time.perf_counter()
+            try:
+                request = backend.client.build_request("POST", "/api/generate", json=payload)
+                response = await backend.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                self._fail(backend)
+                last_error = e
+            except BaseException:
+                backend.outstanding -= 1
+                backend.breaker.release()
+                raise
+            else:
+                if response.status_code < 400:
+                    return backend, response, started
+                body = (await response.aread()).decode("utf-8", "replace")
+                await response.aclose()
+                if response.status_code not in self.RETRYABLE_STATUS:
+                    # The request itself is bad; another endpoint would reject it too
+                    backend.breaker.record_success()
+                    backend.outstanding -= 1
+                    raise LLMBackendError(f"Ollama returned {response.status_code}: {self._error_message(body)}")
+                self._fail(backend)
+                last_error = LLMBackendError(f"Ollama returned {response.status_code}: {self._error_message(body)}")
+            if attempt < self.retries:
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 1.0))
+        if last_error is None:
+            raise NoBackendAvailableError(config.RETRY_AFTER_SECONDS)
+        raise LLMBackendError(f"LLM request failed after {len(tried)} attempt(s): {str(last_error)}")
+
+    async def _iter_stream(self, backend: Backend, response: httpx.Response, started: float) -> AsyncIterator[Dict]:
+        failed = False
+        try:
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                part = json.loads(line)
+                if "error" in part:
+                    raise LLMBackendError(part["error"])
+                yield part
+        except httpx.TransportError as e:
+            failed = True
+            raise LLMBackendError(f"LLM stream interrupted: {str(e)}")
+        finally:
+            await response.aclose()
+            if failed:
+                self._fail(backend)
+            else:
+                self._finish(backend, started)
+
+    def _pick(self, exclude: Sequence[Backend] = ()) -> Optional[Backend]:
+        """Available endpoint with the fewest outstanding requests, rotating on ties"""
+        candidates = [backend for backend in self.backends if backend not in exclude and backend.available]
+        if not candidates:
+            return None
+        self._next = (self._next + 1) % len(self.backends)
+        return min(
+            candidates,
+            key=lambda backend: (backend.outstanding, (self.backends.index(backend) - self._next) % len(self.backends))
+        )
+
+    def _finish(self, backend: Backend, started: float):
+        backend.outstanding -= 1
+        backend.breaker.record_success()
+        backend.record_latency(time.perf_counter() - started)
+
+    def _fail(self, backend: Backend):
+        backend.outstanding -= 1
+        backend.failures += 1
+        backend.breaker.record_failure()
+
+    @staticmethod
+    def _error_message(body: str) -> str:
+        try:
+            return json.loads(body).get("error", body)
+        except (ValueError, AttributeError):
+            return body
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(self._check(backend) for backend in self.backends))
+            await asyncio.sleep(self.health_interval)
+
+    async def _check(self, backend: Backend):
+        try:
+            response = await backend.client.get("/api/tags", timeout=config.LLM_CONNECT_TIMEOUT_SECONDS)
+            healthy = response.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        if healthy and not backend.healthy and backend.breaker.state == "open":
+            # Recovered endpoints get their probe request straight away
+            backend.breaker.opened_at = 0.0
+        backend.healthy = healthy
+
+    def stats(self) -> Dict:
+        return {"backends": [backend.stats() for backend in self.backends]}
+
+
+_llm_backend: Optional[LLMBackend] = None
+
+
+def get_llm_backend() -> LLMBackend:
+    """Shared client for the configured Ollama endpoints"""
+    global _llm_backend
+    if _llm_backend is None:
+        _llm_backend = LLMBackend(config.OLLAMA_HOSTS)
+    return _llm_backend
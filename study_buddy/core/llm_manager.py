@@ -1,11 +1,38 @@
-import ollama
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Sequence
 import json
+import time
+from . import config
+from . import metrics
+from .context_builder import get_token_counter
+from .executor import ServiceOverloadedError, get_llm_limiter
+from .llm_backend import get_llm_backend
+from .json_stream import IncrementalJSONParser
+from .response_cache import ResponseCache
+
+LLM_TOKENS = metrics.counter("study_buddy_llm_tokens_total", "Tokens processed by Ollama", ("kind",))
+
+# Durations Ollama reports with each response (in nanoseconds), as stages
+OLLAMA_DURATIONS = (
+    ("load_duration", "llm_load"),
+    ("prompt_eval_duration", "llm_prefill"),
+    ("eval_duration", "llm_generation")
+)
 
 class LLMManager:
     def __init__(self):
         self.model = "llama2:8b"
-        self.context_window = 4096
+        self.client = get_llm_backend()
+        self.limiter = get_llm_limiter()
+        self.response_cache = ResponseCache(
+            max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=config.RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+            ttl_seconds=config.RESPONSE_CACHE_TTL_SECONDS,
+            similarity_threshold=config.RESPONSE_CACHE_SIMILARITY,
+            persist_path=config.RESPONSE_CACHE_PATH or None
+        ) if config.RESPONSE_CACHE_ENABLED else None
+        self.context_window = config.CONTEXT_WINDOW
+        self.response_tokens = config.RESPONSE_TOKENS
+        self.token_counter = get_token_counter()
         self.temperature = 0.7
         self.system_prompts = {
             "learning": """You are an expert tutor helping a student learn. Your goal is to:
@@ -16,6 +43,7 @@ class LLMManager:
 5. Encourage active recall
 
 Current topic: {topic}
+Target difficulty: {difficulty}
 Context from notes: {context}
 
 Respond in JSON format with the following structure:
@@ -54,25 +82,140 @@ Respond in JSON format with the following structure:
 }"""
         }
 
-    async def generate_response(self, mode: str, topic: str, context: Optional[str] = None) -> Dict:
-        """Generate a response using the LLM based on the specified mode and context"""
-        prompt = self.system_prompts[mode].format(
-            topic=topic,
-            context=context or "No additional context provided"
-        )
+    async def generate_response(self, mode: str, topic: str, context: Optional[str] = None,
+                                topic_embedding: Optional[Sequence[float]] = None,
+                                difficulty: Optional[str] = None, use_cache: bool = True,
+                                cache_scope: Optional[str] = None) -> Dict:
+        """Generate a response using the LLM based on the specified mode and context.
+
+        Responses are served from the response cache when the same (or, given
+        `topic_embedding`, a near-identical) topic was asked over the same
+        context at the same difficulty. For retrieved context, `cache_scope`
+        (see `DocumentProcessor.retrieval_scope`) is compared instead.
+        """
+        cache_mode = self._cache_mode(mode, difficulty)
+        if use_cache:
+            cached = self._cache_get(cache_mode, topic, context, topic_embedding, cache_scope)
+            if cached is not None:
+                return cached
+
+        prompt = self._build_prompt(mode, topic, context, difficulty)
         
         try:
-            response = ollama.generate(
-                model=self.model,
-                prompt=prompt,
-                temperature=self.temperature
-            )
+            response = await self._generate(prompt, self.temperature)
             
             # Parse the JSON response
-            return json.loads(response['response'])
+            parsed = self._parse(response['response'])
+            if use_cache:
+                self._cache_put(cache_mode, topic, context, parsed, topic_embedding, cache_scope)
+            return parsed
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
             raise Exception(f"Error generating response: {str(e)}")
 
+    async def stream_response(self, mode: str, topic: str, context: Optional[str] = None,
+                              topic_embedding: Optional[Sequence[float]] = None,
+                              difficulty: Optional[str] = None,
+                              cache_scope: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream the raw response text for a mode as tokens arrive.
+
+        A cached response is replayed as a single chunk.
+        """
+        cache_mode = self._cache_mode(mode, difficulty)
+        cached = self._cache_get(cache_mode, topic, context, topic_embedding, cache_scope)
+        if cached is not None:
+            yield json.dumps(cached)
+            return
+
+        prompt = self._build_prompt(mode, topic, context, difficulty)
+        parts = []
+        queued = time.perf_counter()
+        async with self.limiter.slot():
+            metrics.record("llm_queue", time.perf_counter() - queued)
+            try:
+                with metrics.span("llm_generate"):
+                    started = time.perf_counter()
+                    stream = await self.client.generate(
+                        model=self.model,
+                        prompt=prompt,
+                        stream=True,
+                        options=self._options(self.temperature)
+                    )
+                    async for part in stream:
+                        if part.get("response"):
+                            if not parts:
+                                metrics.record("llm_first_token", time.perf_counter() - started)
+                            parts.append(part["response"])
+                            yield part["response"]
+                        if part.get("done"):
+                            self._record_usage(part)
+            except ServiceOverloadedError:
+                raise
+            except Exception as e:
+                raise Exception(f"Error generating response: {str(e)}")
+
+        parser = IncrementalJSONParser()
+        parser.feed("".join(parts))
+        try:
+            self._cache_put(cache_mode, topic, context, parser.result(), topic_embedding, cache_scope)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def _cache_mode(mode: str, difficulty: Optional[str]) -> str:
+        """Cache namespace for a mode; responses differ per target difficulty"""
+        return f"{mode}:{difficulty}" if difficulty else mode
+
+    def _cache_get(self, mode: str, topic: str, context: Optional[str],
+                   topic_embedding: Optional[Sequence[float]], scope: Optional[str] = None) -> Optional[Dict]:
+        if self.response_cache is None:
+            return None
+        with metrics.span("cache_lookup"):
+            return self.response_cache.get(
+                self.model, mode, topic, context, self.temperature, topic_embedding, scope
+            )
+
+    def _cache_put(self, mode: str, topic: str, context: Optional[str], response: Dict,
+                   topic_embedding: Optional[Sequence[float]], scope: Optional[str] = None):
+        if self.response_cache is not None:
+            self.response_cache.put(
+                self.model, mode, topic, context, self.temperature, response, topic_embedding, scope
+            )
+
+    def context_budget(self, mode: str, topic: str = "", difficulty: Optional[str] = None) -> int:
+        """Prompt tokens left for context once the template and the response are accounted for"""
+        if config.CONTEXT_TOKEN_BUDGET:
+            return config.CONTEXT_TOKEN_BUDGET
+        template = self._fill_template(mode, topic, "", difficulty)
+        return max(0, self.context_window - self.response_tokens - self.token_counter.count(template))
+
+    def _build_prompt(self, mode: str, topic: str, context: Optional[str] = None,
+                      difficulty: Optional[str] = None) -> str:
+        """Fill in the prompt template for a mode.
+
+        Context that would push the prompt past the context window is cut
+        to fit, so Ollama never silently truncates the start of the prompt.
+        """
+        with metrics.span("prompt_build"):
+            if context:
+                context = self.token_counter.truncate(context, self.context_budget(mode, topic, difficulty))
+            return self._fill_template(mode, topic, context or "No additional context provided", difficulty)
+
+    def _fill_template(self, mode: str, topic: str, context: str, difficulty: Optional[str]) -> str:
+        """Substitute the placeholders of a mode's template.
+
+        The templates contain literal JSON braces, so placeholders are
+        substituted directly rather than through str.format.
+        """
+        return self.system_prompts[mode].replace(
+            "{topic}", topic
+        ).replace(
+            "{difficulty}", difficulty or "match the student's level"
+        ).replace(
+            "{context}", context
+        )
+
     async def evaluate_answer(self, question: Dict, user_answer: str) -> Dict:
         """Evaluate a user's answer to a question"""
         prompt = f"""Evaluate the following answer to a question:
@@ -89,12 +232,100 @@ Provide feedback in JSON format:
 }}"""
 
         try:
-            response = ollama.generate(
-                model=self.model,
-                prompt=prompt,
-                temperature=0.3  # Lower temperature for more consistent evaluation
-            )
+            response = await self._generate(prompt, 0.3)  # Lower temperature for more consistent evaluation
             
-            return json.loads(response['response'])
+            return self._parse(response['response'])
+        except ServiceOverloadedError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error evaluating answer: {str(e)}")
+
+    async def evaluate_answers(self, items: List[Dict]) -> List[Dict]:
+        """Evaluate several answers in a single generation.
+
+        Each item holds a `question` and a `user_answer`. Returns one
+        evaluation per item, in order.
+        """
+        answers = "\n\n".join(
+            f"""[{index}]
+Question: {item['question']['question']}
+Correct Answer: {item['question'].get('correct_answer', '')}
+User's Answer: {item['user_answer']}"""
+            for index, item in enumerate(items)
+        )
+        prompt = f"""Evaluate each of the following answers to quiz questions:
+
+{answers}
+
+Provide feedback in JSON format, with one verdict per answer:
+{{
+    "verdicts": [
+        {{
+            "index": 0,
+            "is_correct": true/false,
+            "feedback": "Detailed feedback on the answer",
+            "suggested_improvements": ["List of suggestions"]
+        }}
+    ]
+}}"""
+
+        try:
+            response = await self._generate(prompt, 0.3)  # Lower temperature for more consistent evaluation
+
+            verdicts = self._parse(response['response']).get("verdicts", [])
+            by_index = {}
+            for position, verdict in enumerate(verdicts):
+                by_index.setdefault(verdict.get("index", position), verdict)
+            return [
+                {
+                    "is_correct": bool(by_index.get(index, {}).get("is_correct", False)),
+                    "feedback": by_index.get(index, {}).get("feedback", "No feedback was returned for this answer"),
+                    "suggested_improvements": by_index.get(index, {}).get("suggested_improvements", [])
+                }
+                for index in range(len(items))
+            ]
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
-            raise Exception(f"Error evaluating answer: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error evaluating answers: {str(e)}")
+
+    async def warm_up(self):
+        """Ask Ollama to load the model into memory before the first request"""
+        await self.client.generate(
+            model=self.model,
+            prompt="",
+            options=self._options(self.temperature),
+            keep_alive=config.OLLAMA_KEEP_ALIVE
+        )
+
+    async def _generate(self, prompt: str, temperature: float) -> Dict:
+        """Send a prompt to Ollama through the bounded, load-balanced client"""
+        queued = time.perf_counter()
+        async with self.limiter.slot():
+            metrics.record("llm_queue", time.perf_counter() - queued)
+            with metrics.span("llm_generate"):
+                response = await self.client.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    options=self._options(temperature)
+                )
+        self._record_usage(response)
+        return response
+
+    @staticmethod
+    def _record_usage(response: Dict):
+        """Record the load, prefill and generation time and token counts Ollama reports"""
+        for field, stage in OLLAMA_DURATIONS:
+            if response.get(field):
+                metrics.record(stage, response[field] / 1e9)
+        LLM_TOKENS.inc(response.get("prompt_eval_count") or 0, kind="prompt")
+        LLM_TOKENS.inc(response.get("eval_count") or 0, kind="completion")
+
+    @staticmethod
+    def _parse(text: str) -> Dict:
+        with metrics.span("json_parse"):
+            return json.loads(text)
+
+    def _options(self, temperature: float) -> Dict:
+        # Ollama reloads the model when num_ctx changes, so every call sends the same window
+        return {"temperature": temperature, "num_ctx": self.context_window} 
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""OCR helpers executed inside the OCR process pool.
+
+This module is kept free of heavy imports so that pool workers start quickly
+and never load the embedding model.
+"""
+import hashlib
+import importlib
+import subprocess
+import time
+from typing import AbstractSet, Dict, List, Optional, Tuple
+
+
+def warm_up(engine: str = "pytesseract") -> bool:
+    """Import the OCR libraries in a pool worker ahead of the first document"""
+    import pdf2image  # noqa: F401
+    from PIL import Image  # noqa: F401
+    importlib.import_module(engine)
+    return True
+
+
+def ocr_image_file(file_path: str, engine: str = "pytesseract") -> str:
+    """Run the OCR engine (Tesseract by default) on an image file"""
+    from PIL import Image
+
+    with Image.open(file_path) as image:
+        return importlib.import_module(engine).image_to_string(image)
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Return the number of pages in a PDF"""
+    from pdf2image import pdfinfo_from_path
+
+    return int(pdfinfo_from_path(file_path)["Pages"])
+
+
+def extract_text_layer(file_path: str, first_page: int, last_page: int) -> List[str]:
+    """Read the embedded text layer of a page range with poppler's pdftotext.
+
+    Returns one string per page, empty when the page has no text layer or
+    pdftotext is unavailable.
+    """
+    page_total = last_page - first_page + 1
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-f", str(first_page), "-l", str(last_page), "-layout", file_path, "-"],
+            capture_output=True,
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return [""] * page_total
+
+    # pdftotext terminates every page with a form feed
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")[:page_total]
+    return pages + [""] * (page_total - len(pages))
+
+
+def process_pdf_pages(file_path: str, first_page: int, last_page: int,
+                      dpi: int = 200, min_text_chars: int = 25,
+                      known_hashes: AbstractSet[str] = frozenset(), engine: str = "pytesseract"
+                      ) -> List[Tuple[int, Optional[str], str, str, Dict[str, float]]]:
+    """Extract text for a small range of PDF pages.
+
+    Pages with a usable text layer are returned as-is; only the remaining
+    pages are rasterised. A rendered page whose hash is in `known_hashes` was
+    already OCR'd in a previous version of the document and is returned with
+    text None instead of being OCR'd again.
+
+    Returns (page_number, text, method, page_hash, timings) tuples in page
+    order, where method is "text", "ocr" or "cached" and timings holds the
+    seconds each stage spent on the page. `engine` names the module whose
+    image_to_string does the OCR.
+    """
+    from pdf2image import convert_from_path
+
+    ocr_engine = importlib.import_module(engine)
+
+    start = time.perf_counter()
+    layer = extract_text_layer(file_path, first_page, last_page)
+    layer_seconds = (time.perf_counter() - start) / len(layer)
+    results = {}
+    needs_ocr = []
+    for offset, text in enumerate(layer):
+        page = first_page + offset
+        if len(text.strip()) >= min_text_chars:
+            page_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            results[page] = (page, text, "text", page_hash, {"pdf_text_layer": layer_seconds})
+        else:
+            needs_ocr.append(page)
+
+    # Render contiguous runs of scanned pages so only this batch is ever in memory
+    runs = []
+    for page in needs_ocr:
+        if runs and runs[-1][1] == page - 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    for run_first, run_last in runs:
+        start = time.perf_counter()
+        images = convert_from_path(file_path, dpi=dpi, first_page=run_first, last_page=run_last)
+        render_seconds = (time.perf_counter() - start) / max(len(images), 1)
+        for page, image in zip(range(run_first, run_last + 1), images):
+            timings = {"pdf_text_layer": layer_seconds, "pdf_render": render_seconds}
+            page_hash = hashlib.sha256(image.tobytes()).hexdigest()
+            if page_hash in known_hashes:
+                results[page] = (page, None, "cached", page_hash, timings)
+            else:
+                start = time.perf_counter()
+                text = ocr_engine.image_to_string(image)
+                timings["ocr_page"] = time.perf_counter() - start
+                results[page] = (page, text, "ocr", page_hash, timings)
+            image.close()
+
+    return [results[page] for page in sorted(results)]
@@ -0,0 +1,323 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import config, metrics
+from .executor import get_io_pool
+
+DIFFICULTY_LEVELS = ("beginner", "intermediate", "advanced")
+DEFAULT_USER = "default"
+
+
+def difficulty_for(answered: int, correct: int) -> int:
+    """Difficulty level (index into DIFFICULTY_LEVELS) earned by a record of answers"""
+    ratio = correct / answered
+    if ratio > 0.8:
+        return 2
+    if ratio > 0.6:
+        return 1
+    return 0
+
+
+class ProgressRecord:
+    """One learner's progress on one topic, including changes not yet written"""
+
+    __slots__ = (
+        "tracked", "answered", "correct", "difficulty", "badges",
+        "created", "pending_answered", "pending_correct", "pending_badges", "loaded_at"
+    )
+
+    def __init__(self, tracked: bool, answered: int, correct: int, difficulty: int, badges: List[str]):
+        self.tracked = tracked
+        self.answered = answered
+        self.correct = correct
+        self.difficulty = difficulty
+        self.badges = badges
+        self.created = False
+        self.pending_answered = 0
+        self.pending_correct = 0
+        self.pending_badges: List[str] = []
+        self.loaded_at = time.monotonic()
+
+    @property
+    def dirty(self) -> bool:
+        return self.created or self.pending_answered > 0 or bool(self.pending_badges)
+
+    def to_dict(self) -> Dict:
+        return {
+            "questions_answered": self.answered,
+            "correct_answers": self.correct,
+            "difficulty_level": DIFFICULTY_LEVELS[self.difficulty]
+        }
+
+
+class ProgressStore:
+    """Per-user progress and badges, persisted in SQLite.
+
+    Records are keyed by (user, topic) and kept in a bounded LRU cache in
+    front of the database. Changes are written back in batches: every
+    `flush_seconds`, once `flush_batch` records are dirty, or before a dirty
+    record is evicted. Answer counts are written as increments merged by an
+    upsert, and difficulty is recomputed from the merged totals, so several
+    server processes can share one database without losing updates. Clean
+    cached records are re-read after `refresh_seconds` to pick up changes
+    made by other processes.
+    """
+
+    UPSERT = """
+        INSERT INTO progress (user_id, topic, questions_answered, correct_answers, difficulty, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, topic) DO UPDATE SET
+            questions_answered = questions_answered + excluded.questions_answered,
+            correct_answers = correct_answers + excluded.correct_answers,
+            difficulty = CASE
+                WHEN excluded.questions_answered = 0 THEN difficulty
+                WHEN (correct_answers + excluded.correct_answers) * 1.0
+                     / (questions_answered + excluded.questions_answered) > 0.8 THEN 2
+                WHEN (correct_answers + excluded.correct_answers) * 1.0
+                     / (questions_answered + excluded.questions_answered) > 0.6 THEN 1
+                ELSE 0
+            END,
+            updated_at = excluded.updated_at
+    """
+
+    def __init__(self, path: str, max_entries: int = config.PROGRESS_CACHE_ENTRIES,
+                 flush_batch: int = config.PROGRESS_FLUSH_BATCH,
+                 flush_seconds: float = config.PROGRESS_FLUSH_SECONDS,
+                 refresh_seconds: float = config.PROGRESS_REFRESH_SECONDS):
+        self.max_entries = max_entries
+        self.flush_batch = flush_batch
+        self.flush_seconds = flush_seconds
+        self.refresh_seconds = refresh_seconds
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self._records: "OrderedDict[Tuple[str, str], ProgressRecord]" = OrderedDict()
+        self._dirty: set = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS progress (
+                user_id TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                questions_answered INTEGER NOT NULL,
+                correct_answers INTEGER NOT NULL,
+                difficulty INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (user_id, topic)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS badges (
+                user_id TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                badge TEXT NOT NULL,
+                awarded_at REAL NOT NULL,
+                PRIMARY KEY (user_id, topic, badge)
+            );
+            """
+        )
+        self._conn.commit()
+        metrics.gauge(
+            "study_buddy_progress_records", "Learner progress records held in memory, by state", ("state",),
+            callback=lambda: {("cached",): len(self._records), ("dirty",): len(self._dirty)}
+        )
+
+    async def start(self):
+        """Start the periodic flush"""
+        if self._task is None and self.flush_seconds > 0:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the periodic flush and write out everything pending"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await get_io_pool().run(self.flush)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Pending changes stay cached and are retried on the next flush
+                pass
+
+    def progress(self, user_id: str, topic: str) -> Dict:
+        """Progress on a topic; a topic never studied reports zeros at beginner level"""
+        with self._lock:
+            return self._record(user_id, topic).to_dict()
+
+    def difficulty(self, user_id: str, topic: str) -> str:
+        with self._lock:
+            return DIFFICULTY_LEVELS[self._record(user_id, topic).difficulty]
+
+    def start_topic(self, user_id: str, topic: str, difficulty_level: str = "beginner") -> Dict:
+        """Start tracking a topic at the given level, unless it is already tracked"""
+        with self._lock:
+            record = self._record(user_id, topic)
+            if not record.tracked:
+                record.tracked = True
+                record.created = True
+                if difficulty_level in DIFFICULTY_LEVELS:
+                    record.difficulty = DIFFICULTY_LEVELS.index(difficulty_level)
+                self._mark_dirty(user_id, topic)
+            return record.to_dict()
+
+    def record_answers(self, user_id: str, topic: str, answered: int, correct: int) -> Dict:
+        """Count graded answers on a topic and adapt its difficulty.
+
+        Answering starts tracking a topic not tracked yet: the request that
+        started it may have gone to another process that has not written it.
+        """
+        with self._lock:
+            record = self._record(user_id, topic)
+            if answered > 0:
+                if not record.tracked and not record.dirty:
+                    # Re-read first, in case it was written since being cached
+                    del self._records[(user_id, topic)]
+                    record = self._record(user_id, topic)
+                if not record.tracked:
+                    record.tracked = True
+                    record.created = True
+                record.answered += answered
+                record.correct += correct
+                record.pending_answered += answered
+                record.pending_correct += correct
+                record.difficulty = difficulty_for(record.answered, record.correct)
+                self._mark_dirty(user_id, topic)
+            return record.to_dict()
+
+    def add_badges(self, user_id: str, topic: str, badges: Sequence[str]) -> List[str]:
+        """Award badges on a topic and return every badge earned on it"""
+        with self._lock:
+            record = self._record(user_id, topic)
+            new = [badge for badge in dict.fromkeys(badges) if badge not in record.badges]
+            if new:
+                record.badges.extend(new)
+                record.pending_badges.extend(new)
+                self._mark_dirty(user_id, topic)
+            return list(record.badges)
+
+    def user_progress(self, user_id: str) -> Dict[str, Dict]:
+        """Progress and badges of every topic a user has studied"""
+        self.flush()
+        with self._lock:
+            progress = self._conn.execute(
+                "SELECT topic, questions_answered, correct_answers, difficulty FROM progress WHERE user_id = ?",
+                (user_id,)
+            ).fetchall()
+            badges = self._conn.execute(
+                "SELECT topic, badge FROM badges WHERE user_id = ? ORDER BY rowid", (user_id,)
+            ).fetchall()
+        topics: Dict[str, Dict] = {}
+        for topic, answered, correct, difficulty in progress:
+            topics[topic] = {
+                "questions_answered": answered,
+                "correct_answers": correct,
+                "difficulty_level": DIFFICULTY_LEVELS[difficulty],
+                "badges": []
+            }
+        for topic, badge in badges:
+            topics.setdefault(topic, {"badges": []})["badges"].append(badge)
+        return topics
+
+    def flush(self) -> int:
+        """Write every dirty record in one transaction; returns how many were written"""
+        with self._lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        if not self._dirty:
+            return 0
+        now = time.time()
+        progress_rows, badge_rows = [], []
+        records = [(key, self._records[key]) for key in self._dirty]
+        for (user_id, topic), record in records:
+            if record.created or record.pending_answered:
+                progress_rows.append((
+                    user_id, topic, record.pending_answered, record.pending_correct, record.difficulty, now
+                ))
+            badge_rows.extend((user_id, topic, badge, now) for badge in record.pending_badges)
+        with self._conn:
+            self._conn.executemany(self.UPSERT, progress_rows)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO badges (user_id, topic, badge, awarded_at) VALUES (?, ?, ?, ?)", badge_rows
+            )
+        for _, record in records:
+            record.created = False
+            record.pending_answered = 0
+            record.pending_correct = 0
+            record.pending_badges = []
+        self._dirty.clear()
+        self.flushes += 1
+        return len(records)
+
+    def _mark_dirty(self, user_id: str, topic: str):
+        self._dirty.add((user_id, topic))
+        if len(self._dirty) >= self.flush_batch:
+            self._flush()
+
+    def _record(self, user_id: str, topic: str) -> ProgressRecord:
+        """Cached record, loaded from the database on a miss or when stale"""
+        key = (user_id, topic)
+        record = self._records.get(key)
+        if record is not None:
+            if record.dirty or time.monotonic() - record.loaded_at < self.refresh_seconds:
+                self._records.move_to_end(key)
+                self.hits += 1
+                return record
+            del self._records[key]
+        self.misses += 1
+        record = self._load(user_id, topic)
+        self._records[key] = record
+        self._evict()
+        return record
+
+    def _load(self, user_id: str, topic: str) -> ProgressRecord:
+        row = self._conn.execute(
+            "SELECT questions_answered, correct_answers, difficulty FROM progress WHERE user_id = ? AND topic = ?",
+            (user_id, topic)
+        ).fetchone()
+        badges = [badge for (badge,) in self._conn.execute(
+            "SELECT badge FROM badges WHERE user_id = ? AND topic = ? ORDER BY rowid", (user_id, topic)
+        )]
+        if row is None:
+            return ProgressRecord(False, 0, 0, 0, badges)
+        return ProgressRecord(True, row[0], row[1], row[2], badges)
+
+    def _evict(self):
+        """Drop least recently used records beyond the cache size, writing back dirty ones first"""
+        while len(self._records) > self.max_entries:
+            key = next(iter(self._records))
+            if key in self._dirty:
+                self._flush()
+            del self._records[key]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "cached": len(self._records),
+                "dirty": len(self._dirty),
+                "hits": self.hits,
+                "misses": self.misses,
+                "flushes": self.flushes,
+                "max_entries": self.max_entries
+            }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
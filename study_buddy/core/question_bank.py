@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from . import config
+from .document_processor import DocumentProcessor
+from .executor import get_io_pool
+from .llm_manager import LLMManager
+from .progress_store import DEFAULT_USER, DIFFICULTY_LEVELS
+
+
+class QuestionBank:
+    """Pre-generated learning content per topic and difficulty level.
+
+    When a document is ingested, generation for each of its topics at every
+    difficulty level is queued at low priority: the background worker only
+    calls the LLM while no live request is using it. Learning requests take
+    entries from the bank and trigger an asynchronous refill. Only topics of
+    scheduled (shared) documents are ever generated; refills of any other
+    topic are ignored.
+    """
+
+    def __init__(self, path: str, llm_manager: LLMManager, document_processor: DocumentProcessor,
+                 depth: int = config.QUESTION_BANK_DEPTH, idle_poll_seconds: float = 0.5):
+        self.llm_manager = llm_manager
+        self.document_processor = document_processor
+        self.depth = depth
+        self.idle_poll_seconds = idle_poll_seconds
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS question_bank (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS question_bank_topic ON question_bank (topic, difficulty);
+            CREATE INDEX IF NOT EXISTS question_bank_document ON question_bank (document_id);
+            -- Generated for topics that came from no document, without notes to ground them
+            DELETE FROM question_bank WHERE document_id = '';
+            """
+        )
+        self._conn.commit()
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: set = set()
+        self._topic_documents: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the background generation worker"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        """Stop the background generation worker"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def schedule_document(self, document_id: str, topics: List[str]):
+        """Queue bank generation for every topic of an ingested document"""
+        self._forget_stale_topics(document_id, topics)
+        for topic in topics:
+            self._topic_documents[topic] = document_id
+            for difficulty in DIFFICULTY_LEVELS:
+                self.request_refill(topic, difficulty)
+
+    def request_refill(self, topic: str, difficulty: str):
+        """Queue generation for a topic and difficulty unless already queued"""
+        if self._queue is None or (topic, difficulty) in self._queued:
+            return
+        self._queued.add((topic, difficulty))
+        self._queue.put_nowait((topic, difficulty))
+
+    async def take(self, topic: str, difficulty: str, document_id: Optional[str] = None) -> Optional[Dict]:
+        """Remove and return one banked response, from one document if given, refilling in the background"""
+        response = await get_io_pool().run(self._pop, topic, difficulty, document_id)
+        if response is not None:
+            self.request_refill(topic, difficulty)
+        return response
+
+    def count(self, topic: str, difficulty: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM question_bank WHERE topic = ? AND difficulty = ?",
+                (topic, difficulty)
+            ).fetchone()[0]
+
+    def _pop(self, topic: str, difficulty: str, document_id: Optional[str] = None) -> Optional[Dict]:
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute(
+                    "SELECT id, response FROM question_bank WHERE topic = ? AND difficulty = ? "
+                    "AND (? IS NULL OR document_id = ?) ORDER BY id LIMIT 1",
+                    (topic, difficulty, document_id, document_id)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute("DELETE FROM question_bank WHERE id = ?", (row[0],))
+        return json.loads(row[1])
+
+    def _add(self, document_id: str, topic: str, difficulty: str, response: Dict):
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO question_bank (document_id, topic, difficulty, response, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (document_id, topic, difficulty, json.dumps(response), time.time())
+                )
+
+    def _document_for(self, topic: str) -> Optional[str]:
+        """Scheduled document a topic came from, falling back to earlier bank entries.
+
+        Bank entries are only written for scheduled topics, so they cover
+        topics scheduled before a restart or by another server process.
+        """
+        if topic not in self._topic_documents:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT document_id FROM question_bank WHERE topic = ? LIMIT 1", (topic,)
+                ).fetchone()
+            if row is None:
+                # Not cached: free-form topics would grow the map without bound
+                return None
+            self._topic_documents[topic] = row[0]
+        return self._topic_documents[topic]
+
+    def _forget_stale_topics(self, document_id: str, topics: List[str]):
+        """Drop banked content for topics a new document version no longer has"""
+        placeholders = ",".join("?" * len(topics))
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    f"DELETE FROM question_bank WHERE document_id = ? AND topic NOT IN ({placeholders})",
+                    (document_id, *topics)
+                )
+
+    async def _worker(self):
+        while True:
+            topic, difficulty = await self._queue.get()
+            try:
+                # Refills are requested for whatever topic a learner asks about;
+                # anything but a scheduled document's topic has no notes to bank
+                document_id = await get_io_pool().run(self._document_for, topic)
+                while document_id and await get_io_pool().run(self.count, topic, difficulty) < self.depth:
+                    await self._wait_for_idle_llm()
+                    response = await self._generate(document_id, topic, difficulty)
+                    await get_io_pool().run(self._add, document_id, topic, difficulty, response)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Banking is best-effort; live generation covers any gap
+                pass
+            finally:
+                self._queued.discard((topic, difficulty))
+
+    async def _wait_for_idle_llm(self):
+        """Yield to live traffic: only generate while the LLM is otherwise unused"""
+        while self.llm_manager.limiter.pending > 0:
+            await asyncio.sleep(self.idle_poll_seconds)
+
+    async def _generate(self, document_id: str, topic: str, difficulty: str) -> Dict:
+        # Banked content is served to every learner, so only shared notes are searched.
+        # Topics are labels extracted from the document, so the search is kept to that
+        # topic's chunks, unless they were stored before chunks carried their topic.
+        budget = self.llm_manager.context_budget("learning", topic, difficulty)
+        context = await self.document_processor.get_relevant_context(
+            topic, budget, document_id=document_id, user_id=DEFAULT_USER, topic_filter=topic
+        )
+        if not context:
+            context = await self.document_processor.get_relevant_context(
+                topic, budget, document_id=document_id, user_id=DEFAULT_USER
+            )
+        return await self.llm_manager.generate_response(
+            mode="learning",
+            topic=topic,
+            context=context,
+            difficulty=difficulty,
+            use_cache=False
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
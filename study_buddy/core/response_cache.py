@@ -0,0 +1,183 @@
+import copy
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+class ResponseCache:
+    """LRU + TTL cache of parsed LLM responses with near-duplicate matching.
+
+    An exact hit requires the same model, mode, topic, context and
+    temperature. A semantic hit requires everything but the topic to match,
+    plus a topic embedding whose cosine similarity to a cached topic is at
+    least `similarity_threshold`. Context retrieved for the topic differs
+    with the topic's wording, so such requests pass the retrieval `scope`
+    (what was searched, and the version of the notes) instead, and it
+    replaces the context in both comparisons. Memory is bounded by both
+    entry count and an estimate of the bytes held.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float,
+                 similarity_threshold: float, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.persist_path = persist_path
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.groups: Dict[str, List[str]] = {}
+        self.bytes = 0
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        if persist_path:
+            self.load()
+
+    @staticmethod
+    def _group_key(model: str, mode: str, context: Optional[str], temperature: float,
+                   scope: Optional[str] = None) -> str:
+        if scope is not None:
+            return f"{model}|{mode}|scope:{scope}|{temperature}"
+        context_hash = hashlib.sha256((context or "").encode("utf-8")).hexdigest()
+        return f"{model}|{mode}|{context_hash}|{temperature}"
+
+    @staticmethod
+    def _normalise_topic(topic: str) -> str:
+        return " ".join(topic.lower().split())
+
+    def get(self, model: str, mode: str, topic: str, context: Optional[str], temperature: float,
+            topic_embedding: Optional[Sequence[float]] = None, scope: Optional[str] = None) -> Optional[Dict]:
+        """Return a cached response for an identical or near-identical request"""
+        group = self._group_key(model, mode, context, temperature, scope)
+        key = f"{group}|{self._normalise_topic(topic)}"
+        now = time.time()
+
+        entry = self.entries.get(key)
+        if entry is not None and self._expired(key, entry, now):
+            entry = None
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.counters["exact_hits"] += 1
+            return copy.deepcopy(entry["response"])
+
+        if topic_embedding is not None and self.groups.get(group):
+            query = self._unit(topic_embedding)
+            candidates = []
+            for candidate in list(self.groups[group]):
+                candidate_entry = self.entries.get(candidate)
+                if candidate_entry is None or self._expired(candidate, candidate_entry, now):
+                    continue
+                if candidate_entry["embedding"] is not None:
+                    candidates.append(candidate)
+            if candidates:
+                matrix = np.vstack([self.entries[candidate]["embedding"] for candidate in candidates])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self.entries.move_to_end(candidates[best])
+                    self.counters["semantic_hits"] += 1
+                    return copy.deepcopy(self.entries[candidates[best]]["response"])
+
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, model: str, mode: str, topic: str, context: Optional[str], temperature: float,
+            response: Dict, topic_embedding: Optional[Sequence[float]] = None, scope: Optional[str] = None):
+        """Cache a parsed response"""
+        group = self._group_key(model, mode, context, temperature, scope)
+        key = f"{group}|{self._normalise_topic(topic)}"
+        embedding = self._unit(topic_embedding) if topic_embedding is not None else None
+        size = len(json.dumps(response)) + len(key) + (embedding.nbytes if embedding is not None else 0)
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = {
+            "group": group,
+            "response": response,
+            "embedding": embedding,
+            "size": size,
+            "expires_at": time.time() + self.ttl_seconds
+        }
+        self.groups.setdefault(group, []).append(key)
+        self.bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.counters["evictions"] += 1
+
+    def stats(self) -> Dict:
+        return dict(self.counters, entries=len(self.entries), bytes=self.bytes)
+
+    def _expired(self, key: str, entry: Dict, now: float) -> bool:
+        if entry["expires_at"] > now:
+            return False
+        self._remove(key)
+        self.counters["expirations"] += 1
+        return True
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        self.bytes -= entry["size"]
+        members = self.groups.get(entry["group"], [])
+        if key in members:
+            members.remove(key)
+        if not members:
+            self.groups.pop(entry["group"], None)
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def save(self):
+        """Write unexpired entries to the persistence file"""
+        if not self.persist_path:
+            return
+        now = time.time()
+        payload = [
+            {
+                "key": key,
+                "group": entry["group"],
+                "response": entry["response"],
+                "embedding": entry["embedding"].tolist() if entry["embedding"] is not None else None,
+                "expires_at": entry["expires_at"]
+            }
+            for key, entry in self.entries.items()
+            if entry["expires_at"] > now
+        ]
+        os.makedirs(os.path.dirname(os.path.abspath(self.persist_path)), exist_ok=True)
+        temp_path = f"{self.persist_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(payload, file)
+        os.replace(temp_path, self.persist_path)
+
+    def load(self):
+        """Restore entries from the persistence file, oldest first"""
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as file:
+                payload = json.load(file)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for item in payload:
+            if item["expires_at"] <= now:
+                continue
+            embedding = np.asarray(item["embedding"], dtype=np.float32) if item["embedding"] is not None else None
+            size = len(json.dumps(item["response"])) + len(item["key"]) + (embedding.nbytes if embedding is not None else 0)
+            self.entries[item["key"]] = {
+                "group": item["group"],
+                "response": item["response"],
+                "embedding": embedding,
+                "size": size,
+                "expires_at": item["expires_at"]
+            }
+            self.groups.setdefault(item["group"], []).append(item["key"])
+            self.bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
@@ -0,0 +1,154 @@
+import copy
+import gc
+import importlib
+import logging
+import logging.config
+import os
+import signal
+import socket
+import time
+from typing import Dict
+
+import uvicorn
+
+from . import config
+from .document_processor import preload_embedding_model
+
+logger = logging.getLogger(__name__)
+
+
+def log_config() -> Dict:
+    """uvicorn's logging configuration, extended to this package's loggers"""
+    config_dict = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    config_dict["loggers"]["study_buddy"] = {"handlers": ["default"], "level": "INFO", "propagate": False}
+    return config_dict
+
+
+def _set_torch_threads(threads: int):
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+class PreforkServer:
+    """Serves an ASGI app from forked worker processes sharing one listening socket.
+
+    The parent imports the app and loads the embedding model before forking,
+    so the workers share those pages copy-on-write instead of each holding
+    a copy; torch runs single-threaded until then, because an OpenMP thread
+    pool does not survive fork. The workers build their components at
+    startup and share the on-disk stores under DATA_DIR. A worker that dies
+    is replaced; SIGINT or SIGTERM stops them all gracefully.
+    """
+
+    RESTART_DELAY_SECONDS = 1.0
+
+    def __init__(self, app: str, host: str = config.HOST, port: int = config.PORT,
+                 workers: int = config.WORKERS, worker_threads: int = config.WORKER_THREADS,
+                 graceful_timeout: float = 30.0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.worker_threads = worker_threads
+        self.graceful_timeout = graceful_timeout
+        self.children: Dict[int, float] = {}  # pid -> start time
+        self._stopping = False
+
+    def run(self):
+        """Preload, fork the workers and supervise them until told to stop"""
+        logging.config.dictConfig(log_config())
+        sock = self._bind()
+        self._preload()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self._handle_stop)
+        logger.info("Serving on %s:%d with %d workers", self.host, self.port, self.workers)
+        try:
+            while not self._stopping:
+                while len(self.children) < self.workers and not self._stopping:
+                    self._spawn(sock)
+                time.sleep(0.2)
+                self._reap()
+        finally:
+            self._stop_children()
+            sock.close()
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _preload(self):
+        _set_torch_threads(1)
+        importlib.import_module(self.app.split(":")[0])
+        preload_embedding_model()
+        # Move everything loaded so far out of the collector's reach, so
+        # collections in the workers do not write to (and copy) those pages
+        gc.freeze()
+
+    def _spawn(self, sock: socket.socket):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self._run_worker(sock)
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+                status = 1
+            finally:
+                os._exit(status)
+        self.children[pid] = time.monotonic()
+
+    def _run_worker(self, sock: socket.socket):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)
+        _set_torch_threads(self.worker_threads)
+        server = uvicorn.Server(uvicorn.Config(self.app, host=self.host, port=self.port, log_config=log_config()))
+        server.run(sockets=[sock])
+
+    def _reap(self):
+        """Collect exited workers; those that exit while serving are replaced"""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            logger.warning("Worker %d exited with status %d, restarting", pid, code)
+            if time.monotonic() - started < self.RESTART_DELAY_SECONDS:
+                # Do not spin when workers fail straight away
+                time.sleep(self.RESTART_DELAY_SECONDS)
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _stop_children(self):
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self._reap()
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.clear()
+
+
+def serve(app: str, workers: int = config.WORKERS):
+    """Run `app` ("module:attribute") in several worker processes"""
+    PreforkServer(app, workers=workers).run()
@@ -1,51 +1,98 @@
-from typing import Dict, Optional
+import os
+from typing import AsyncIterator, Dict, List, Optional
+from . import config
+from . import metrics
 from .llm_manager import LLMManager
 from .document_processor import DocumentProcessor
+from .executor import ServiceOverloadedError, get_io_pool
+from .json_stream import stream_events
+from .progress_store import DEFAULT_USER, ProgressStore
 
 class TeachingMode:
-    def __init__(self, llm_manager: LLMManager, document_processor: DocumentProcessor):
+    def __init__(self, llm_manager: LLMManager, document_processor: DocumentProcessor,
+                 progress_store: Optional[ProgressStore] = None):
         self.llm_manager = llm_manager
         self.document_processor = document_processor
-        self.user_badges = {}  # Track user badges per topic
+        # Track user badges per user and topic
+        self.progress_store = progress_store or ProgressStore(os.path.join(config.DATA_DIR, "progress.sqlite3"))
 
-    async def handle_request(self, topic: str, context: Optional[str] = None) -> Dict:
-        """Handle a teaching request for a specific topic"""
+    async def handle_request(self, topic: str, context: Optional[str] = None, user_id: str = DEFAULT_USER,
+                             document_id: Optional[str] = None, topic_filter: Optional[str] = None) -> Dict:
+        """Handle a teaching request for a specific topic.
+
+        `document_id` and `topic_filter` limit the notes searched for context.
+        """
         try:
-            # Get relevant context from uploaded notes
-            if not context:
-                context = await self.document_processor.get_relevant_context(topic)
-
-            # Generate teaching evaluation
-            response = await self.llm_manager.generate_response(
-                mode="teaching",
-                topic=topic,
-                context=context
-            )
+            with metrics.span("teaching"):
+                # Get relevant context from uploaded notes
+                scope = None
+                if not context:
+                    context = await self.document_processor.get_relevant_context(
+                        topic, self.llm_manager.context_budget("teaching", topic),
+                        document_id=document_id, user_id=user_id, topic_filter=topic_filter
+                    )
+                    scope = await get_io_pool().run(
+                        self.document_processor.retrieval_scope, document_id, user_id, topic_filter
+                    )
 
-            # Update user badges
-            self._update_badges(topic, response.get("badges", []))
+                # Generate teaching evaluation
+                topic_embedding = (await self.document_processor.embed([topic]))[0]
+                response = await self.llm_manager.generate_response(
+                    mode="teaching",
+                    topic=topic,
+                    context=context,
+                    topic_embedding=topic_embedding,
+                    cache_scope=scope
+                )
 
-            return {
-                "status": "success",
-                "content": response,
-                "badges": self.user_badges.get(topic, [])
-            }
+                # Update user badges
+                badges = await self._update_badges(user_id, topic, response.get("badges", []))
 
+                return {
+                    "status": "success",
+                    "content": response,
+                    "badges": badges
+                }
+
+        except ServiceOverloadedError:
+            raise
         except Exception as e:
             return {
                 "status": "error",
                 "message": str(e)
             }
 
-    def _update_badges(self, topic: str, new_badges: list):
-        """Update user badges for a topic"""
-        if topic not in self.user_badges:
-            self.user_badges[topic] = []
+    async def stream_request(self, topic: str, context: Optional[str] = None, user_id: str = DEFAULT_USER,
+                             document_id: Optional[str] = None,
+                             topic_filter: Optional[str] = None) -> AsyncIterator[Dict]:
+        """Stream a teaching evaluation as tokens and structured events"""
+        scope = None
+        if not context:
+            context = await self.document_processor.get_relevant_context(
+                topic, self.llm_manager.context_budget("teaching", topic),
+                document_id=document_id, user_id=user_id, topic_filter=topic_filter
+            )
+            scope = await get_io_pool().run(
+                self.document_processor.retrieval_scope, document_id, user_id, topic_filter
+            )
+
+        topic_embedding = (await self.document_processor.embed([topic]))[0]
+        tokens = self.llm_manager.stream_response(
+            mode="teaching",
+            topic=topic,
+            context=context,
+            topic_embedding=topic_embedding,
+            cache_scope=scope
+        )
+        with metrics.span("teaching_stream"):
+            async for event in stream_events(tokens):
+                if event["event"] == "done":
+                    event["badges"] = await self._update_badges(user_id, topic, event["content"].get("badges", []))
+                yield event
 
-        # Add new badges
-        for badge in new_badges:
-            if badge not in self.user_badges[topic]:
-                self.user_badges[topic].append(badge)
+    async def _update_badges(self, user_id: str, topic: str, new_badges: list) -> List[str]:
+        """Update user badges for a topic and return all of them"""
+        return await get_io_pool().run(self.progress_store.add_badges, user_id, topic, new_badges)
 
     def get_badge_criteria(self) -> Dict:
         """Return the criteria for earning different badges"""
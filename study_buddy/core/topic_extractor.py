@@ -0,0 +1,220 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .file_lock import FileLock
+
+TOPIC_LABEL_CHARS = 100  # A topic is named after the start of its most central chunk
+
+
+def squared_distances(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Squared euclidean distances between every point and every center"""
+    distances = (
+        np.einsum("ij,ij->i", points, points)[:, None]
+        - 2 * points @ centers.T
+        + np.einsum("ij,ij->i", centers, centers)[None, :]
+    )
+    return np.maximum(distances, 0, out=distances)
+
+
+class TopicExtractor:
+    """Names the main topics of a document by clustering its chunk embeddings.
+
+    Clustering is fitted with MiniBatchKMeans on at most `sample_size`
+    chunks; every chunk is then assigned, and each cluster's most central
+    chunk found, from one chunk-by-center distance matrix. The cost is
+    linear in the number of chunks past the sample size.
+    """
+
+    def __init__(self, max_topics: int = config.TOPIC_MAX_TOPICS, sample_size: int = config.TOPIC_SAMPLE_SIZE):
+        self.max_topics = max_topics
+        self.sample_size = sample_size
+
+    def extract(self, chunks: List[str], embeddings: np.ndarray) -> List[str]:
+        """Topic labels, largest cluster first"""
+        return self.extract_with_assignments(chunks, embeddings)[0]
+
+    def extract_with_assignments(self, chunks: List[str], embeddings: np.ndarray) -> Tuple[List[str], List[str]]:
+        """Topic labels, largest cluster first, and the label of every chunk's topic"""
+        if len(chunks) == 0:
+            return [], []
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        n_clusters = min(self.max_topics, len(chunks))
+        centers = self._fit(embeddings, n_clusters)
+
+        distances = squared_distances(embeddings, centers)
+        labels = np.argmin(distances, axis=1)
+        # Non-members are pushed to infinity so each column's minimum is a member
+        distances[labels[:, None] != np.arange(len(centers))[None, :]] = np.inf
+        sizes = np.bincount(labels, minlength=len(centers))
+        representatives = np.argmin(distances, axis=0)
+        names = [chunks[representative][:TOPIC_LABEL_CHARS] for representative in representatives]
+        topics = [names[cluster] for cluster in np.argsort(-sizes, kind="stable") if sizes[cluster] > 0]
+        return topics, [names[label] for label in labels]
+
+    def _fit(self, embeddings: np.ndarray, n_clusters: int) -> np.ndarray:
+        if n_clusters == len(embeddings):
+            return embeddings
+        from sklearn.cluster import MiniBatchKMeans
+
+        sample = embeddings
+        if len(embeddings) > self.sample_size:
+            rows = np.random.default_rng(0).choice(len(embeddings), self.sample_size, replace=False)
+            sample = embeddings[np.sort(rows)]
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=1024, n_init=3, random_state=0)
+        kmeans.fit(sample)
+        return kmeans.cluster_centers_.astype(np.float32)
+
+
+class TopicMap:
+    """Corpus-wide topics, updated incrementally as documents arrive.
+
+    A streaming k-means: each batch of new chunk embeddings is assigned to
+    the nearest centers, which then move to the running mean of everything
+    assigned to them so far. Centers are seeded from the first chunks seen,
+    farthest-first. Each center keeps the chunk closest to it as its label.
+    The map is saved as plain arrays, so it survives restarts. Processes
+    sharing the file take turns to update it and reload it when another
+    process has saved a newer version.
+    """
+
+    SEED_SAMPLE_SIZE = 4096
+
+    def __init__(self, path: Optional[str] = None, n_topics: int = config.TOPIC_MAP_SIZE):
+        self.path = path
+        self.n_topics = n_topics
+        self._lock = threading.Lock()
+        self.centers: Optional[np.ndarray] = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.label_vectors: Optional[np.ndarray] = None
+        self.labels: List[str] = []
+        self._file_lock = FileLock(f"{path}.lock") if path else None
+        self._loaded_version: Optional[Tuple[int, int, int]] = None
+        if path:
+            self.load()
+
+    def update(self, chunks: List[str], embeddings: np.ndarray):
+        """Fold a batch of new chunks into the map"""
+        if len(chunks) == 0:
+            return
+        if self._file_lock is None:
+            self._update(chunks, embeddings)
+            return
+        with self._file_lock.hold():
+            self.refresh()
+            self._update(chunks, embeddings)
+            self.save()
+
+    def _update(self, chunks: List[str], embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            self._seed(chunks, embeddings)
+
+            assignments = np.argmin(squared_distances(embeddings, self.centers), axis=1)
+            batch_counts = np.bincount(assignments, minlength=len(self.centers))
+            batch_sums = np.zeros_like(self.centers)
+            np.add.at(batch_sums, assignments, embeddings)
+            moved = batch_counts > 0
+            totals = self.counts + batch_counts
+            self.centers[moved] += (
+                batch_sums[moved] - batch_counts[moved, None] * self.centers[moved]
+            ) / totals[moved, None]
+            self.counts = totals
+
+            # Keep, per center, whichever of the old label and the new chunks is closest
+            label_distances = np.sum((self.label_vectors - self.centers) ** 2, axis=1)
+            distances = squared_distances(embeddings, self.centers)
+            distances[assignments[:, None] != np.arange(len(self.centers))[None, :]] = np.inf
+            best = np.argmin(distances, axis=0)
+            better = distances[best, np.arange(len(self.centers))] < label_distances
+            for cluster in np.flatnonzero(better):
+                self.labels[cluster] = chunks[best[cluster]][:TOPIC_LABEL_CHARS]
+                self.label_vectors[cluster] = embeddings[best[cluster]]
+
+    def _seed(self, chunks: List[str], embeddings: np.ndarray):
+        """Add centers from new chunks until the map has n_topics of them"""
+        if self.centers is None:
+            self.centers = np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+            self.label_vectors = np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+        missing = self.n_topics - len(self.centers)
+        if missing <= 0:
+            return
+        # Seeds are picked from a bounded sample so seeding stays cheap on large batches
+        pool = np.arange(len(embeddings))
+        if len(pool) > self.SEED_SAMPLE_SIZE:
+            pool = np.sort(np.random.default_rng(0).choice(pool, self.SEED_SAMPLE_SIZE, replace=False))
+        candidates = embeddings[pool]
+        nearest = (
+            squared_distances(candidates, self.centers).min(axis=1)
+            if len(self.centers) else np.full(len(candidates), np.inf, dtype=np.float32)
+        )
+        chosen = []
+        for _ in range(min(missing, len(candidates))):
+            candidate = int(np.argmax(nearest))
+            if nearest[candidate] <= 1e-12:
+                break
+            chosen.append(int(pool[candidate]))
+            nearest = np.minimum(nearest, squared_distances(candidates, candidates[candidate:candidate + 1])[:, 0])
+        if not chosen:
+            return
+        # Seeds start with zero weight; the assignment step gives them their chunks
+        self.centers = np.vstack([self.centers, embeddings[chosen]])
+        self.label_vectors = np.vstack([self.label_vectors, embeddings[chosen]])
+        self.counts = np.concatenate([self.counts, np.zeros(len(chosen), dtype=np.int64)])
+        self.labels.extend(chunks[i][:TOPIC_LABEL_CHARS] for i in chosen)
+
+    def topics(self, limit: Optional[int] = None) -> List[Dict]:
+        """Topics with the number of chunks assigned to them, largest first"""
+        self.refresh()
+        with self._lock:
+            order = np.argsort(-self.counts, kind="stable")
+            return [
+                {"topic": self.labels[cluster], "chunks": int(self.counts[cluster])}
+                for cluster in order[:limit]
+            ]
+
+    def save(self):
+        """Write the map atomically to its file"""
+        with self._lock:
+            if self.centers is None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.tmp.npz"
+            np.savez(
+                temp_path,
+                centers=self.centers,
+                counts=self.counts,
+                label_vectors=self.label_vectors,
+                labels=np.array(self.labels, dtype=str)
+            )
+            os.replace(temp_path, self.path)
+            self._loaded_version = self._file_version()
+
+    def load(self):
+        """Restore the map saved by `save`, if any"""
+        with self._lock:
+            self._loaded_version = self._file_version()
+            try:
+                with np.load(self.path) as data:
+                    self.centers = data["centers"]
+                    self.counts = data["counts"]
+                    self.label_vectors = data["label_vectors"]
+                    self.labels = [str(label) for label in data["labels"]]
+            except (OSError, KeyError, ValueError):
+                pass
+
+    def refresh(self):
+        """Reload the map if another process has saved it since it was last read"""
+        if self.path and self._file_version() != self._loaded_version:
+            self.load()
+
+    def _file_version(self) -> Optional[Tuple[int, int, int]]:
+        # Every save replaces the file, so the inode changes even within one mtime tick
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
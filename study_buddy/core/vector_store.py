@@ -0,0 +1,668 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .file_lock import FileLock
+
+# Metadata keys copied into indexed columns, so searches can be restricted by them
+FILTER_COLUMNS = ("source_id", "user_id", "topic")
+# Filter columns that never change for a row (the chunk ID includes the source), kept in memory per row
+ROW_COLUMNS = ("source_id", "user_id")
+
+
+def filter_clause(where: Dict, prefix: str = "") -> Tuple[str, List]:
+    """SQL condition and parameters for a metadata filter.
+
+    `where` maps filter columns to a value or a list of accepted values.
+    """
+    clauses, params = [], []
+    for column, value in where.items():
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"Cannot filter on {column}")
+        values = list(value) if isinstance(value, (list, tuple, set, frozenset)) else [value]
+        clauses.append(f"{prefix}{column} IN ({','.join('?' * len(values))})")
+        params.extend(values)
+    return " AND ".join(clauses) or "1", params
+
+
+class _StaleSnapshot(Exception):
+    """The rows being read were renumbered by a compaction in another process"""
+
+
+class VectorStore:
+    """Persistent chunk store with memory-mapped embeddings.
+
+    Embeddings live in one contiguous, row-major file of unit-length float32
+    (or float16) vectors that is memory-mapped rather than loaded, so opening
+    the store costs the same for ten chunks as for a million. Chunk text and
+    metadata live in SQLite next to it, keyed by the vector's row number.
+
+    Appends write the vectors first and only then commit the rows in SQLite;
+    a crash in between leaves an uncommitted tail that is truncated on the
+    next write. Deletes only mark rows, and `compact` rewrites the vector file
+    under a new generation number once the SQLite remap has committed.
+
+    Search is either exact ("brute") or an inverted-file index ("ivf") that
+    only scores the rows in the clusters nearest to the query. A metadata
+    filter narrows the rows scored to those matching it. The document and
+    owner of every row are kept in memory next to the deletion mask, so
+    filtering by them is a numpy mask; topics, which change with a new
+    document version, are looked up through an SQLite index. A filter that
+    leaves few rows scores those alone, otherwise it masks either search.
+
+    Several processes can share one store. Writes hold a lock file in the
+    index directory and start by catching up with the latest committed
+    state; reads compare SQLite's data version with the last one seen and
+    reload the row count, deletions and vector file generation when another
+    process has committed since. The vector file itself is shared through
+    the page cache.
+    """
+
+    SEARCH_BLOCK_ROWS = 65536
+
+    def __init__(self, directory: str, dim: Optional[int] = None, dtype: str = "float32",
+                 search_mode: str = "brute", ivf_min_rows: int = 10000, ivf_nprobe: int = 8):
+        self.directory = directory
+        self.search_mode = search_mode
+        self.ivf_min_rows = ivf_min_rows
+        self.ivf_nprobe = ivf_nprobe
+        self._lock = threading.RLock()
+        self._write_lock = FileLock(os.path.join(directory, "write.lock"))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._write_lock.hold():
+            self._conn = sqlite3.connect(
+                os.path.join(directory, "chunks.sqlite3"), check_same_thread=False, timeout=30
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    row INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL,
+                    source_id TEXT,
+                    user_id TEXT NOT NULL DEFAULT 'default',
+                    topic TEXT,
+                    document TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    deleted INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                """
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+            if "user_id" not in columns:
+                # Indexes written before filters existed belong to the default user
+                self._conn.execute("ALTER TABLE chunks ADD COLUMN user_id TEXT NOT NULL DEFAULT 'default'")
+            if "topic" not in columns:
+                self._conn.execute("ALTER TABLE chunks ADD COLUMN topic TEXT")
+            self._conn.executescript(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS chunks_live_id ON chunks (id) WHERE deleted = 0;
+                CREATE INDEX IF NOT EXISTS chunks_source_id ON chunks (source_id);
+                CREATE INDEX IF NOT EXISTS chunks_user_id ON chunks (user_id);
+                CREATE INDEX IF NOT EXISTS chunks_topic ON chunks (topic);
+                """
+            )
+            self._conn.commit()
+
+            stored = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+            self.dim = int(stored["dim"]) if "dim" in stored else dim
+            self.dtype = np.dtype(stored.get("dtype", dtype))
+            self._generation = int(stored.get("generation", 0))
+            self._rows = int(stored.get("rows", 0))
+            if "dtype" not in stored:
+                self._set_meta(dtype=self.dtype.name, generation=self._generation, rows=self._rows)
+                self._conn.commit()
+
+            # Only safe under the write lock: a compaction elsewhere may be writing the next generation
+            self._remove_stale_generations()
+            self._data_version = self._read_data_version()
+            self._live = self._load_live()
+            self._row_codes: Dict[str, Dict[Optional[str], int]] = {column: {} for column in ROW_COLUMNS}
+            self._row_values = {column: np.zeros(0, dtype=np.int32) for column in ROW_COLUMNS}
+            self._load_row_values()
+            self._matrix: Optional[np.ndarray] = None
+            self._ivf_centroids: Optional[np.ndarray] = None
+            self._ivf_assignments: Optional[np.ndarray] = None
+            self._ivf_trained_rows = 0
+            self._load_ivf()
+
+    # Files
+
+    @property
+    def _vector_path(self) -> str:
+        return os.path.join(self.directory, f"vectors.{self._generation}.bin")
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    def _remove_stale_generations(self):
+        """Delete vector files left behind by interrupted or finished compactions"""
+        for path in glob.glob(os.path.join(self.directory, "vectors.*.bin")):
+            if path != self._vector_path:
+                os.remove(path)
+
+    def _set_meta(self, **values):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in values.items()]
+        )
+
+    def _matrix_view(self) -> np.ndarray:
+        """Memory-mapped view of all committed rows"""
+        if self._matrix is None or self._matrix.shape[0] != self._rows:
+            if self._rows == 0:
+                self._matrix = np.zeros((0, self.dim or 0), dtype=self.dtype)
+            else:
+                try:
+                    self._matrix = np.memmap(
+                        self._vector_path, dtype=self.dtype, mode="r", shape=(self._rows, self.dim)
+                    )
+                except FileNotFoundError:
+                    # Compacted away by another process since the last sync
+                    raise _StaleSnapshot()
+        return self._matrix
+
+    # Sharing between processes
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load_live(self) -> np.ndarray:
+        live = np.ones(self._rows, dtype=bool)
+        for (row,) in self._conn.execute("SELECT row FROM chunks WHERE deleted = 1"):
+            if row < self._rows:
+                live[row] = False
+        return live
+
+    def _load_row_values(self):
+        """Read the in-memory filter values of the rows added since the last call"""
+        start = len(self._row_values[ROW_COLUMNS[0]])
+        if start >= self._rows:
+            return
+        self._append_row_values(self._conn.execute(
+            f"SELECT {', '.join(ROW_COLUMNS)} FROM chunks WHERE row >= ? AND row < ? ORDER BY row",
+            (start, self._rows)
+        ).fetchall())
+
+    def _append_row_values(self, records: Sequence[Tuple]):
+        for column, values in zip(ROW_COLUMNS, zip(*records)):
+            codes = self._row_codes[column]
+            self._row_values[column] = np.concatenate([
+                self._row_values[column],
+                np.array([codes.setdefault(value, len(codes)) for value in values], dtype=np.int32)
+            ])
+
+    def _row_mask(self, column: str, accepted) -> Optional[np.ndarray]:
+        """Mask of the rows whose value in a row column is accepted, or None when that is every row"""
+        accepted = set(accepted) if isinstance(accepted, (list, tuple, set, frozenset)) else {accepted}
+        codes = self._row_codes[column]
+        if set(codes) <= accepted:
+            return None
+        return np.isin(self._row_values[column], [codes[value] for value in accepted if value in codes])
+
+    def _sync(self):
+        """Catch up with writes committed by other processes since the last call"""
+        with self._lock:
+            version = self._read_data_version()
+            if version == self._data_version:
+                return
+            stored = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+            if "dim" in stored:
+                self.dim = int(stored["dim"])
+            generation = int(stored.get("generation", 0))
+            if generation != self._generation:
+                self._matrix = None
+                self._row_values = {column: values[:0] for column, values in self._row_values.items()}
+            self._generation = generation
+            self._rows = int(stored.get("rows", 0))
+            self._live = self._load_live()
+            self._load_row_values()
+            self._load_ivf()
+            self._data_version = version
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """Exclusive write access across processes, starting from the latest committed state"""
+        with self._write_lock.hold():
+            with self._lock:
+                self._sync()
+                yield
+
+    # Writes
+
+    def add(self, ids: List[str], embeddings: np.ndarray, documents: List[str], metadatas: List[Dict]):
+        """Append chunks; existing IDs are replaced"""
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.where(norms == 0, 1, norms)).astype(self.dtype)
+        with self._writing():
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_meta(dim=self.dim)
+            self.delete(ids)
+
+            start = self._rows
+            with open(self._vector_path, "ab") as file:
+                # Drop any tail written by an append that never committed
+                file.truncate(start * self._row_bytes)
+                file.write(vectors.tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, id, source_id, user_id, topic, document, metadata) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (start + offset, chunk_id, *self._filter_values(metadata), document, json.dumps(metadata))
+                        for offset, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas))
+                    ]
+                )
+                self._set_meta(rows=start + len(ids))
+            self._rows = start + len(ids)
+            self._live = np.concatenate([self._live, np.ones(len(ids), dtype=bool)])
+            self._append_row_values([
+                (metadata.get("source_id"), metadata.get("user_id", "default")) for metadata in metadatas
+            ])
+            if self._ivf_centroids is not None:
+                self._ivf_assignments = np.concatenate([
+                    self._ivf_assignments, self._nearest_centroids(vectors.astype(np.float32))
+                ])
+                self._save_ivf()
+
+    def delete(self, ids: Sequence[str]):
+        """Mark chunks as deleted; space is reclaimed by `compact`"""
+        if not ids:
+            return
+        with self._writing():
+            rows = self._rows_for(ids)
+            if not rows:
+                return
+            with self._conn:
+                self._conn.executemany("UPDATE chunks SET deleted = 1 WHERE row = ?", [(row,) for row in rows])
+            self._live[rows] = False
+
+    def update_metadata(self, ids: Sequence[str], metadatas: List[Dict]):
+        """Replace the metadata of existing chunks"""
+        with self._writing():
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE chunks SET metadata = ?, source_id = ?, user_id = ?, topic = ? "
+                    "WHERE id = ? AND deleted = 0",
+                    [(json.dumps(metadata), *self._filter_values(metadata), chunk_id)
+                     for chunk_id, metadata in zip(ids, metadatas)]
+                )
+
+    @staticmethod
+    def _filter_values(metadata: Dict) -> Tuple:
+        return metadata.get("source_id"), metadata.get("user_id", "default"), metadata.get("topic")
+
+    def compact_if_fragmented(self, min_dead_fraction: float = 0.5, min_dead_rows: int = 1000):
+        """Compact once deleted rows make up a large part of the vector file"""
+        with self._writing():
+            dead = self._rows - self.count()
+            if dead >= min_dead_rows and dead >= min_dead_fraction * self._rows:
+                self.compact()
+
+    def compact(self):
+        """Rewrite the vector file without deleted rows"""
+        with self._writing():
+            live_rows = np.flatnonzero(self._live)
+            if len(live_rows) == self._rows:
+                return
+            matrix = self._matrix_view()
+            next_generation = self._generation + 1
+            next_path = os.path.join(self.directory, f"vectors.{next_generation}.bin")
+            with open(next_path, "wb") as file:
+                for offset in range(0, len(live_rows), self.SEARCH_BLOCK_ROWS):
+                    file.write(np.ascontiguousarray(matrix[live_rows[offset:offset + self.SEARCH_BLOCK_ROWS]]).tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+            assignments = None
+            if self._ivf_assignments is not None:
+                # Saved first, tagged with the new generation: readers that see
+                # the commit find an index that already matches it
+                assignments = self._ivf_assignments[live_rows]
+                self._save_ivf(assignments, next_generation)
+
+            with self._conn:
+                self._conn.execute("DELETE FROM chunks WHERE deleted = 1")
+                # Ascending order never collides: each target row is already free
+                self._conn.executemany(
+                    "UPDATE chunks SET row = ? WHERE row = ?",
+                    [(new_row, int(old_row)) for new_row, old_row in enumerate(live_rows)]
+                )
+                self._set_meta(generation=next_generation, rows=len(live_rows))
+
+            old_path = self._vector_path
+            self._matrix = None
+            self._generation = next_generation
+            self._rows = len(live_rows)
+            self._live = np.ones(self._rows, dtype=bool)
+            self._row_values = {column: values[live_rows] for column, values in self._row_values.items()}
+            self._ivf_assignments = assignments
+            os.remove(old_path)
+
+    # Reads
+
+    def count(self) -> int:
+        with self._lock:
+            self._sync()
+            return int(self._live.sum())
+
+    def version(self) -> str:
+        """Changes whenever chunks are added, deleted or compacted, in any process"""
+        with self._lock:
+            self._sync()
+            return f"{self._generation}.{self._rows}.{int(self._live.sum())}"
+
+    def contains(self, where: Dict) -> bool:
+        """Whether any live chunk matches `where` (see `filter_clause`)"""
+        where = dict(where)
+        row_filters = {column: where.pop(column) for column in ROW_COLUMNS if column in where}
+        with self._lock:
+            self._sync()
+            live = self._live
+            masks = [self._row_mask(column, accepted) for column, accepted in row_filters.items()]
+            live = np.logical_and.reduce([live, *(mask for mask in masks if mask is not None)])
+            if not where:
+                return bool(live.any())
+            allowed = self._matching_rows(where, self._rows)
+        return bool(live[allowed].any())
+
+    def query(self, embedding: Sequence[float], n_results: int = 3, mode: Optional[str] = None,
+              include_vectors: bool = False, where: Optional[Dict] = None) -> List[Dict]:
+        """Return the n most similar live chunks, best first.
+
+        `where` restricts the search to chunks whose metadata matches it
+        (see `filter_clause`).
+        """
+        try:
+            return self._query(embedding, n_results, mode, include_vectors, where)
+        except _StaleSnapshot:
+            # Another process compacted the index mid-query; search the new generation
+            return self._query(embedding, n_results, mode, include_vectors, where)
+
+    def _query(self, embedding: Sequence[float], n_results: int, mode: Optional[str],
+               include_vectors: bool, where: Optional[Dict]) -> List[Dict]:
+        where = dict(where or {})
+        row_filters = {column: where.pop(column) for column in ROW_COLUMNS if column in where}
+        with self._lock:
+            self._sync()
+            matrix = self._matrix_view()
+            live = self._live
+            rows = self._rows
+            generation = self._generation
+            masks = [self._row_mask(column, accepted) for column, accepted in row_filters.items()]
+            allowed = self._matching_rows(where, rows) if where else None
+        if rows == 0 or not live.any():
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        mode = mode or self.search_mode
+        if allowed is not None:
+            mask = np.zeros(rows, dtype=bool)
+            mask[allowed] = True
+            masks.append(mask)
+        masks = [mask for mask in masks if mask is not None]
+        candidates = None
+        if masks:
+            live = np.logical_and.reduce([live, *masks])
+            selected = np.flatnonzero(live)
+            if len(selected) == 0:
+                return []
+            # Few matching rows are scored alone, exactly; many are masked in a full search
+            if len(selected) < (self.ivf_min_rows if mode == "ivf" else rows // 4):
+                candidates = selected
+        if candidates is None and mode == "ivf" and self.count() >= self.ivf_min_rows:
+            candidates = self._ivf_candidates(query, live)
+        if candidates is not None:
+            scores = self._score_rows(matrix, candidates, query)
+            rows_out, scores_out = self._top_k(candidates, scores, n_results)
+        else:
+            rows_out, scores_out = self._brute_force(matrix, live, query, n_results)
+        results = self._fetch(rows_out, scores_out, generation)
+        if include_vectors:
+            self._attach_vectors(matrix, results)
+        return results
+
+    def get(self, ids: Sequence[str], include_vectors: bool = False) -> List[Dict]:
+        """Live chunks with the given IDs, in row order; unknown IDs are skipped"""
+        try:
+            return self._get(ids, include_vectors)
+        except _StaleSnapshot:
+            return self._get(ids, include_vectors)
+
+    def _get(self, ids: Sequence[str], include_vectors: bool) -> List[Dict]:
+        with self._lock:
+            self._sync()
+            matrix = self._matrix_view()
+            generation = self._generation
+            # Rows committed by another process since the sync are not in the matrix yet
+            rows = np.array(sorted(row for row in self._rows_for(ids) if row < self._rows), dtype=np.int64)
+        results = self._fetch(rows, np.zeros(len(rows), dtype=np.float32), generation)
+        if include_vectors:
+            self._attach_vectors(matrix, results)
+        return results
+
+    def iter_chunks(self, batch_size: int = 1000) -> Iterator[List[Dict]]:
+        """Every live chunk's ID, text and metadata, in batches"""
+        last_row = -1
+        while True:
+            with self._lock:
+                batch = self._conn.execute(
+                    "SELECT row, id, document, metadata FROM chunks WHERE deleted = 0 AND row > ? "
+                    "ORDER BY row LIMIT ?",
+                    (last_row, batch_size)
+                ).fetchall()
+            if not batch:
+                return
+            last_row = batch[-1][0]
+            yield [
+                {"id": chunk_id, "document": document, "metadata": json.loads(metadata)}
+                for _, chunk_id, document, metadata in batch
+            ]
+
+    def _matching_rows(self, where: Dict, rows: int) -> np.ndarray:
+        """Live rows below `rows` whose filter columns match `where`"""
+        clause, params = filter_clause(where)
+        matching = np.fromiter(
+            (row for (row,) in self._conn.execute(
+                f"SELECT row FROM chunks WHERE deleted = 0 AND {clause}", params
+            )),
+            dtype=np.int64
+        )
+        return matching[matching < rows]
+
+    @staticmethod
+    def _attach_vectors(matrix: np.ndarray, results: List[Dict]):
+        if results:
+            vectors = np.asarray(matrix[[result["row"] for result in results]], dtype=np.float32)
+            for result, vector in zip(results, vectors):
+                result["vector"] = vector
+
+    def _brute_force(self, matrix: np.ndarray, live: np.ndarray, query: np.ndarray, k: int):
+        """Exact top-k over all live rows, scored block by block"""
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, matrix.shape[0], self.SEARCH_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + self.SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores = block @ query
+            scores[~live[start:start + len(block)]] = -np.inf
+            rows, scores = self._top_k(np.arange(start, start + len(block)), scores, k)
+            best_rows, best_scores = self._top_k(
+                np.concatenate([best_rows, rows]), np.concatenate([best_scores, scores]), k
+            )
+        keep = np.isfinite(best_scores)
+        return best_rows[keep], best_scores[keep]
+
+    def _score_rows(self, matrix: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.SEARCH_BLOCK_ROWS):
+            block = rows[start:start + self.SEARCH_BLOCK_ROWS]
+            scores[start:start + len(block)] = np.asarray(matrix[block], dtype=np.float32) @ query
+        return scores
+
+    @staticmethod
+    def _top_k(rows: np.ndarray, scores: np.ndarray, k: int):
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores)
+        return rows[order], scores[order]
+
+    def _fetch(self, rows: np.ndarray, scores: np.ndarray, generation: int) -> List[Dict]:
+        """Chunks at the given rows, provided they still belong to `generation`"""
+        if len(rows) == 0:
+            return []
+        row_list = [int(row) for row in rows]
+        placeholders = ",".join("?" * len(row_list))
+        with self._lock:
+            # The generation is read in the same statement, so from the same snapshot as the rows
+            found = self._conn.execute(
+                f"SELECT row, id, document, metadata, deleted, (SELECT value FROM meta WHERE key = 'generation') "
+                f"FROM chunks WHERE row IN ({placeholders})",
+                row_list
+            ).fetchall()
+            generations = {int(record[5]) for record in found}
+            if len(found) < len(row_list):
+                current = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+                generations.add(int(current[0]))
+        if generations - {generation}:
+            raise _StaleSnapshot()
+        # Rows deleted by another process since the last sync are skipped
+        records = {
+            row: (chunk_id, document, metadata)
+            for row, chunk_id, document, metadata, deleted, _ in found if not deleted
+        }
+        results = []
+        for row, score in zip(row_list, scores):
+            if row in records:
+                chunk_id, document, metadata = records[row]
+                results.append({
+                    "id": chunk_id,
+                    "row": row,
+                    "document": document,
+                    "metadata": json.loads(metadata),
+                    "score": float(score)
+                })
+        return results
+
+    def _rows_for(self, ids: Sequence[str]) -> List[int]:
+        rows = []
+        ids = list(ids)
+        for offset in range(0, len(ids), 500):
+            batch = ids[offset:offset + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(row for (row,) in self._conn.execute(
+                f"SELECT row FROM chunks WHERE deleted = 0 AND id IN ({placeholders})", batch
+            ))
+        return rows
+
+    # Inverted-file index
+
+    @property
+    def _ivf_path(self) -> str:
+        return os.path.join(self.directory, "ivf.npz")
+
+    def build_ivf(self, n_lists: Optional[int] = None, sample_size: int = 20000):
+        """Cluster a sample of the vectors and assign every row to its nearest centroid"""
+        from sklearn.cluster import MiniBatchKMeans
+
+        with self._writing():
+            matrix = self._matrix_view()
+            live_rows = np.flatnonzero(self._live)
+            if len(live_rows) == 0:
+                return
+            n_lists = n_lists or int(np.clip(np.sqrt(len(live_rows)), 16, 4096))
+            n_lists = min(n_lists, len(live_rows))
+            sample = np.random.default_rng(0).choice(live_rows, min(sample_size, len(live_rows)), replace=False)
+            kmeans = MiniBatchKMeans(n_clusters=n_lists, n_init=3, random_state=0)
+            kmeans.fit(np.asarray(matrix[np.sort(sample)], dtype=np.float32))
+            centroids = kmeans.cluster_centers_.astype(np.float32)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+            self._ivf_centroids = centroids
+            self._ivf_assignments = self._assign_rows(matrix, 0)
+            self._ivf_trained_rows = len(live_rows)
+            self._save_ivf()
+            # A commit moves the data version, so other processes reload the new index
+            with self._conn:
+                self._set_meta(ivf_trained_rows=self._ivf_trained_rows)
+
+    def _assign_rows(self, matrix: np.ndarray, start: int) -> np.ndarray:
+        """Nearest centroid of every row from `start` on"""
+        assignments = np.empty(matrix.shape[0] - start, dtype=np.int32)
+        for offset in range(start, matrix.shape[0], self.SEARCH_BLOCK_ROWS):
+            block = np.asarray(matrix[offset:offset + self.SEARCH_BLOCK_ROWS], dtype=np.float32)
+            assignments[offset - start:offset - start + len(block)] = self._nearest_centroids(block)
+        return assignments
+
+    def _nearest_centroids(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._ivf_centroids.T, axis=1).astype(np.int32)
+
+    def _ivf_stale(self) -> bool:
+        # Retrain once the index has fallen far behind the corpus
+        return self._ivf_centroids is None or self.count() > 4 * max(self._ivf_trained_rows, 1)
+
+    def _ivf_candidates(self, query: np.ndarray, live: np.ndarray) -> np.ndarray:
+        """Live rows in the clusters closest to the query"""
+        with self._lock:
+            stale = self._ivf_stale()
+        if stale:
+            # The write lock is taken before the store lock, never while holding it
+            with self._writing():
+                if self._ivf_stale():
+                    self.build_ivf()
+        with self._lock:
+            centroids = self._ivf_centroids
+            assignments = self._ivf_assignments
+        probes = np.argsort(-(centroids @ query))[:self.ivf_nprobe]
+        covered = min(len(assignments), len(live))
+        return np.flatnonzero(np.isin(assignments[:covered], probes) & live[:covered])
+
+    def _save_ivf(self, assignments: Optional[np.ndarray] = None, generation: Optional[int] = None):
+        temp_path = f"{self._ivf_path}.tmp.npz"
+        np.savez(temp_path, centroids=self._ivf_centroids,
+                 assignments=self._ivf_assignments if assignments is None else assignments,
+                 trained_rows=np.array([self._ivf_trained_rows]),
+                 generation=np.array([self._generation if generation is None else generation]))
+        os.replace(temp_path, self._ivf_path)
+
+    def _load_ivf(self):
+        """Load the saved index, assigning any rows it does not cover yet"""
+        try:
+            with np.load(self._ivf_path) as data:
+                centroids = data["centroids"]
+                assignments = data["assignments"]
+                trained_rows = int(data["trained_rows"][0])
+                generation = int(data["generation"][0]) if "generation" in data.files else self._generation
+        except (OSError, KeyError, ValueError):
+            return
+        if generation != self._generation or len(assignments) > self._rows:
+            # Saved for another generation (e.g. an interrupted compaction): keep the centroids only
+            assignments = assignments[:0]
+        self._ivf_centroids = centroids
+        self._ivf_trained_rows = trained_rows
+        if len(assignments) < self._rows:
+            # Rows appended after the file was saved, possibly by another process
+            assignments = np.concatenate([assignments, self._assign_rows(self._matrix_view(), len(assignments))])
+        self._ivf_assignments = assignments
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
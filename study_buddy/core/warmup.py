@@ -0,0 +1,61 @@
+import time
+from typing import Dict, Optional
+
+from . import config, ocr
+from .document_processor import DocumentProcessor
+from .executor import get_io_pool, get_ocr_pool
+from .llm_manager import LLMManager
+
+
+class WarmUp:
+    """Preloads heavy components after startup and tracks readiness.
+
+    Each step records its status ("pending", "ready", "skipped" or
+    "failed: <reason>") and duration. The service counts as ready once no
+    step is pending; a failed LLM warm-up does not block readiness because
+    the model is still loaded on the first request.
+    """
+
+    def __init__(self, document_processor: DocumentProcessor, llm_manager: LLMManager):
+        self.document_processor = document_processor
+        self.llm_manager = llm_manager
+        self.enabled = config.WARMUP_ENABLED
+        self.steps: Dict[str, Dict] = {
+            name: {"status": "pending" if self.enabled else "skipped", "seconds": None}
+            for name in ("embeddings", "ocr", "llm")
+        }
+        if self.enabled and not config.WARMUP_LLM:
+            self.steps["llm"]["status"] = "skipped"
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return all(step["status"] != "pending" for step in self.steps.values())
+
+    async def run(self):
+        """Run every pending warm-up step"""
+        self.started_at = time.time()
+        await self._step("embeddings", get_io_pool().run, self.document_processor.warm_up)
+        await self._step("ocr", get_ocr_pool().run, ocr.warm_up, config.OCR_ENGINE)
+        await self._step("llm", self.llm_manager.warm_up)
+        self.finished_at = time.time()
+
+    async def _step(self, name: str, fn, *args):
+        if self.steps[name]["status"] != "pending":
+            return
+        start = time.perf_counter()
+        try:
+            await fn(*args)
+            self.steps[name]["status"] = "ready"
+        except Exception as e:
+            self.steps[name]["status"] = f"failed: {str(e)}"
+        self.steps[name]["seconds"] = round(time.perf_counter() - start, 3)
+
+    def status(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "steps": self.steps,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
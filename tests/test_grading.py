@@ -0,0 +1,53 @@
+import unittest
+
+from study_buddy.core.grading import grade_closed_form
+
+
+def grade(question, answer):
+    """is_correct of the local verdict, or None when it is left to the LLM"""
+    evaluation = grade_closed_form(question, answer)
+    return None if evaluation is None else evaluation["is_correct"]
+
+
+class MultipleChoiceGradingTest(unittest.TestCase):
+    def test_number_is_not_a_position_when_options_are_numeric(self):
+        question = {"type": "multiple_choice", "options": ["10", "20", "30"], "correct_answer": "20"}
+        self.assertIsNone(grade(question, "2"))
+        self.assertTrue(grade(question, "20"))
+        self.assertTrue(grade(question, "b"))
+        self.assertFalse(grade(question, "30"))
+
+    def test_number_is_a_position_when_options_are_text(self):
+        question = {"type": "multiple_choice", "options": ["A) red", "B) blue"], "correct_answer": "B"}
+        self.assertTrue(grade(question, "2"))
+        self.assertTrue(grade(question, "blue"))
+        self.assertFalse(grade(question, "1"))
+
+    def test_free_text_answer_is_left_to_the_llm(self):
+        question = {"type": "multiple_choice", "options": ["Nucleus", "Mitochondria"], "correct_answer": "Mitochondria"}
+        self.assertIsNone(grade(question, "The mitochondria"))
+        self.assertIsNone(grade(question, "I think it is the powerhouse"))
+        self.assertTrue(grade(question, "mitochondria."))
+        self.assertFalse(grade(question, "Nucleus"))
+
+
+class TrueFalseGradingTest(unittest.TestCase):
+    question = {"type": "true_false", "correct_answer": "False"}
+
+    def test_leading_word(self):
+        self.assertTrue(grade(self.question, "false"))
+        self.assertTrue(grade(self.question, "No, it is not"))
+        self.assertFalse(grade(self.question, "True"))
+
+    def test_verdict_later_in_the_answer(self):
+        self.assertTrue(grade(self.question, "I think false"))
+        self.assertFalse(grade(self.question, "I'd say it's true"))
+
+    def test_unclear_answer_is_left_to_the_llm(self):
+        self.assertIsNone(grade(self.question, "I don't know"))
+        self.assertIsNone(grade(self.question, "It is not true"))
+        self.assertIsNone(grade(self.question, "Partly true, partly false"))
+
+
+if __name__ == "__main__":
+    unittest.main()
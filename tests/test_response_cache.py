@@ -0,0 +1,77 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from study_buddy.core import config
+from study_buddy.core.document_processor import DocumentProcessor
+from study_buddy.core.response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_entries=100, max_bytes=1 << 20, ttl_seconds=60, similarity_threshold=0.95)
+        self.topic = np.array([1.0, 0.2, 0.0], dtype=np.float32)
+        self.near_topic = np.array([1.0, 0.25, 0.02], dtype=np.float32)
+        self.response = {"explanation": "Plants turn light into sugar"}
+
+    def test_near_duplicate_topic_hits_within_scope(self):
+        # Each topic's wording retrieves (and budgets) a different context
+        self.cache.put("llama2", "learning", "photosynthesis", "context A", 0.7, self.response,
+                       self.topic, scope="notes-v1")
+        hit = self.cache.get("llama2", "learning", "what is photosynthesis", "context B", 0.7,
+                             self.near_topic, scope="notes-v1")
+        self.assertEqual(hit, self.response)
+        self.assertEqual(self.cache.stats()["semantic_hits"], 1)
+
+    def test_other_scope_misses(self):
+        self.cache.put("llama2", "learning", "photosynthesis", "context A", 0.7, self.response,
+                       self.topic, scope="notes-v1")
+        self.assertIsNone(self.cache.get("llama2", "learning", "what is photosynthesis", "context A", 0.7,
+                                         self.near_topic, scope="notes-v2"))
+
+    def test_given_context_must_match_without_scope(self):
+        self.cache.put("llama2", "learning", "photosynthesis", "context A", 0.7, self.response, self.topic)
+        self.assertIsNone(self.cache.get("llama2", "learning", "what is photosynthesis", "context B", 0.7,
+                                         self.near_topic))
+        self.assertEqual(self.cache.get("llama2", "learning", "what is photosynthesis", "context A", 0.7,
+                                        self.near_topic), self.response)
+
+
+class RetrievalScopeTest(unittest.TestCase):
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        with mock.patch.object(config, "DATA_DIR", data_dir.name):
+            self.processor = DocumentProcessor()
+            self.store = self.processor.vector_store
+        self.addCleanup(self.store.close)
+        self.cache = ResponseCache(max_entries=100, max_bytes=1 << 20, ttl_seconds=60, similarity_threshold=0.95)
+        self.add("shared-0", "shared", "default")
+
+    def add(self, chunk_id, source_id, user_id):
+        self.store.add([chunk_id], np.ones((1, 3), dtype=np.float32), ["Plants turn light into sugar"],
+                       [{"source_id": source_id, "user_id": user_id, "topic": "photosynthesis"}])
+
+    def test_users_without_private_notes_share_entries(self):
+        alice = self.processor.retrieval_scope("shared", "alice")
+        bob = self.processor.retrieval_scope("shared", "bob")
+        self.assertEqual(alice, bob)
+        response = {"explanation": "Plants turn light into sugar"}
+        self.cache.put("llama2", "learning", "what is photosynthesis", "context", 0.7, response, scope=alice)
+        self.assertEqual(self.cache.get("llama2", "learning", "what is photosynthesis", "context", 0.7,
+                                        scope=bob), response)
+        self.assertEqual(self.cache.stats()["exact_hits"], 1)
+
+    def test_private_notes_in_the_search_set_the_scope_apart(self):
+        self.add("alice-0", "alice-notes", "alice")
+        self.assertNotEqual(self.processor.retrieval_scope(None, "alice"),
+                            self.processor.retrieval_scope(None, "bob"))
+        # Alice's notes are outside a search of the shared document
+        self.assertEqual(self.processor.retrieval_scope("shared", "alice"),
+                         self.processor.retrieval_scope("shared", "bob"))
+
+
+if __name__ == "__main__":
+    unittest.main()